@@ -0,0 +1,163 @@
+"""
+Checkpoint storage benchmark for long HITL sessions.
+
+Runs one workflow per checkpointer with several regenerate loops and a
+few dozen render status polls, and compares time spent serializing
+checkpoints (put/put_writes) and the bytes kept for the thread:
+  - memory:   LangGraph's MemorySaver (every checkpoint kept)
+  - compact:  MemorySaver with the compressing CompactSerializer
+  - compacted: CompactingSaver (dedup + compaction + pruning)
+
+No external APIs are called: enhancement and rendering are stubbed out.
+
+Usage:
+    python bench_checkpoints.py [--regenerations 10] [--polls 30]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+# Keep the photo index out of the way - a reused result would skip the stubbed enhancement
+_scratch = tempfile.mkdtemp(prefix="bench_checkpoints_")
+os.environ["PHOTO_INDEX_PATH"] = os.path.join(_scratch, "photos.sqlite3")
+os.environ["LEDGER_ENABLED"] = "false"
+
+import numpy as np
+from PIL import Image
+from langgraph.checkpoint.memory import MemorySaver
+
+import nodes
+import photo_index
+from checkpoints import CompactSerializer, CompactingSaver, thread_stats
+from main import VideoGenerationWorkflow, new_thread_id, workflow_config
+from state import GraphState
+
+CHECKPOINTERS = {
+    "memory": lambda: MemorySaver(),
+    "compact": lambda: MemorySaver(serde=CompactSerializer()),
+    "compacted": lambda: CompactingSaver(),
+}
+
+
+def make_photos() -> dict:
+    photos = {}
+    for index in range(1, 6):
+        path = os.path.join(_scratch, f"photo_{index}.jpg")
+        pixels = np.random.default_rng(index).integers(40, 220, (640, 360, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(path)
+        photos[f"Photo-{index}"] = path
+    return photos
+
+
+def stub_providers(polls: int):
+    """Replaces enhancement and rendering with instant fakes that still change the state."""
+    counter = iter(range(1_000_000))
+    remaining = {}
+    attempts = {}
+
+    def enhance(placeholder, file_path, mode, prompt, token=None, aspect_ratio=None):
+        # Numbered per photo - the photo branches run in parallel, in no fixed order
+        attempts[placeholder] = attempts.get(placeholder, 0) + 1
+        return f"https://bench.invalid/{placeholder}/{attempts[placeholder]}.jpg", "model"
+
+    def submit(template_id, modifications, force=False, render_scale=None, backend=None):
+        render_id = f"local-bench-{next(counter)}"
+        remaining[render_id] = polls
+        return {"render_id": render_id, "status": "planned", "url": None}
+
+    def fetch(render_id):
+        remaining[render_id] -= 1
+        if remaining[render_id] > 0:
+            return {"status": "rendering", "url": None}
+        return {"status": "succeeded", "url": f"https://bench.invalid/{render_id}.mp4"}
+
+    nodes._enhance_with_mode = enhance
+    nodes._submit_render = submit
+    nodes._fetch_render = fetch
+    nodes.LOCAL_RENDER_POLL_INTERVAL = 0
+
+
+def timed(saver, totals: dict):
+    """Wraps the saver's write methods to add up the time spent in them."""
+    for name in ("put", "put_writes"):
+        method = getattr(saver, name)
+
+        def wrapper(*args, _method=method, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                totals["seconds"] += time.perf_counter() - start
+                totals["calls"] += 1
+        setattr(saver, name, wrapper)
+
+
+def run_session(name: str, photos: dict, regenerations: int, polls: int):
+    stub_providers(polls)
+    # A fresh photo index, so this session enhances the same photos the others did
+    photo_index._index = photo_index.PhotoIndex(os.path.join(_scratch, f"photos_{name}.sqlite3"))
+    saver = CHECKPOINTERS[name]()
+    totals = {"seconds": 0.0, "calls": 0}
+    timed(saver, totals)
+    graph = VideoGenerationWorkflow(checkpointer=saver).compile()
+
+    config = workflow_config(new_thread_id())
+    config["recursion_limit"] = 1000  # every status poll is a graph step
+    state = GraphState(template_id="benchmark-template", input_images=photos, render_backend="local")
+    start = time.perf_counter()
+    for _ in graph.stream(state.model_dump(), config):
+        pass
+    for loop in range(regenerations):
+        graph.update_state(config, {"rejected_images": [f"Photo-{loop % 5 + 1}"], "replacement_images": {},
+                                    "human_approval_received": False})
+        for _ in graph.stream(None, config):
+            pass
+    graph.update_state(config, {"rejected_images": [], "replacement_images": {}, "human_approval_received": True})
+    for _ in graph.stream(None, config):
+        pass
+    elapsed = time.perf_counter() - start
+
+    final = graph.get_state(config)
+    history = sum(1 for _ in graph.get_state_history(config))
+    stats = thread_stats(saver, config["configurable"]["thread_id"])
+    return saver, config, final.values, history, stats, totals, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--regenerations", type=int, default=10, help="Regenerate loops in the session")
+    parser.add_argument("--polls", type=int, default=30, help="Render status checks before it succeeds")
+    args = parser.parse_args()
+
+    photos = make_photos()
+
+    print(f"One session: {args.regenerations} regenerations, {args.polls} status polls\n")
+    print(f"{'checkpointer':<12} {'writes':>7} {'write ms':>9} {'us/write':>9} "
+          f"{'checkpoints':>12} {'stored KB':>10} {'total s':>8}")
+    print("-" * 74)
+
+    results = {}
+    for name in CHECKPOINTERS:
+        saver, config, values, history, stats, totals, elapsed = run_session(name, photos, args.regenerations,
+                                                                               args.polls)
+        results[name] = (saver, config, values, stats)
+        print(f"{name:<12} {totals['calls']:>7} {totals['seconds'] * 1000:>9.1f} "
+              f"{totals['seconds'] / max(totals['calls'], 1) * 1e6:>9.0f} "
+              f"{history:>12} {stats['bytes'] / 1000:>10.1f} {elapsed:>8.2f}")
+
+    baseline = results["memory"]
+    for name, (_, _, values, stats) in results.items():
+        if values != baseline[2]:
+            print(f"\nWARNING: final state from '{name}' differs from MemorySaver")
+    print(f"\nCompactingSaver keeps {baseline[3]['bytes'] / max(results['compacted'][3]['bytes'], 1):.1f}x "
+          f"fewer bytes for the thread.")
+
+    # The finished thread is pruned once its TTL has passed
+    saver, config, _, _ = results["compacted"]
+    saver.prune(now=time.time() + saver.finished_ttl + 1)
+    print(f"Threads left after pruning finished ones: {len(saver.storage)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Records a cassette of the full workflow for the replay regression test
+(tests/test_replay.py).
+
+`record` runs the compiled graph once against the real fal.ai and
+Creatomate APIs (keys from .env) and saves every external call - request,
+response and timing - plus the input photos into a cassette directory.
+Next to it, baseline.json keeps what the recorded run produced: wall time,
+calls per kind, the final state and the ledger rows. The test replays the
+cassette offline and checks the workflow still gets there with the same
+calls, and - replayed at the recorded latencies - no slower.
+
+Approval steps are answered automatically (everything approved).
+
+Usage:
+    python bench_replay.py record --cassette DIR --photos DIR [--template ID] [--draft]
+    python -m pytest tests/test_replay.py
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict
+
+from cassettes import Cassette, RECORD
+
+BASELINE_FILE = "baseline.json"
+INPUTS_DIR = "inputs"
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png")
+MAX_RESUMES = 20
+
+# Final state fields the replay test compares with the recording
+BASELINE_FIELDS = ("render_status", "final_video_url", "final_video_urls", "processed_image_urls", "payload_errors")
+
+
+def run_workflow(graph, initial_state: dict, thread_id: str) -> dict:
+    """Runs a workflow to the end, approving every photo and draft along the way."""
+    config = {"configurable": {"thread_id": thread_id}}
+    graph_input = initial_state
+    for _ in range(MAX_RESUMES):
+        for _ in graph.stream(graph_input, config):
+            pass
+        snapshot = graph.get_state(config)
+        if not snapshot.next:
+            return snapshot.values
+        if snapshot.values.get("awaiting_draft_approval"):
+            update = {"draft_approved": True, "awaiting_draft_approval": False}
+        else:
+            update = {"rejected_images": [], "replacement_images": {}, "human_approval_received": True}
+        graph.update_state(config, update)
+        graph_input = None
+    raise RuntimeError(f"Workflow did not finish after {MAX_RESUMES} resumes")
+
+
+def initial_state(inputs: str, scenario: dict) -> dict:
+    """The scenario's workflow input, with its photos read from the `inputs` directory."""
+    from state import GraphState
+
+    return GraphState(
+        template_id=scenario["template_id"],
+        input_images={name: os.path.join(inputs, file) for name, file in scenario["photos"].items()},
+        draft_preview=scenario.get("draft_preview", False),
+        render_backend="creatomate",
+    ).model_dump()
+
+
+def ledger_rows(thread_id: str) -> Dict[str, int]:
+    """The thread's ledger rows, counted by "provider operation outcome"."""
+    from ledger import get_ledger
+
+    rows = get_ledger().query(
+        "SELECT provider, operation, outcome FROM calls WHERE thread_id = ?", (thread_id,)
+    )
+    return dict(sorted(Counter(f"{row['provider']} {row['operation']} {row['outcome']}" for row in rows).items()))
+
+
+def record(args):
+    from templates import DEFAULT_TEMPLATE_ID
+
+    photos = sorted(f for f in os.listdir(args.photos) if f.lower().endswith(PHOTO_EXTENSIONS))
+    if not photos:
+        sys.exit(f"No photos found in {args.photos}")
+    inputs = os.path.join(args.cassette, INPUTS_DIR)
+    os.makedirs(inputs, exist_ok=True)
+    for file in photos:
+        shutil.copy2(os.path.join(args.photos, file), inputs)
+
+    scenario = {
+        "template_id": args.template or DEFAULT_TEMPLATE_ID,
+        "photos": {f"Photo-{index}": file for index, file in enumerate(photos, start=1)},
+        "draft_preview": args.draft,
+    }
+
+    import nodes
+    from main import VideoGenerationWorkflow, new_thread_id
+
+    # Part of the wall time; a timed replay waits between polls like the recording did
+    metadata = {
+        "scenario": scenario,
+        "poll_intervals": {"render": nodes.RENDER_POLL_INTERVAL, "draft": nodes.DRAFT_POLL_INTERVAL},
+    }
+    graph = VideoGenerationWorkflow().compile()
+    thread_id = new_thread_id()
+    start = time.perf_counter()
+    with Cassette(args.cassette, mode=RECORD, metadata=metadata) as cassette:
+        final = run_workflow(graph, initial_state(args.photos, scenario), thread_id)
+        cassette.metadata["wall_seconds"] = time.perf_counter() - start
+
+    baseline = {
+        "wall_seconds": cassette.metadata["wall_seconds"],
+        "calls": dict(sorted(cassette.calls.items())),
+        "final_state": {field: final.get(field) for field in BASELINE_FIELDS},
+        "ledger": ledger_rows(thread_id),
+    }
+    with open(os.path.join(args.cassette, BASELINE_FILE), "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Recorded {len(cassette.interactions)} interactions in {cassette.metadata['wall_seconds']:.1f}s "
+          f"(render status: {final.get('render_status')}) to {args.cassette}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Record a cassette against the real APIs")
+    record_parser.add_argument("--cassette", required=True, help="Cassette directory to write")
+    record_parser.add_argument("--photos", required=True, help="Directory with the listing photos")
+    record_parser.add_argument("--template", help="Creatomate template ID (default: the 5-photo template)")
+    record_parser.add_argument("--draft", action="store_true", help="Render a draft preview first")
+    args = parser.parse_args()
+
+    # Keep caches, the photo index and the ledger out of the way - a cache hit
+    # would hide exactly the calls the cassette is meant to capture. Set before
+    # the workflow modules are imported, since they read these on import.
+    scratch = tempfile.mkdtemp(prefix="bench_replay_")
+    os.environ["PHOTO_INDEX_PATH"] = os.path.join(scratch, "photos.sqlite3")
+    os.environ["RENDER_CACHE_DIR"] = os.path.join(scratch, "renders")
+    os.environ["TEMPLATE_CACHE_DIR"] = os.path.join(scratch, "templates")
+    os.environ["LEDGER_PATH"] = os.path.join(scratch, "ledger.sqlite3")
+    os.environ["LEDGER_ENABLED"] = "true"
+    os.environ["LEASES_ENABLED"] = "false"
+    try:
+        record(args)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Memory-footprint benchmark for concurrent sessions.
+
+Simulates N Streamlit sessions that each start a workflow and stop at the
+approval interrupt, and compares:
+  - per-session: every session compiles its own graph with its own checkpointer
+  - shared:      one compiled graph + checkpointer, sessions isolated by thread_id
+
+Runs offline: fal is disabled (photos take the local path), the benchmark
+template's definition is seeded into the template registry so Creatomate
+is never asked for it, and the ledger, lease table, photo index, caches and
+scratch directories live in a temporary directory.
+
+Usage:
+    python bench_sessions.py [--sessions 100]
+"""
+import argparse
+import gc
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+BENCH_TEMPLATE_ID = "benchmark-template"
+# Element names the workflow's payload uses, so validation has something to check
+BENCH_ELEMENTS = {
+    **{f"Photo-{i}": "image" for i in range(1, 6)},
+    "Picture": "image",
+    **{name: "text" for name in ("Address", "Details-1", "Details-2", "Email",
+                                 "Phone-Number", "Brand-Name", "Name")},
+}
+
+
+def seed_template():
+    """Puts the benchmark template's definition in the registry, as if it had just been fetched."""
+    from templates import get_template_registry
+
+    get_template_registry()._cache[BENCH_TEMPLATE_ID] = {
+        "template_id": BENCH_TEMPLATE_ID,
+        "name": "Benchmark",
+        "elements": dict(BENCH_ELEMENTS),
+        "width": 1080,
+        "height": 1920,
+        "fetched_at": time.time(),
+    }
+
+
+def make_state(index: int, scratch_dir: str) -> dict:
+    from state import GraphState
+
+    return GraphState(
+        template_id=BENCH_TEMPLATE_ID,
+        input_images={f"Photo-{i}": f"/nonexistent/session_{index}_{i}.jpg" for i in range(1, 6)},
+        address=f"{index} Benchmark Street",
+        scratch_dir=scratch_dir,
+    ).model_dump()
+
+
+def start_session(graph, index: int) -> str:
+    from main import new_thread_id, workflow_config
+    from scratch import get_scratch_manager
+
+    # Like the app: the session creates the job directory and the workflow holds it
+    scratch_dir = get_scratch_manager().create_job_dir()
+    thread_id = new_thread_id()
+    for _ in graph.stream(make_state(index, scratch_dir), workflow_config(thread_id)):
+        pass
+    get_scratch_manager().release(scratch_dir)
+    return thread_id
+
+
+def run_per_session(sessions: int):
+    from main import VideoGenerationWorkflow
+
+    graphs = []
+    for index in range(sessions):
+        graph = VideoGenerationWorkflow().compile()
+        start_session(graph, index)
+        graphs.append(graph)
+    return graphs
+
+
+def run_shared(sessions: int):
+    from main import VideoGenerationWorkflow
+
+    graph = VideoGenerationWorkflow().compile()
+    threads = [start_session(graph, index) for index in range(sessions)]
+    return graph, threads
+
+
+def measure(fn, sessions: int):
+    """Runs `fn(sessions)`; returns its result, bytes still held, peak bytes and seconds taken."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(sessions)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+
+def leftovers(graph, threads) -> dict:
+    """What is still kept for the given threads: checkpoints, live cancel tokens and scratch directories."""
+    import cancellation
+    from scratch import get_scratch_manager
+
+    threads = set(threads)
+    manager = get_scratch_manager()
+    with cancellation._tokens_lock:
+        # Released threads leave a cancelled tombstone behind for a while (see cancel_thread)
+        tokens = sum(1 for thread_id in cancellation._tokens
+                     if thread_id in threads and thread_id not in cancellation._cancelled_at)
+    with manager._lock:
+        scratch = sum(len(manager._owners.get(thread_id, ())) for thread_id in threads)
+    return {
+        "threads": len(threads & set(graph.checkpointer.storage)),
+        "tokens": tokens,
+        "scratch": scratch,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="Number of simulated sessions")
+    args = parser.parse_args()
+
+    # Set before the workflow modules are imported, since they read these on import
+    storage = tempfile.mkdtemp(prefix="bench_sessions_")
+    os.environ["PHOTO_INDEX_PATH"] = os.path.join(storage, "photos.sqlite3")
+    os.environ["RENDER_CACHE_DIR"] = os.path.join(storage, "renders")
+    os.environ["TEMPLATE_CACHE_DIR"] = os.path.join(storage, "templates")
+    os.environ["LEDGER_PATH"] = os.path.join(storage, "ledger.sqlite3")
+    os.environ["LEASE_DB_PATH"] = os.path.join(storage, "leases.sqlite3")
+    os.environ["SCRATCH_DIR"] = os.path.join(storage, "scratch")
+    try:
+        import nodes
+        from main import release_thread
+
+        # Keep the benchmark offline - photos are enhanced locally without a key
+        nodes.FAL_KEY = None
+        seed_template()
+
+        print(f"Simulating {args.sessions} sessions up to the approval step\n")
+        print(f"{'mode':<14} {'held MB':>10} {'peak MB':>10} {'KB/session':>14} {'time s':>8}")
+        print("-" * 60)
+
+        held = {}
+        for label, fn in (("per-session", run_per_session), ("shared", run_shared)):
+            result, held[label], peak, elapsed = measure(fn, args.sessions)
+            print(f"{label:<14} {held[label] / 1e6:>10.1f} {peak / 1e6:>10.1f} "
+                  f"{held[label] / args.sessions / 1e3:>14.1f} {elapsed:>8.2f}")
+        graph, threads = result
+        print(f"\nShared graph uses {held['per-session'] / max(held['shared'], 1):.1f}x "
+              "less memory than per-session graphs.")
+
+        # Releasing finished threads should give everything they held back
+        for thread_id in threads:
+            release_thread(graph, thread_id)
+        for name, count in leftovers(graph, threads).items():
+            print(f"{name.capitalize()} left after release: {count}")
+    finally:
+        shutil.rmtree(storage, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
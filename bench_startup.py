@@ -0,0 +1,62 @@
+"""
+Cold-start benchmark: measures how long each startup stage takes in a fresh
+interpreter, so regressions in import time are easy to spot.
+
+Usage:
+    python bench_startup.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Each stage runs in its own interpreter so module caches don't hide the cost
+STAGES = {
+    "login page (streamlit + templates)": "import streamlit; import templates",
+    "import main": "import main",
+    "import nodes": "import nodes",
+    "import langgraph": "import langgraph.graph",
+    "build + compile graph": "import main; main.VideoGenerationWorkflow().compile()",
+}
+
+TIMER = """
+import time, json
+_start = time.perf_counter()
+{code}
+print(json.dumps(time.perf_counter() - _start))
+"""
+
+
+def time_stage(code: str) -> float:
+    """Runs `code` in a fresh interpreter and returns its wall time in seconds."""
+    result = subprocess.run(
+        [sys.executable, "-c", TIMER.format(code=code)],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Runs per stage (median is reported)")
+    args = parser.parse_args()
+
+    print(f"{'Stage':<40} {'median ms':>10} {'min ms':>10}")
+    print("-" * 62)
+    for name, code in STAGES.items():
+        try:
+            timings = [time_stage(code) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{name:<40} {'failed':>10}  ({e.splitlines()[-1]})")
+            continue
+        print(f"{name:<40} {statistics.median(timings) * 1000:>10.1f} {min(timings) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from typing import Callable, Dict, List, Optional
+
+# Cancelled tokens are kept this long, so work that looks its thread up late still sees it cancelled
+CANCEL_TOMBSTONE_TTL = int(os.getenv("CANCEL_TOMBSTONE_TTL", "3600"))
+
+
+class WorkflowCancelled(Exception):
+    """Raised inside a node when its workflow thread has been cancelled."""
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag for one workflow thread.
+
+    Long-running code checks `cancelled` / `raise_if_cancelled()` between
+    steps, waits with `wait()` instead of `time.sleep()`, and registers
+    `on_cancel` callbacks to abort work it can't check itself (e.g. queued
+    provider requests).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Sets the flag and runs every registered cancel callback once."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Warning: Cancel callback failed: {e}")
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise WorkflowCancelled()
+
+    def wait(self, timeout: float) -> bool:
+        """Sleeps up to `timeout` seconds; returns True early if cancelled."""
+        return self._event.wait(timeout)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Registers `callback` to run on cancellation (immediately if already
+        cancelled). Returns a function that unregisters it.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+
+                def unregister():
+                    with self._lock:
+                        if callback in self._callbacks:
+                            self._callbacks.remove(callback)
+                return unregister
+        callback()
+        return lambda: None
+
+
+# Token used when a node runs without a thread_id (never cancelled)
+NEVER_CANCELLED = CancelToken()
+
+_tokens: Dict[str, CancelToken] = {}
+_cancelled_at: Dict[str, float] = {}  # thread -> when it was cancelled (its token is a tombstone)
+_tokens_lock = threading.Lock()
+
+
+def get_cancel_token(thread_id: Optional[str]) -> CancelToken:
+    """Returns the cancel token for a workflow thread, creating it if needed."""
+    if not thread_id:
+        return NEVER_CANCELLED
+    with _tokens_lock:
+        token = _tokens.get(thread_id)
+        if token is None:
+            token = _tokens[thread_id] = CancelToken()
+        return token
+
+
+def token_for_config(config: Optional[dict]) -> CancelToken:
+    """Returns the cancel token for the thread_id in a LangGraph run config."""
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+    return get_cancel_token(thread_id)
+
+
+def cancel_thread(thread_id: Optional[str]):
+    """
+    Cancels all in-flight work of a workflow thread. Its token stays
+    registered as cancelled for CANCEL_TOMBSTONE_TTL seconds, so a node or
+    pool thread that only looks the token up afterwards stops too.
+    """
+    if not thread_id:
+        return
+    now = time.time()
+    with _tokens_lock:
+        for expired in [tid for tid, at in _cancelled_at.items() if now - at > CANCEL_TOMBSTONE_TTL]:
+            _cancelled_at.pop(expired)
+            _tokens.pop(expired, None)
+        token = _tokens.get(thread_id)
+        if token is None:
+            token = _tokens[thread_id] = CancelToken()
+        already_cancelled = thread_id in _cancelled_at
+        _cancelled_at.setdefault(thread_id, now)
+    if not already_cancelled:
+        print(f"Cancelling workflow {thread_id}...")
+    token.cancel()
+
+
+def discard_token(thread_id: Optional[str]):
+    """Forgets the token of a finished or pruned workflow thread without cancelling it."""
+    with _tokens_lock:
+        _tokens.pop(thread_id, None)
+        _cancelled_at.pop(thread_id, None)
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import base64
+import functools
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import requests
+
+RECORD = "record"
+REPLAY = "replay"
+
+CASSETTE_FILE = "cassette.json"
+CASSETTE_VERSION = 1
+
+
+class CassetteMiss(RuntimeError):
+    """Raised on replay when a call has no recorded interaction to answer it."""
+
+
+def _digest(value: Any) -> str:
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(value).hexdigest()[:16]
+
+
+def _encode_event(event) -> Dict[str, Any]:
+    import fal_client
+
+    if isinstance(event, fal_client.Queued):
+        return {"type": "Queued", "position": event.position}
+    if isinstance(event, fal_client.InProgress):
+        return {"type": "InProgress", "logs": event.logs}
+    if isinstance(event, fal_client.Completed):
+        return {"type": "Completed", "logs": event.logs, "metrics": event.metrics}
+    return {"type": type(event).__name__}
+
+
+def _decode_event(data: Dict[str, Any]):
+    import fal_client
+
+    if data["type"] == "Queued":
+        return fal_client.Queued(position=data["position"])
+    if data["type"] == "InProgress":
+        return fal_client.InProgress(logs=data["logs"])
+    return fal_client.Completed(logs=data.get("logs"), metrics=data.get("metrics") or {})
+
+
+def _encode_body(content: bytes) -> Dict[str, str]:
+    try:
+        return {"text": content.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"base64": base64.b64encode(content).decode("ascii")}
+
+
+def _decode_body(body: Dict[str, str]) -> bytes:
+    if "base64" in body:
+        return base64.b64decode(body["base64"])
+    return body.get("text", "").encode("utf-8")
+
+
+class _RecordingHandle:
+    """Wraps a fal request handle and writes its events and result into the interaction."""
+
+    def __init__(self, handle, interaction: Dict[str, Any]):
+        self._handle = handle
+        self._interaction = interaction
+        self.request_id = handle.request_id
+
+    def iter_events(self, *args, **kwargs):
+        start = time.monotonic()
+        events = self._interaction.setdefault("events", [])
+        for event in self._handle.iter_events(*args, **kwargs):
+            events.append({"offset": time.monotonic() - start, **_encode_event(event)})
+            yield event
+
+    def get(self):
+        start = time.monotonic()
+        result = self._handle.get()
+        self._interaction["result"] = result
+        self._interaction["result_duration"] = time.monotonic() - start
+        return result
+
+    def cancel(self):
+        self._interaction["cancelled"] = True
+        return self._handle.cancel()
+
+    def status(self, *args, **kwargs):
+        return self._handle.status(*args, **kwargs)
+
+
+class _ReplayHandle:
+    """Plays a recorded fal request back: its queue events, then its result."""
+
+    def __init__(self, cassette: "Cassette", interaction: Dict[str, Any]):
+        self._cassette = cassette
+        self._interaction = interaction
+        self._cancelled = threading.Event()
+        self.request_id = interaction["response"].get("request_id")
+
+    def iter_events(self, *args, **kwargs):
+        elapsed = 0.0
+        for event in self._interaction.get("events", []):
+            # Cancelling ends the wait early, like the real queue would
+            if self._cancelled.wait(self._cassette.scaled(event["offset"] - elapsed)):
+                return
+            elapsed = event["offset"]
+            yield _decode_event(event)
+
+    def get(self):
+        if "result" not in self._interaction:
+            raise CassetteMiss(f"fal request {self.request_id} was cancelled before its result was recorded")
+        self._cancelled.wait(self._cassette.scaled(self._interaction.get("result_duration", 0.0)))
+        return self._interaction["result"]
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def status(self, *args, **kwargs):
+        import fal_client
+
+        if "result" in self._interaction:
+            return fal_client.Completed(logs=None, metrics={})
+        return fal_client.InProgress(logs=None)
+
+
+class Cassette:
+    """
+    Records the workflow's external I/O (fal_client uploads and model runs,
+    and every `requests` call - Creatomate renders, status polls, template
+    fetches) into a cassette file, or replays it offline.
+
+    Interactions are keyed by their request (upload bytes, model arguments,
+    URL and JSON body) and answered in recorded order, so concurrent calls
+    get the right responses. On replay each call takes its recorded time
+    multiplied by `latency_scale` (0 for as fast as possible).
+
+    Use as a context manager:
+
+        with Cassette("cassettes/listing", mode=RECORD):
+            ...run the workflow against the real APIs...
+
+        with Cassette("cassettes/listing", latency_scale=0.1) as cassette:
+            ...run it again offline...
+        print(cassette.calls)
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY, latency_scale: float = 1.0,
+                 metadata: Optional[Dict[str, Any]] = None):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode '{mode}'")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.metadata: Dict[str, Any] = dict(metadata or {})
+        self.interactions: List[Dict[str, Any]] = []
+        self.calls: Counter = Counter()  # kind -> calls made while the cassette was active
+        self.misses: List[str] = []
+        self._used: set = set()
+        self._lock = threading.Lock()
+        self._originals: Dict[str, Any] = {}
+        self._start = 0.0
+
+        if mode == REPLAY:
+            with open(os.path.join(path, CASSETTE_FILE), "r") as f:
+                data = json.load(f)
+            if data.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version {data.get('version')} in {path}")
+            self.metadata = {**data.get("metadata", {}), **self.metadata}
+            self.interactions = data["interactions"]
+
+    def scaled(self, seconds: float) -> float:
+        return max(seconds, 0.0) * self.latency_scale
+
+    # --- Patching ---
+
+    def __enter__(self) -> "Cassette":
+        import fal_client
+
+        self._start = time.monotonic()
+        self._originals = {
+            "upload": fal_client.upload,
+            "submit": fal_client.submit,
+            "get": requests.get,
+            "post": requests.post,
+        }
+        fal_client.upload = self._upload
+        fal_client.submit = self._submit
+        requests.get = functools.partial(self._request, "GET")
+        requests.post = functools.partial(self._request, "POST")
+        return self
+
+    def __exit__(self, *exc_info):
+        import fal_client
+
+        fal_client.upload = self._originals["upload"]
+        fal_client.submit = self._originals["submit"]
+        requests.get = self._originals["get"]
+        requests.post = self._originals["post"]
+        self._originals.clear()
+        if self.mode == RECORD:
+            self.save()
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, CASSETTE_FILE), "w") as f:
+            json.dump({
+                "version": CASSETTE_VERSION,
+                "recorded_at": time.time(),
+                "metadata": self.metadata,
+                "interactions": self.interactions,
+            }, f, indent=1)
+
+    # --- Recording / matching ---
+
+    def _record(self, kind: str, route: str, key: str, request: Dict[str, Any], start: float) -> Dict[str, Any]:
+        interaction = {
+            "kind": kind,
+            "route": route,
+            "key": key,
+            "request": request,
+            "start": start - self._start,
+            "duration": time.monotonic() - start,
+        }
+        with self._lock:
+            self.interactions.append(interaction)
+        return interaction
+
+    def _match(self, kind: str, route: str, key: str) -> Dict[str, Any]:
+        """
+        The first unused interaction with the same request, else the first
+        unused one for the same route, else (e.g. extra status polls) the
+        last one for the same request.
+        """
+        with self._lock:
+            self.calls[kind] += 1
+            candidates = [(index, interaction) for index, interaction in enumerate(self.interactions)
+                          if interaction["kind"] == kind and interaction["route"] == route]
+            for wanted in (lambda i: i["key"] == key, lambda i: True):
+                for index, interaction in candidates:
+                    if index not in self._used and wanted(interaction):
+                        self._used.add(index)
+                        return interaction
+            repeats = [interaction for _, interaction in candidates if interaction["key"] == key]
+            if repeats:
+                return repeats[-1]
+            self.misses.append(f"{kind} {route}")
+        raise CassetteMiss(f"No recorded {kind} interaction for {route}")
+
+    def _upload(self, data, content_type: str, file_name: Optional[str] = None) -> str:
+        payload = data.encode() if isinstance(data, str) else data
+        key = _digest(payload)
+        if self.mode == RECORD:
+            with self._lock:
+                self.calls["fal.upload"] += 1
+            start = time.monotonic()
+            url = self._originals["upload"](data, content_type=content_type, file_name=file_name)
+            interaction = self._record("fal.upload", "upload", key,
+                                       {"bytes": len(payload), "content_type": content_type}, start)
+            interaction["response"] = {"url": url}
+            return url
+
+        interaction = self._match("fal.upload", "upload", key)
+        time.sleep(self.scaled(interaction["duration"]))
+        return interaction["response"]["url"]
+
+    def _submit(self, application: str, arguments: Any, **kwargs):
+        key = _digest(arguments)
+        if self.mode == RECORD:
+            with self._lock:
+                self.calls["fal.submit"] += 1
+            start = time.monotonic()
+            handle = self._originals["submit"](application, arguments=arguments, **kwargs)
+            interaction = self._record("fal.submit", application, key, {"arguments": arguments}, start)
+            interaction["response"] = {"request_id": handle.request_id}
+            return _RecordingHandle(handle, interaction)
+
+        interaction = self._match("fal.submit", application, key)
+        time.sleep(self.scaled(interaction["duration"]))
+        return _ReplayHandle(self, interaction)
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kind = f"http.{method.lower()}"
+        route = f"{method} {url.split('?', 1)[0]}"
+        key = _digest({"url": url, "params": kwargs.get("params"), "json": kwargs.get("json")})
+        if self.mode == RECORD:
+            with self._lock:
+                self.calls[kind] += 1
+            start = time.monotonic()
+            response = self._originals[method.lower()](url, **kwargs)
+            # Request headers are never written - they carry the API keys
+            interaction = self._record(kind, route, key, {"url": url, "json": kwargs.get("json")}, start)
+            interaction["response"] = {
+                "status_code": response.status_code,
+                "content_type": response.headers.get("Content-Type"),
+                "body": _encode_body(response.content),
+            }
+            return response
+
+        try:
+            interaction = self._match(kind, route, key)
+        except CassetteMiss as e:
+            # Surface it the way a network failure would, so the workflow's own error handling runs
+            raise requests.exceptions.ConnectionError(str(e))
+        time.sleep(self.scaled(interaction["duration"]))
+        recorded = interaction["response"]
+        response = requests.Response()
+        response.status_code = recorded["status_code"]
+        response._content = _decode_body(recorded["body"])
+        response.url = url
+        if recorded.get("content_type"):
+            response.headers["Content-Type"] = recorded["content_type"]
+        response.request = requests.Request(method, url).prepare()
+        return response
@@ -0,0 +1,192 @@
+import os
+import time
+import zlib
+import threading
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# --- Checkpoint Configuration ---
+# Checkpoints kept per thread besides the approval points (enough for the current step and a retry)
+CHECKPOINT_KEEP_LATEST = int(os.getenv("CHECKPOINT_KEEP_LATEST", "4"))
+# Serialized values at least this large are zlib-compressed
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "512"))
+# Finished workflows are dropped after this long; the UI keeps its own copy of the final state
+CHECKPOINT_FINISHED_TTL = int(os.getenv("CHECKPOINT_FINISHED_TTL", "3600"))
+# Workflows nobody has touched for this long (closed tabs) are dropped too
+CHECKPOINT_IDLE_TTL = int(os.getenv("CHECKPOINT_IDLE_TTL", str(24 * 3600)))
+PRUNE_INTERVAL = 60  # seconds between sweeps for finished/idle threads
+
+# Nodes the graph pauses after for a human - their checkpoints are never compacted away
+INTERRUPT_NODES = ("wait_approval", "wait_draft")
+
+COMPRESSED = "msgpack+zlib"
+
+
+def thread_stats(saver: InMemorySaver, thread_id: str) -> Dict[str, int]:
+    """Checkpoints and stored bytes for a thread in an in-memory saver (shared blobs counted once)."""
+    checkpoints = [entry for namespace in saver.storage.get(thread_id, {}).values()
+                   for entry in namespace.values()]
+    blobs = {id(blob): blob for key, blob in list(saver.blobs.items()) if key[0] == thread_id}
+    writes = [write for key, value in list(saver.writes.items()) if key[0] == thread_id
+              for write in value.values()]
+    return {
+        "checkpoints": len(checkpoints),
+        "blobs": len(blobs),
+        "bytes": sum(len(header[1]) + len(meta[1]) for header, meta, _ in checkpoints)
+        + sum(len(blob[1]) for blob in blobs.values())
+        + sum(len(write[2][1]) for write in writes),
+    }
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """
+    LangGraph's msgpack serializer, with larger payloads zlib-compressed.
+    Checkpoint headers (channel versions for ~40 state fields) repeat the
+    same long version strings and shrink several times over.
+    """
+
+    def __init__(self, min_bytes: int = CHECKPOINT_COMPRESS_MIN_BYTES, **kwargs):
+        super().__init__(**kwargs)
+        self.min_bytes = min_bytes
+
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        type_, data = super().dumps_typed(obj)
+        if type_ == "msgpack" and len(data) >= self.min_bytes:
+            packed = zlib.compress(data, 1)
+            if len(packed) < len(data):
+                return COMPRESSED, packed
+        return type_, data
+
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_ == COMPRESSED:
+            return super().loads_typed(("msgpack", zlib.decompress(payload)))
+        return super().loads_typed(data)
+
+
+class CompactingSaver(InMemorySaver):
+    """
+    In-memory checkpointer that doesn't grow with the length of a session.
+
+    - Field-level dedup: most nodes return the whole state, so every step
+      writes a new version of every field. A field whose serialized value
+      is unchanged shares the previous checkpoint's blob instead of storing
+      a copy.
+    - Compaction: only the latest `keep_latest` checkpoints of a thread are
+      kept, plus every checkpoint where it paused for approval (the
+      INTERRUPT_NODES), so long regenerate loops and render polling don't
+      pile up full-state snapshots. Blobs only old checkpoints used are freed.
+    - Pruning: finished threads are dropped after `finished_ttl` seconds,
+      abandoned ones after `idle_ttl`; `on_prune(thread_id)` is then called
+      so whatever else the process keeps per thread can be freed too.
+    """
+
+    def __init__(self, keep_latest: int = CHECKPOINT_KEEP_LATEST,
+                 finished_ttl: float = CHECKPOINT_FINISHED_TTL, idle_ttl: float = CHECKPOINT_IDLE_TTL,
+                 serde=None, on_prune: Optional[Callable[[str], None]] = None):
+        super().__init__(serde=serde or CompactSerializer())
+        self.keep_latest = max(keep_latest, 1)
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self.on_prune = on_prune
+        self._lock = threading.RLock()
+        self._pinned: Dict[Tuple[str, str], Set[str]] = {}          # (thread, ns) -> approval checkpoint ids
+        self._seen: Dict[Tuple[str, str], Dict[str, Any]] = {}      # (thread, ns) -> interrupt node -> version seen
+        self._blob_keys: Dict[Tuple[str, str], Set[tuple]] = {}     # (thread, ns) -> blob keys
+        self._last_blobs: Dict[Tuple[str, str, str], tuple] = {}    # (thread, ns, channel) -> latest blob
+        self._activity: Dict[str, Tuple[float, bool]] = {}          # thread -> (last write, finished)
+        self._next_prune = time.monotonic() + PRUNE_INTERVAL
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            scope = (thread_id, checkpoint_ns)
+
+            blob_keys = self._blob_keys.setdefault(scope, set())
+            for channel, version in new_versions.items():
+                key = (thread_id, checkpoint_ns, channel, version)
+                blob = self.blobs[key]
+                previous = self._last_blobs.get((thread_id, checkpoint_ns, channel))
+                if previous is not None and previous == blob:
+                    self.blobs[key] = previous
+                else:
+                    self._last_blobs[(thread_id, checkpoint_ns, channel)] = blob
+                blob_keys.add(key)
+
+            # A checkpoint written by an interrupt node is where the thread waits for a human
+            versions_seen = checkpoint.get("versions_seen", {})
+            seen = self._seen.setdefault(scope, {})
+            for node in INTERRUPT_NODES:
+                if node in versions_seen and versions_seen[node] != seen.get(node):
+                    seen[node] = versions_seen[node]
+                    self._pinned.setdefault(scope, set()).add(checkpoint["id"])
+
+            updated = checkpoint.get("updated_channels")
+            finished = metadata.get("source") == "loop" and updated is not None and not any(
+                channel.startswith("branch:to:") or channel == "__pregel_tasks" for channel in updated
+            )
+            self._activity[thread_id] = (time.time(), finished)
+
+            self._compact(thread_id, checkpoint_ns)
+            prune_due = time.monotonic() >= self._next_prune
+        if prune_due:
+            self.prune()
+        return next_config
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def _compact(self, thread_id: str, checkpoint_ns: str):
+        """Drops all but the latest and pinned checkpoints of a thread, then frees unused blobs."""
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        pinned = self._pinned.get((thread_id, checkpoint_ns), set())
+        unpinned = sorted((cid for cid in checkpoints if cid not in pinned), reverse=True)
+        # Compact in batches - freeing blobs means decoding the kept checkpoints
+        if len(unpinned) < 2 * self.keep_latest:
+            return
+
+        for checkpoint_id in unpinned[self.keep_latest:]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        referenced = set()
+        for header, _, _ in checkpoints.values():
+            for channel, version in self.serde.loads_typed(header)["channel_versions"].items():
+                referenced.add((thread_id, checkpoint_ns, channel, version))
+        blob_keys = self._blob_keys.get((thread_id, checkpoint_ns), set())
+        for key in blob_keys - referenced:
+            self.blobs.pop(key, None)
+        blob_keys &= referenced
+
+    def prune(self, now: Optional[float] = None):
+        """Deletes threads that finished more than finished_ttl ago or went idle for idle_ttl."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._next_prune = time.monotonic() + PRUNE_INTERVAL
+            expired = [
+                thread_id for thread_id, (last_write, finished) in self._activity.items()
+                if now - last_write > (self.finished_ttl if finished else self.idle_ttl)
+            ]
+            for thread_id in expired:
+                self.delete_thread(thread_id)
+        if expired:
+            print(f"Pruned {len(expired)} finished or idle workflow thread(s) from the checkpointer.")
+        if self.on_prune is not None:
+            for thread_id in expired:
+                try:
+                    self.on_prune(thread_id)
+                except Exception as e:
+                    print(f"Warning: Could not free pruned thread {thread_id}: {e}")
+
+    def delete_thread(self, thread_id: str):
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._activity.pop(thread_id, None)
+            for registry in (self._pinned, self._seen, self._blob_keys, self._last_blobs):
+                for key in [key for key in registry if key[0] == thread_id]:
+                    del registry[key]
@@ -0,0 +1,199 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple, Type
+
+# --- Circuit Breaker Configuration ---
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "120"))            # seconds of history considered
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "4"))        # calls needed before tripping
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))  # trip at this failure ratio
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))    # trip at this slow-call ratio
+BREAKER_OPEN_SECONDS = int(os.getenv("BREAKER_OPEN_SECONDS", "60")) # how long to fail fast
+BREAKER_PROBES = int(os.getenv("BREAKER_PROBES", "1"))              # trial calls when half-open
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker with rolling error-rate and latency thresholds.
+
+    closed    - calls go through; outcomes are recorded in a time window.
+    open      - calls fail immediately with CircuitOpenError.
+    half_open - after open_seconds, a few probe calls are let through; a
+                successful probe closes the circuit, a failed one re-opens it.
+    """
+
+    def __init__(self, name: str, slow_call_seconds: float, window: int = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS, error_rate: float = BREAKER_ERROR_RATE,
+                 slow_rate: float = BREAKER_SLOW_RATE, open_seconds: int = BREAKER_OPEN_SECONDS,
+                 probes: int = BREAKER_PROBES):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self._probes_in_flight = 0
+        self._calls = deque()  # (timestamp, failed, slow)
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _rates(self) -> Tuple[float, float]:
+        if not self._calls:
+            return 0.0, 0.0
+        total = len(self._calls)
+        failed = sum(1 for _, is_failed, _ in self._calls if is_failed)
+        slow = sum(1 for _, _, is_slow in self._calls if is_slow)
+        return failed / total, slow / total
+
+    def _open(self, now: float, reason: str):
+        self.state = OPEN
+        self.opened_at = now
+        self._probes_in_flight = 0
+        print(f"Circuit '{self.name}' OPEN: {reason}. Failing fast for {self.open_seconds}s.")
+
+    def check(self):
+        """
+        Raises CircuitOpenError while the circuit rejects calls, without taking
+        a probe - e.g. before queuing for a provider slot (see FairScheduler.slot).
+        """
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self.open_seconds - (time.monotonic() - self.opened_at)
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+            elif self.state == HALF_OPEN and self._probes_in_flight >= self.probes:
+                raise CircuitOpenError(self.name, 0)
+
+    def allow(self):
+        """Raises CircuitOpenError if a call should not be attempted right now."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                retry_in = self.open_seconds - (now - self.opened_at)
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+                print(f"Circuit '{self.name}' HALF-OPEN: probing provider.")
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.probes:
+                    raise CircuitOpenError(self.name, 0)
+                self._probes_in_flight += 1
+
+    def record(self, failed: bool, duration: float):
+        """Records the outcome of a call and updates the circuit state."""
+        with self._lock:
+            now = time.monotonic()
+            slow = duration >= self.slow_call_seconds
+
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if failed or slow:
+                    self._open(now, "probe call failed" if failed else "probe call too slow")
+                else:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    print(f"Circuit '{self.name}' CLOSED: provider recovered.")
+                return
+
+            self._calls.append((now, failed, slow))
+            self._prune(now)
+            if self.state == CLOSED and len(self._calls) >= self.min_calls:
+                error_rate, slow_rate = self._rates()
+                if error_rate >= self.error_rate:
+                    self._open(now, f"{error_rate:.0%} of recent calls failed")
+                elif slow_rate >= self.slow_rate:
+                    self._open(now, f"{slow_rate:.0%} of recent calls slower than {self.slow_call_seconds:.0f}s")
+
+    @contextmanager
+    def track(self, ignore: Tuple[Type[BaseException], ...] = (),
+              is_failure: Optional[Callable[[BaseException], bool]] = None):
+        """
+        Guards a provider call: fails fast if the circuit is open, otherwise
+        records the call's duration and outcome. Exceptions in `ignore`
+        (e.g. cancellation) are not recorded at all; exceptions for which
+        `is_failure` returns False (e.g. a 4xx for a bad request) count as a
+        healthy provider response.
+        """
+        self.allow()
+        start = time.monotonic()
+        try:
+            yield
+        except ignore:
+            with self._lock:
+                if self.state == HALF_OPEN:
+                    self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+            raise
+        except BaseException as e:
+            failed = is_failure(e) if is_failure is not None else True
+            self.record(failed, time.monotonic() - start)
+            raise
+        self.record(False, time.monotonic() - start)
+
+    def snapshot(self) -> dict:
+        """Returns the breaker's state for display."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            error_rate, slow_rate = self._rates()
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(self.open_seconds - (now - self.opened_at), 0)
+            return {
+                "state": self.state,
+                "calls": len(self._calls),
+                "error_rate": error_rate,
+                "slow_rate": slow_rate,
+                "retry_in": retry_in,
+            }
+
+
+# Slow-call thresholds per provider: a fal model run legitimately takes tens of
+# seconds, while a Creatomate API request (not the render itself) should be quick.
+_breakers: Dict[str, CircuitBreaker] = {
+    "fal": CircuitBreaker("fal", slow_call_seconds=float(os.getenv("FAL_SLOW_CALL_SECONDS", "180"))),
+    "creatomate": CircuitBreaker("creatomate", slow_call_seconds=float(os.getenv("CREATOMATE_SLOW_CALL_SECONDS", "30"))),
+}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Returns the process-wide circuit breaker for a provider ("fal" or "creatomate")."""
+    return _breakers[name]
+
+
+def breaker_states() -> Dict[str, dict]:
+    """Returns a snapshot of every provider breaker, for the UI and CLI."""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
+
+
+def format_breaker_states() -> str:
+    """Formats breaker states as one line per provider."""
+    lines = []
+    for name, snap in breaker_states().items():
+        line = f"{name}: {snap['state']} ({snap['calls']} recent calls, {snap['error_rate']:.0%} errors)"
+        if snap["retry_in"] is not None:
+            line += f", retry in {snap['retry_in']:.0f}s"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, ContextManager, Optional
+
+from cancellation import CancelToken, NEVER_CANCELLED
+from ledger import carry_context
+
+# --- Hedging Configuration ---
+# Off by default: a hedge is a second paid model run
+HEDGE_ENABLED = os.getenv("FAL_HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Hedge once a job has run longer than this percentile of recent job latencies
+HEDGE_PERCENTILE = float(os.getenv("FAL_HEDGE_PERCENTILE", "0.95"))
+# Don't hedge until this many latencies have been observed
+HEDGE_MIN_SAMPLES = int(os.getenv("FAL_HEDGE_MIN_SAMPLES", "10"))
+# Extra spend cap: hedges may be at most this fraction of primary requests
+HEDGE_BUDGET = float(os.getenv("FAL_HEDGE_BUDGET", "0.1"))
+LATENCY_WINDOW = int(os.getenv("FAL_LATENCY_WINDOW", "200"))
+
+
+class HedgeSkipped(Exception):
+    """The hedge guard had no spare capacity, so no duplicate was submitted."""
+
+
+class Superseded(Exception):
+    """Raised in a request that lost to its duplicate and was cancelled."""
+
+
+class LatencyHistogram:
+    """Rolling window of recently observed latencies (seconds)."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns the p-th percentile (0-1) of the window, or None if empty."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(int(p * len(samples)), len(samples) - 1)
+        return samples[index]
+
+
+class HedgePolicy:
+    """
+    Decides when (and whether) a slow request gets a duplicate.
+
+    The hedge delay is a percentile of the latency histogram; the budget caps
+    hedges to a fraction of all primary requests so tail-latency insurance
+    can't double the model bill.
+    """
+
+    def __init__(self, histogram: LatencyHistogram, enabled: bool = HEDGE_ENABLED,
+                 percentile: float = HEDGE_PERCENTILE, min_samples: int = HEDGE_MIN_SAMPLES,
+                 budget: float = HEDGE_BUDGET):
+        self.histogram = histogram
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.budget = budget
+        self.primary_requests = 0
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None if hedging shouldn't happen."""
+        if not self.enabled or len(self.histogram) < self.min_samples:
+            return None
+        return self.histogram.percentile(self.percentile)
+
+    def record_primary(self):
+        with self._lock:
+            self.primary_requests += 1
+
+    def try_acquire_hedge(self) -> bool:
+        """Reserves budget for one hedge; False if the budget is used up."""
+        with self._lock:
+            if self.hedged_requests + 1 > self.budget * max(self.primary_requests, 1):
+                return False
+            self.hedged_requests += 1
+            return True
+
+    def refund_hedge(self):
+        """Returns a reserved hedge to the budget (it was never submitted)."""
+        with self._lock:
+            self.hedged_requests = max(self.hedged_requests - 1, 0)
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "primary_requests": self.primary_requests,
+                "hedged_requests": self.hedged_requests,
+                "hedge_wins": self.hedge_wins,
+                "p50": self.histogram.percentile(0.5),
+                "hedge_delay": self.hedge_delay(),
+            }
+
+
+def run_hedged(submit: Callable[[], Any], wait_result: Callable[[Any], Any],
+               cancel: Callable[[Any], None], policy: HedgePolicy,
+               token: Optional[CancelToken] = None,
+               hedge_guard: Optional[Callable[[], ContextManager[bool]]] = None) -> Any:
+    """
+    Runs a request with optional hedging.
+
+    `submit()` starts a request and returns its handle, `wait_result(handle)`
+    blocks until the result is available, and `cancel(handle)` aborts it.
+    If the primary hasn't finished within the policy's hedge delay (and the
+    budget allows), a duplicate is submitted; the first result wins and the
+    other request is cancelled. Successful latencies feed the histogram.
+    If `token` is cancelled, every submitted request is cancelled and
+    WorkflowCancelled is raised.
+
+    The caller holds the provider's capacity (scheduler slot, breaker) for
+    the primary only. `hedge_guard()` is entered around the duplicate and
+    yields whether it may run - e.g. a spare scheduler slot plus breaker
+    tracking of its own, so a hedge never runs on capacity nobody sees.
+    A loser that errors after being cancelled raises Superseded.
+    """
+    token = token or NEVER_CANCELLED
+    token.raise_if_cancelled()
+    policy.record_primary()
+    start = time.monotonic()
+    settled = threading.Event()
+
+    def attempt(hedge: bool = False):
+        token.raise_if_cancelled()
+        with (hedge_guard() if hedge and hedge_guard else nullcontext(True)) as allowed:
+            if not allowed:
+                policy.refund_hedge()
+                raise HedgeSkipped()
+            handle = submit()
+            handles.append(handle)
+            unregister = token.on_cancel(lambda: cancel(handle))
+            try:
+                return handle, wait_result(handle)
+            except Exception as e:
+                if settled.is_set():
+                    raise Superseded() from e
+                raise
+            finally:
+                unregister()
+
+    handles = []
+    pool = ThreadPoolExecutor(max_workers=2)
+    try:
+        # Attempts run in pool threads - keep the caller's ledger scope for them
+        attempt = carry_context(attempt)
+        primary = pool.submit(attempt)
+        pending = {primary}
+
+        delay = policy.hedge_delay()
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done and policy.try_acquire_hedge():
+                print(f"Request still running after {delay:.1f}s (p{int(policy.percentile * 100)}) - submitting hedge...")
+                pending.add(pool.submit(attempt, True))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            token.raise_if_cancelled()
+            for future in done:
+                try:
+                    winner, result = future.result()
+                except HedgeSkipped:
+                    print("No spare capacity for a hedge - waiting on the primary request.")
+                    continue
+                except Exception as e:
+                    error = e
+                    continue
+
+                settled.set()
+                policy.histogram.record(time.monotonic() - start)
+                if future is not primary:
+                    policy.record_hedge_win()
+                    print("Hedged request finished first.")
+                for handle in handles:
+                    if handle is not winner:
+                        try:
+                            cancel(handle)
+                        except Exception as e:
+                            print(f"Warning: Could not cancel duplicate request: {e}")
+                return result
+
+        raise error
+    finally:
+        # Don't block on the losing request - it has been cancelled
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+_policy: Optional[HedgePolicy] = None
+_policy_lock = threading.Lock()
+
+
+def get_fal_hedge_policy() -> HedgePolicy:
+    """Returns the process-wide hedge policy for fal.ai model requests."""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = HedgePolicy(LatencyHistogram())
+        return _policy
@@ -0,0 +1,96 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+# --- Quality Pre-screen Configuration ---
+# Metrics are computed on a downscaled copy so thresholds don't depend on camera resolution
+ANALYSIS_SIZE = 1024                                                   # long side, pixels
+BLUR_WARN = float(os.getenv("QUALITY_BLUR_WARN", "40"))               # Laplacian variance below this: badly blurred
+BLUR_SHARP = float(os.getenv("QUALITY_BLUR_SHARP", "250"))            # at or above this: sharp enough to skip
+MIN_SHORT_SIDE = int(os.getenv("QUALITY_MIN_SHORT_SIDE", "720"))      # smaller photos look soft in a 1080p video
+GOOD_SHORT_SIDE = int(os.getenv("QUALITY_GOOD_SHORT_SIDE", "1080"))
+BRIGHTNESS_RANGE = (90, 170)                                           # well-exposed mean luminance
+CLIP_LEVEL = 0.02                                                      # max fraction of crushed shadows / blown highlights
+CLIP_WARN = 0.25                                                       # beyond this the detail is gone for good
+# Skip the model for photos that are already good (only in "auto" enhancement mode)
+QUALITY_SKIP_ENABLED = os.getenv("QUALITY_SKIP_ENABLED", "true").lower() in ("1", "true", "yes")
+
+EXIF_ORIENTATION = 0x0112
+
+SKIP = "skip"
+ENHANCE = "enhance"
+WARN = "warn"
+
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    """Variance of the 4-neighbour Laplacian - low values mean a blurry image."""
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4 * gray[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def exposure_metrics(gray: np.ndarray) -> Dict[str, float]:
+    """Mean brightness and the fractions of crushed shadows / blown highlights."""
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256) / gray.size
+    return {
+        "brightness": float(np.dot(histogram, np.arange(256))),
+        "shadows": float(histogram[:11].sum()),
+        "highlights": float(histogram[245:].sum()),
+    }
+
+
+def _verdict(metrics: Dict[str, Any]) -> Tuple[str, List[str]]:
+    issues = []
+    short_side = min(metrics["width"], metrics["height"])
+    low, high = BRIGHTNESS_RANGE
+
+    if short_side < MIN_SHORT_SIDE:
+        issues.append(f"Low resolution ({metrics['width']}x{metrics['height']})")
+    if metrics["blur"] < BLUR_WARN:
+        issues.append("Very blurry")
+    if metrics["shadows"] > CLIP_WARN:
+        issues.append("Very dark - shadow detail lost")
+    if metrics["highlights"] > CLIP_WARN:
+        issues.append("Overexposed - highlight detail lost")
+    if issues:
+        return WARN, issues
+
+    well_exposed = (low <= metrics["brightness"] <= high
+                    and metrics["shadows"] <= CLIP_LEVEL and metrics["highlights"] <= CLIP_LEVEL)
+    if metrics["blur"] >= BLUR_SHARP and well_exposed and short_side >= GOOD_SHORT_SIDE:
+        return SKIP, []
+    return ENHANCE, []
+
+
+def assess_image(file_path: str) -> Dict[str, Any]:
+    """
+    Measures a photo's resolution, sharpness and exposure and decides what to
+    do with it: "skip" (already good, no enhancement needed), "enhance", or
+    "warn" (enhance, but tell the user the photo has problems enhancement
+    can't fix). Returns the metrics with "verdict" and "issues".
+    """
+    with Image.open(file_path) as image:
+        width, height = image.size
+        if image.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8):  # rotated 90 degrees
+            width, height = height, width
+        image.draft("L", (ANALYSIS_SIZE, ANALYSIS_SIZE))  # fast JPEG decode at reduced scale
+        analysis = image.convert("L")
+    analysis.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    gray = np.asarray(analysis, dtype=np.float32)
+
+    metrics = {
+        "width": width,
+        "height": height,
+        "blur": round(laplacian_variance(gray), 1),
+        **{name: round(value, 3) for name, value in exposure_metrics(gray).items()},
+    }
+    metrics["verdict"], metrics["issues"] = _verdict(metrics)
+    return metrics
+
+
+def format_quality(metrics: Dict[str, Any]) -> str:
+    """One-line summary of a photo's quality metrics for the review step."""
+    return (f"{metrics['width']}x{metrics['height']} · sharpness {metrics['blur']:.0f} · "
+            f"brightness {metrics['brightness']:.0f}")
@@ -0,0 +1,380 @@
+"""
+Lease table that coordinates several app or worker processes on one
+host (each an "instance"): which instance drives a workflow thread, which
+one polls a render, and which one submits a render for a payload.
+
+Every instance heartbeats the leases its work is still using (touched
+recently, or held for a block of work); a lease nobody renews expires
+after LEASE_TTL seconds and the next instance that asks for the resource
+takes it over, so the work of a crashed or stalled instance is picked up
+without anyone coordinating by hand.
+
+The table is SQLite in WAL mode, which needs shared memory between the
+processes using it: instances must run on the same host (e.g. several
+app or worker processes, or containers sharing a local volume). Point
+LEASE_DB_PATH (and RENDER_CACHE_DIR, so renders are reused across
+instances) at a local disk they all mount - never at a network
+filesystem (NFS, SMB, EFS), where WAL locking is not safe. Running on
+several hosts would need a different lease store; LeaseManager is the
+only implementation.
+
+Workflow checkpoints live in each process's own memory (checkpoints.py).
+A thread lease keeps two processes from driving the same thread at once,
+but a thread claimed from a dead process can only be resumed if the
+graph was compiled with a checkpointer every process shares; with the
+default one, the session has to start again. Render and render-submit
+leases do carry over, since renders are shared through RENDER_CACHE_DIR.
+
+Usage:
+    python leases.py status
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import atexit
+import sqlite3
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# --- Lease Configuration ---
+# Local disk shared by the instances of one host - not a network filesystem (see above)
+LEASE_DB_PATH = os.getenv(
+    "LEASE_DB_PATH",
+    os.path.join(tempfile.gettempdir(), "video_generator_leases.sqlite3")
+)
+LEASES_ENABLED = os.getenv("LEASES_ENABLED", "true").lower() in ("1", "true", "yes")
+# A lease not renewed for this long belongs to a dead instance and can be taken over
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+# Resource name prefixes
+THREAD = "thread"
+RENDER = "render"
+RENDER_SUBMIT = "render-submit"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    resource TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    acquired_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS leases_owner ON leases (owner);
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started_at REAL NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+def resource_name(kind: str, name: str) -> str:
+    return f"{kind}:{name}"
+
+
+class LeaseManager:
+    """
+    SQLite-backed leases for one instance. Lease operations never raise: if
+    the table can't be reached, `acquire` grants the lease, so a broken
+    coordination store degrades to every instance doing its own work
+    rather than to nobody doing it.
+    """
+
+    def __init__(self, path: str = LEASE_DB_PATH, instance_id: str = INSTANCE_ID,
+                 ttl: float = LEASE_TTL, enabled: bool = LEASES_ENABLED):
+        self.path = path
+        self.instance_id = instance_id
+        self.ttl = ttl
+        self.enabled = enabled
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._heartbeat: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._started_at = time.time()
+        self._touched: Dict[str, float] = {}  # resource -> last time our work used it
+        self._held: Dict[str, int] = {}  # resource -> blocks of work holding it (see hold)
+        self._threads: Dict[str, str] = {}  # resource -> workflow thread it was taken for
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _start_heartbeat(self):
+        """Starts renewing this instance's leases in the background (once)."""
+        if self._heartbeat is not None:
+            return
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+        atexit.register(self.release_all)
+
+    def _heartbeat_loop(self):
+        while True:
+            self.heartbeat()
+            if self._stopped.wait(self.ttl / 3):
+                return
+
+    def heartbeat(self):
+        """
+        Renews the leases this instance's work is still using - held by a
+        block of work, or touched within the last TTL - and marks the
+        instance alive. A lease left behind by work that stalled or was
+        abandoned is not renewed and expires, so another instance can take
+        it over.
+        """
+        now = time.time()
+        try:
+            with self._lock:
+                active = [resource for resource, touched_at in self._touched.items()
+                          if resource in self._held or now - touched_at < self.ttl]
+                # Long expired by now; stop tracking
+                for resource in [resource for resource, touched_at in self._touched.items()
+                                 if resource not in self._held and now - touched_at > 2 * self.ttl]:
+                    self._forget(resource)
+                connection = self._connection()
+                connection.execute(
+                    "INSERT INTO instances (instance_id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT (instance_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                    (self.instance_id, socket.gethostname(), os.getpid(), self._started_at, now),
+                )
+                if active:
+                    connection.execute(
+                        f"UPDATE leases SET expires_at = ? WHERE owner = ?"
+                        f" AND resource IN ({', '.join('?' * len(active))})",
+                        (now + self.ttl, self.instance_id, *active),
+                    )
+        except sqlite3.Error as e:
+            print(f"Warning: Could not renew leases: {e}")
+
+    def _forget(self, resource: str):
+        """Stops tracking a lease. Caller holds the lock."""
+        self._touched.pop(resource, None)
+        self._threads.pop(resource, None)
+
+    def touch(self, resource: str):
+        """Marks a lease we hold as still in use, so the heartbeat keeps renewing it."""
+        if not self.enabled:
+            return
+        with self._lock:
+            if resource in self._touched:
+                self._touched[resource] = time.time()
+
+    @contextmanager
+    def hold(self, resource: str):
+        """Keeps a lease we hold renewed while the block of work runs, however long it takes."""
+        if not self.enabled:
+            yield
+            return
+        with self._lock:
+            self._held[resource] = self._held.get(resource, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                remaining = self._held.pop(resource) - 1
+                if remaining:
+                    self._held[resource] = remaining
+                if resource in self._touched:
+                    self._touched[resource] = time.time()
+
+    def acquire(self, resource: str, thread_id: Optional[str] = None) -> bool:
+        """
+        Takes the lease on `resource` if it is free, expired, or already ours,
+        and marks it in use. Leases taken for a workflow thread are given up
+        with it (see release_thread). Returns False only while another live
+        instance holds it.
+        """
+        if not self.enabled:
+            return True
+        now = time.time()
+        try:
+            with self._lock:
+                self._start_heartbeat()
+                # One statement, so two instances can't both take a free lease
+                row = self._connection().execute(
+                    "INSERT INTO leases (resource, owner, acquired_at, expires_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (resource) DO UPDATE SET owner = excluded.owner,"
+                    " acquired_at = CASE WHEN leases.owner = excluded.owner THEN leases.acquired_at"
+                    " ELSE excluded.acquired_at END, expires_at = excluded.expires_at"
+                    " WHERE leases.owner = excluded.owner OR leases.expires_at < excluded.acquired_at"
+                    " RETURNING owner",
+                    (resource, self.instance_id, now, now + self.ttl),
+                ).fetchone()
+                if row is not None:
+                    self._touched[resource] = now
+                    if thread_id:
+                        self._threads[resource] = thread_id
+        except sqlite3.Error as e:
+            print(f"Warning: Could not acquire lease {resource}: {e}")
+            return True
+        return row is not None
+
+    def release(self, resource: str):
+        """Gives up the lease (if we hold it) so another instance can take it at once."""
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                self._forget(resource)
+                self._connection().execute("DELETE FROM leases WHERE resource = ? AND owner = ?",
+                                           (resource, self.instance_id))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not release lease {resource}: {e}")
+
+    def release_thread(self, thread_id: str):
+        """
+        Gives up a cancelled or pruned workflow thread's lease and every lease
+        taken for it (e.g. its renders), so other instances neither wait for
+        them nor read the status last published on them.
+        """
+        if not self.enabled or not thread_id:
+            return
+        try:
+            with self._lock:
+                resources = [resource_name(THREAD, thread_id)]
+                resources += [resource for resource, owner in self._threads.items() if owner == thread_id]
+                for resource in resources:
+                    self._forget(resource)
+                self._connection().execute(
+                    f"DELETE FROM leases WHERE owner = ? AND resource IN ({', '.join('?' * len(resources))})",
+                    (self.instance_id, *resources),
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: Could not release leases of thread {thread_id}: {e}")
+
+    def release_all(self):
+        """Releases every lease of this instance (on shutdown), so failover doesn't wait for the TTL."""
+        self._stopped.set()
+        if not self.enabled or self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._touched.clear()
+                self._threads.clear()
+                self._conn.execute("DELETE FROM leases WHERE owner = ?", (self.instance_id,))
+                self._conn.execute("DELETE FROM instances WHERE instance_id = ?", (self.instance_id,))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not release leases: {e}")
+
+    def publish(self, resource: str, data: Dict[str, Any]):
+        """Stores data on a lease we hold (e.g. the latest render status) for the other instances."""
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                if resource in self._touched:
+                    self._touched[resource] = time.time()
+                self._connection().execute("UPDATE leases SET data = ? WHERE resource = ? AND owner = ?",
+                                           (json.dumps(data), resource, self.instance_id))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not publish lease data for {resource}: {e}")
+
+    def read(self, resource: str) -> Optional[Dict[str, Any]]:
+        """Returns the lease (owner, expiry, published data), or None if nobody holds it."""
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT owner, acquired_at, expires_at, data FROM leases WHERE resource = ?", (resource,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read lease {resource}: {e}")
+            return None
+        if row is None:
+            return None
+        owner, acquired_at, expires_at, data = row
+        return {
+            "owner": owner,
+            "acquired_at": acquired_at,
+            "expires_at": expires_at,
+            "expired": expires_at < time.time(),
+            "data": json.loads(data) if data else None,
+        }
+
+    def snapshot(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Live instances and current leases, for the UI and CLI."""
+        if not self.enabled:
+            return {"instances": [], "leases": []}
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connection()
+                instances = connection.execute(
+                    "SELECT instance_id, host, pid, started_at, heartbeat_at FROM instances"
+                    " WHERE heartbeat_at >= ? ORDER BY started_at", (now - self.ttl,)
+                ).fetchall()
+                leases = connection.execute(
+                    "SELECT resource, owner, acquired_at, expires_at FROM leases ORDER BY resource"
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read leases: {e}")
+            return {"instances": [], "leases": []}
+        return {
+            "instances": [
+                {"instance_id": row[0], "host": row[1], "pid": row[2], "started_at": row[3], "heartbeat_at": row[4]}
+                for row in instances
+            ],
+            "leases": [
+                {"resource": row[0], "owner": row[1], "acquired_at": row[2], "expires_at": row[3],
+                 "expired": row[3] < now}
+                for row in leases
+            ],
+        }
+
+
+_manager: Optional[LeaseManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_lease_manager() -> LeaseManager:
+    """Returns this instance's lease manager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = LeaseManager()
+        return _manager
+
+
+def format_lease_status(snapshot: Dict[str, List[Dict[str, Any]]]) -> str:
+    """Formats instances and leases, grouping leases by owner."""
+    lines = [f"{len(snapshot['instances'])} live instance(s):"]
+    for instance in snapshot["instances"]:
+        owned = [lease for lease in snapshot["leases"] if lease["owner"] == instance["instance_id"]]
+        lines.append(f"  {instance['instance_id']}: {len(owned)} lease(s), "
+                     f"last heartbeat {time.time() - instance['heartbeat_at']:.0f}s ago")
+        for lease in owned:
+            lines.append(f"    {lease['resource']}")
+    orphaned = [lease for lease in snapshot["leases"] if lease["expired"]]
+    if orphaned:
+        lines.append(f"{len(orphaned)} expired lease(s), waiting for another instance to take over:")
+        for lease in orphaned:
+            lines.append(f"  {lease['resource']} (was {lease['owner']})")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Live instances and the leases they hold")
+    parser.parse_args()
+
+    if not os.path.exists(LEASE_DB_PATH):
+        print(f"No lease table at {LEASE_DB_PATH}")
+        return
+    print(format_lease_status(get_lease_manager().snapshot()))
+
+
+if __name__ == "__main__":
+    main()
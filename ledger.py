@@ -0,0 +1,336 @@
+"""
+Append-only ledger of external calls (fal.ai, Creatomate, local engines):
+one row per call with the job, node, provider, duration, bytes, retries
+and outcome - the data for tuning concurrency limits and cache sizes.
+
+Usage:
+    python ledger.py report [--days 7]
+    python ledger.py job <thread_id>
+"""
+import os
+import time
+import sqlite3
+import argparse
+import tempfile
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from cancellation import WorkflowCancelled
+from circuit_breaker import CircuitOpenError
+
+# --- Ledger Configuration ---
+LEDGER_PATH = os.getenv(
+    "LEDGER_PATH",
+    os.path.join(tempfile.gettempdir(), "video_generator_ledger.sqlite3")
+)
+LEDGER_ENABLED = os.getenv("LEDGER_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Estimated cost (USD) of a successful call, by (provider, operation)
+COSTS = {
+    ("fal", "enhance"): float(os.getenv("FAL_COST_PER_IMAGE", "0.039")),
+    ("creatomate", "render"): float(os.getenv("CREATOMATE_COST_PER_RENDER", "0")),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    thread_id TEXT,
+    node TEXT,
+    provider TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    ref TEXT,
+    duration REAL NOT NULL DEFAULT 0,
+    bytes_sent INTEGER NOT NULL DEFAULT 0,
+    bytes_received INTEGER NOT NULL DEFAULT 0,
+    retries INTEGER NOT NULL DEFAULT 0,
+    outcome TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS calls_ts ON calls (ts);
+CREATE INDEX IF NOT EXISTS calls_thread ON calls (thread_id);
+CREATE INDEX IF NOT EXISTS calls_ref ON calls (ref);
+CREATE TABLE IF NOT EXISTS jobs (
+    thread_id TEXT PRIMARY KEY,
+    ts REAL NOT NULL,
+    agent TEXT,
+    email TEXT,
+    template_id TEXT,
+    photos INTEGER
+);
+"""
+
+# (thread_id, node, tenant) of the graph node currently running in this context
+_scope: contextvars.ContextVar[Tuple[Optional[str], Optional[str], Optional[str]]] = contextvars.ContextVar(
+    "ledger_scope", default=(None, None, None)
+)
+
+
+def job_scope(node_fn: Callable) -> Callable:
+    """
+    Decorator for graph nodes: calls recorded while the node runs are
+    attributed to its workflow thread and node name, and scheduled for its
+    tenant (all from the run config; the tenant defaults to the thread).
+    """
+    @functools.wraps(node_fn)
+    def wrapper(state, config):
+        configurable = (config or {}).get("configurable") or {}
+        thread_id = configurable.get("thread_id")
+        node = ((config or {}).get("metadata") or {}).get("langgraph_node", node_fn.__name__)
+        reset = _scope.set((thread_id, node, configurable.get("tenant") or thread_id))
+        try:
+            return node_fn(state, config)
+        finally:
+            _scope.reset(reset)
+    return wrapper
+
+
+def current_scope() -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """The (thread_id, node, tenant) of the graph node running in this context."""
+    return _scope.get()
+
+
+def carry_context(fn: Callable) -> Callable:
+    """
+    Wraps `fn` so it runs with the caller's ledger scope when handed to a
+    thread pool (executor threads don't inherit context variables).
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+class CallRecord:
+    """Details of a call in progress; fill in what is known before the block exits."""
+
+    def __init__(self, bytes_sent: int = 0, retries: int = 0, ref: Optional[str] = None):
+        self.bytes_sent = bytes_sent
+        self.bytes_received = 0
+        self.retries = retries
+        self.ref = ref
+
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, WorkflowCancelled):
+        return "cancelled"
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    return "error"
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest-rank percentile (p in 0-1) of `values`, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+
+def _seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+class Ledger:
+    """SQLite-backed call ledger. Recording never raises - a broken ledger must not break a job."""
+
+    def __init__(self, path: str = LEDGER_PATH, enabled: bool = LEDGER_ENABLED):
+        self.path = path
+        self.enabled = enabled
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def _write(self, sql: str, params: tuple):
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                self._connection().execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write to ledger: {e}")
+
+    def record(self, provider: str, operation: str, duration: float = 0.0, outcome: str = "ok",
+               ref: Optional[str] = None, bytes_sent: int = 0, bytes_received: int = 0, retries: int = 0):
+        """Appends one call to the ledger, attributed to the current job scope."""
+        thread_id, node, _ = _scope.get()
+        cost = COSTS.get((provider, operation), 0.0) if outcome == "ok" else 0.0
+        self._write(
+            "INSERT INTO calls (ts, thread_id, node, provider, operation, ref, duration, bytes_sent,"
+            " bytes_received, retries, outcome, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (time.time(), thread_id, node, provider, operation, ref, duration, bytes_sent,
+             bytes_received, retries, outcome, cost),
+        )
+
+    @contextmanager
+    def track(self, provider: str, operation: str, bytes_sent: int = 0, retries: int = 0,
+              ref: Optional[str] = None):
+        """Times the block and records it as one call; the outcome comes from how it exits."""
+        call = CallRecord(bytes_sent, retries, ref)
+        start = time.monotonic()
+        error = None
+        try:
+            yield call
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.record(provider, operation, time.monotonic() - start, _outcome(error), call.ref,
+                        call.bytes_sent, call.bytes_received, call.retries)
+
+    def record_render(self, provider: str, render_id: str, status: str):
+        """
+        Records a finished render, timed from the first call that mentioned
+        its render_id (the submission).
+        """
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT MIN(ts) FROM calls WHERE ref = ?", (render_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read ledger: {e}")
+            return
+        started = row[0] if row and row[0] else time.time()
+        self.record(provider, "render", time.time() - started,
+                    "ok" if status == "succeeded" else status, ref=render_id)
+
+    def record_job(self, thread_id: Optional[str], agent: str, email: str, template_id: str, photos: int):
+        """Registers a workflow thread with the agent it belongs to (first call wins)."""
+        if not thread_id:
+            return
+        self._write(
+            "INSERT OR IGNORE INTO jobs (thread_id, ts, agent, email, template_id, photos)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (thread_id, time.time(), agent, email, template_id, photos),
+        )
+
+    def query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            connection = self._connection()
+            connection.row_factory = sqlite3.Row
+            try:
+                return connection.execute(sql, params).fetchall()
+            finally:
+                connection.row_factory = None
+
+    def report(self, since: float = 0.0) -> str:
+        """Per-stage latency, per-agent volume and regeneration rates since a timestamp."""
+        lines = []
+
+        calls = self.query("SELECT * FROM calls WHERE ts >= ?", (since,))
+        stages: Dict[Tuple[str, str, str], List[sqlite3.Row]] = {}
+        for call in calls:
+            stages.setdefault((call["node"] or "-", call["provider"], call["operation"]), []).append(call)
+
+        lines.append(f"{'Stage (node / provider.operation)':<44} {'calls':>6} {'errors':>6} "
+                     f"{'p50 s':>8} {'p95 s':>8} {'MB':>8} {'cost $':>8}")
+        lines.append("-" * 94)
+        for (node, provider, operation), rows in sorted(stages.items()):
+            durations = [row["duration"] for row in rows if row["outcome"] == "ok"]
+            errors = sum(1 for row in rows if row["outcome"] not in ("ok", "cancelled"))
+            megabytes = sum(row["bytes_sent"] + row["bytes_received"] for row in rows) / 1e6
+            p50, p95 = percentile(durations, 0.5), percentile(durations, 0.95)
+            lines.append(
+                f"{node + ' / ' + provider + '.' + operation:<44} {len(rows):>6} {errors:>6} "
+                f"{_seconds(p50):>8} {_seconds(p95):>8} "
+                f"{megabytes:>8.2f} {sum(row['cost'] for row in rows):>8.2f}"
+            )
+
+        agents = self.query(
+            "SELECT COALESCE(j.email, j.agent, '(unknown)') AS agent, COUNT(DISTINCT j.thread_id) AS jobs,"
+            " SUM(CASE WHEN c.provider = 'fal' AND c.operation = 'enhance' THEN 1 ELSE 0 END) AS model_runs,"
+            " SUM(CASE WHEN c.operation = 'render' THEN 1 ELSE 0 END) AS renders,"
+            " COALESCE(SUM(c.cost), 0) AS cost"
+            " FROM jobs j LEFT JOIN calls c ON c.thread_id = j.thread_id"
+            " WHERE j.ts >= ? GROUP BY 1 ORDER BY jobs DESC", (since,)
+        )
+        lines.append("")
+        lines.append(f"{'Agent':<44} {'jobs':>6} {'model':>6} {'renders':>8} {'cost $':>8}")
+        lines.append("-" * 76)
+        for row in agents:
+            lines.append(f"{row['agent']:<44} {row['jobs']:>6} {row['model_runs'] or 0:>6} "
+                         f"{row['renders'] or 0:>8} {row['cost']:>8.2f}")
+
+        regen = self.query(
+            "SELECT COUNT(*) AS jobs, COALESCE(SUM(photos), 0) AS photos,"
+            " SUM(CASE WHEN r.regenerated > 0 THEN 1 ELSE 0 END) AS regenerated_jobs,"
+            " COALESCE(SUM(r.regenerated), 0) AS regenerated_photos"
+            " FROM jobs j LEFT JOIN (SELECT thread_id, COUNT(*) AS regenerated FROM calls"
+            " WHERE operation = 'regenerate_photo' GROUP BY thread_id) r ON r.thread_id = j.thread_id"
+            " WHERE j.ts >= ?", (since,)
+        )[0]
+        lines.append("")
+        if regen["jobs"]:
+            lines.append(f"Regeneration: {regen['regenerated_jobs']}/{regen['jobs']} jobs "
+                         f"({regen['regenerated_jobs'] / regen['jobs']:.0%}), "
+                         f"{regen['regenerated_photos']}/{regen['photos']} photos "
+                         f"({regen['regenerated_photos'] / max(regen['photos'], 1):.0%})")
+        else:
+            lines.append("Regeneration: no jobs recorded")
+        return "\n".join(lines)
+
+    def job_report(self, thread_id: str) -> str:
+        """Every recorded call of one workflow thread, in order."""
+        rows = self.query("SELECT * FROM calls WHERE thread_id = ? ORDER BY ts", (thread_id,))
+        if not rows:
+            return f"No calls recorded for {thread_id}"
+        start = rows[0]["ts"]
+        lines = [f"{'t+s':>7} {'node':<22} {'provider.operation':<28} {'s':>7} {'outcome':<12} ref"]
+        for row in rows:
+            lines.append(f"{row['ts'] - start:>7.1f} {row['node'] or '-':<22} "
+                         f"{row['provider'] + '.' + row['operation']:<28} {row['duration']:>7.2f} "
+                         f"{row['outcome']:<12} {row['ref'] or ''}")
+        lines.append(f"Total cost: ${sum(row['cost'] for row in rows):.2f}")
+        return "\n".join(lines)
+
+
+_ledger: Optional[Ledger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> Ledger:
+    """Returns the process-wide call ledger."""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = Ledger()
+        return _ledger
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    report = commands.add_parser("report", help="Latency per stage, volume per agent, regeneration rates")
+    report.add_argument("--days", type=float, default=7, help="Only include the last N days")
+    job = commands.add_parser("job", help="Timeline of one workflow thread")
+    job.add_argument("thread_id")
+    args = parser.parse_args()
+
+    if not os.path.exists(LEDGER_PATH):
+        print(f"No ledger at {LEDGER_PATH}")
+        return
+    ledger = get_ledger()
+    if args.command == "report":
+        print(ledger.report(since=time.time() - args.days * 86400))
+    else:
+        print(ledger.job_report(args.thread_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# --- Local Enhancement Configuration ---
+TARGET_ASPECT = 9 / 16              # width / height of the video frame (9:16 templates)
+MAX_OUTPUT_SIDE = 1920              # no point sending Creatomate more than the frame
+LEVELS_CLIP_PERCENT = 0.5           # % of darkest/brightest pixels clipped by auto-levels
+WB_MAX_GAIN = 1.25                  # keep white balance corrections modest
+LOCAL_ENHANCE_WORKERS = int(os.getenv("LOCAL_ENHANCE_WORKERS", str(os.cpu_count() or 2)))
+
+
+def auto_levels(pixels: np.ndarray, clip_percent: float = LEVELS_CLIP_PERCENT) -> np.ndarray:
+    """Stretches each channel so its clipped min/max map to 0/255."""
+    low = np.percentile(pixels, clip_percent, axis=(0, 1))
+    high = np.percentile(pixels, 100 - clip_percent, axis=(0, 1))
+    scale = 255.0 / np.maximum(high - low, 1.0)
+    return np.clip((pixels - low) * scale, 0, 255)
+
+
+def white_balance(pixels: np.ndarray, max_gain: float = WB_MAX_GAIN) -> np.ndarray:
+    """Gray-world white balance: scales channels so their means match."""
+    means = pixels.reshape(-1, 3).mean(axis=0)
+    gains = np.clip(means.mean() / np.maximum(means, 1.0), 1 / max_gain, max_gain)
+    return np.clip(pixels * gains, 0, 255)
+
+
+def _best_window(energy: np.ndarray, size: int) -> int:
+    """
+    Returns the start of the `size`-long window with the most detail,
+    with a mild bias towards the centre so crops don't hug an edge.
+    """
+    sums = np.concatenate(([0.0], np.cumsum(energy)))
+    window_sums = sums[size:] - sums[:-size]
+    offsets = np.arange(len(window_sums))
+    centre = (len(energy) - size) / 2
+    bias = 1.0 - 0.3 * np.abs(offsets - centre) / max(centre, 1.0)
+    return int(np.argmax(window_sums * bias))
+
+
+def smart_crop(image: Image.Image, aspect: float = TARGET_ASPECT) -> Image.Image:
+    """Crops to `aspect` (width / height), keeping the most detailed region."""
+    width, height = image.size
+    gray = np.asarray(image.convert("L"), dtype=np.float32)
+    gradient = np.abs(np.diff(gray, axis=0))[:, :-1] + np.abs(np.diff(gray, axis=1))[:-1, :]
+
+    if width / height > aspect:
+        crop_width = int(round(height * aspect))
+        left = _best_window(gradient.sum(axis=0), crop_width)
+        return image.crop((left, 0, left + crop_width, height))
+
+    crop_height = int(round(width / aspect))
+    if crop_height >= height:
+        return image
+    top = _best_window(gradient.sum(axis=1), crop_height)
+    return image.crop((0, top, width, top + crop_height))
+
+
+def enhance_image_file(source_path: str, output_path: str, aspect: float = TARGET_ASPECT) -> str:
+    """
+    Enhances one photo locally (auto-levels, white balance, unsharp mask,
+    smart crop to the template's `aspect`) and writes it as a JPEG. Runs in
+    a worker process.
+    """
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+    image = smart_crop(image, aspect)
+    image.thumbnail((MAX_OUTPUT_SIDE, MAX_OUTPUT_SIDE), Image.LANCZOS)
+
+    pixels = np.asarray(image, dtype=np.float32)
+    pixels = white_balance(auto_levels(pixels))
+    image = Image.fromarray(pixels.astype(np.uint8))
+    image = image.filter(ImageFilter.UnsharpMask(radius=2, percent=80, threshold=3))
+
+    image.save(output_path, "JPEG", quality=90, optimize=True)
+    return output_path
+
+
+def enhanced_path_for(source_path: str, placeholder: str) -> str:
+    """Output path for a locally enhanced photo, next to its source in the job directory."""
+    directory, name = os.path.split(source_path)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(directory, f"enhanced_{placeholder}_{stem}.jpg")
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_enhance_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared process pool for local enhancement. Uses 'spawn' so
+    workers don't inherit the threads of the Streamlit/LangGraph process.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=LOCAL_ENHANCE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
@@ -0,0 +1,146 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+# --- Local Render Configuration ---
+FRAME_SIZE = (1080, 1920)           # 9:16, same as the Creatomate templates
+SLIDE_SECONDS = float(os.getenv("LOCAL_RENDER_SLIDE_SECONDS", "3"))
+FRAME_RATE = 30
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+LOCAL_RENDER_FONT = os.getenv("LOCAL_RENDER_FONT", "DejaVuSans-Bold.ttf")
+# Where rendered MP4s are kept. Unset: a scratch directory per workflow thread
+# (see scratch.py), deleted when the thread is released or pruned
+LOCAL_RENDER_DIR = os.getenv("LOCAL_RENDER_DIR") or None
+DOWNLOAD_TIMEOUT = 30
+
+# Which text field is captioned on which photo slide; the rest go on the closing card
+SLIDE_CAPTIONS = ["Address.text", "Details-1.text", "Details-2.text"]
+CONTACT_FIELDS = ["Name.text", "Brand-Name.text", "Email.text", "Phone-Number.text"]
+
+_PHOTO_KEY = re.compile(r"^Photo-(\d+)\.source$")
+
+
+def ffmpeg_available() -> bool:
+    """Whether the ffmpeg binary used for local renders can be found."""
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+def _load_image(source: str) -> Image.Image:
+    """Opens an image from a local path or an http(s) URL."""
+    if source.startswith(("http://", "https://")):
+        import requests
+
+        response = requests.get(source, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        image = Image.open(io.BytesIO(response.content))
+    else:
+        image = Image.open(source)
+    return ImageOps.exif_transpose(image).convert("RGB")
+
+
+def _font(size: int) -> ImageFont.FreeTypeFont:
+    try:
+        return ImageFont.truetype(LOCAL_RENDER_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _draw_panel(frame: Image.Image, text: str, scale: float, top: Optional[int] = None):
+    """Draws `text` on a translucent panel, near the bottom unless `top` is given."""
+    draw = ImageDraw.Draw(frame, "RGBA")
+    margin = int(60 * scale)
+    padding = int(36 * scale)
+    spacing = int(16 * scale)
+
+    # Shrink the font until the longest line fits the panel
+    font_size = int(56 * scale)
+    while True:
+        font = _font(max(font_size, 10))
+        left, upper, right, lower = draw.multiline_textbbox((0, 0), text, font=font, spacing=spacing)
+        if right - left <= frame.width - 2 * (margin + padding) or font_size <= 10:
+            break
+        font_size -= 4
+    box_height = lower - upper + 2 * padding
+    y = top if top is not None else frame.height - box_height - int(240 * scale)
+    draw.rounded_rectangle(
+        (margin, y, frame.width - margin, y + box_height),
+        radius=int(28 * scale), fill=(0, 0, 0, 150)
+    )
+    draw.multiline_text((margin + padding, y + padding - upper), text, font=font,
+                        fill=(255, 255, 255, 255), spacing=spacing)
+
+
+def compose_slides(modifications: Dict[str, Any], size=FRAME_SIZE) -> List[Image.Image]:
+    """
+    Lays the template fields out as slides: one per photo (in placeholder
+    order) with the address and details as captions, then a closing card
+    with the agent picture and contact details.
+    """
+    scale = size[0] / FRAME_SIZE[0]
+    photo_keys = sorted(
+        (key for key in modifications if _PHOTO_KEY.match(key)),
+        key=lambda key: int(_PHOTO_KEY.match(key).group(1))
+    )
+    if not photo_keys:
+        raise ValueError("No photos in the payload")
+
+    slides = []
+    for index, key in enumerate(photo_keys):
+        frame = ImageOps.fit(_load_image(modifications[key]), size, Image.LANCZOS)
+        if index < len(SLIDE_CAPTIONS) and modifications.get(SLIDE_CAPTIONS[index], "").strip():
+            _draw_panel(frame, modifications[SLIDE_CAPTIONS[index]].strip(), scale)
+        slides.append(frame)
+
+    # Closing card: last photo, darkened, with the contact details
+    closing = Image.blend(slides[-1], Image.new("RGB", size), 0.6)
+    contact_top = int(size[1] * 0.45)
+    if modifications.get("Picture.source"):
+        picture_size = int(360 * scale)
+        picture = ImageOps.fit(_load_image(modifications["Picture.source"]), (picture_size, picture_size))
+        closing.paste(picture, ((size[0] - picture_size) // 2, contact_top - picture_size - int(60 * scale)))
+    contact = "\n".join(modifications[field].strip() for field in CONTACT_FIELDS
+                        if modifications.get(field, "").strip())
+    if contact:
+        _draw_panel(closing, contact, scale, top=contact_top)
+    slides.append(closing)
+    return slides
+
+
+def render_slideshow(modifications: Dict[str, Any], output_path: str, render_scale: float = 1.0) -> str:
+    """
+    Renders a 9:16 slideshow MP4 from a Creatomate-style modifications dict
+    with Pillow (slides) and ffmpeg (encoding). Runs in a worker process.
+    """
+    if not ffmpeg_available():
+        raise RuntimeError(f"ffmpeg not found ('{FFMPEG_BINARY}') - install it or set FFMPEG_BINARY")
+
+    # H.264 with yuv420p needs even dimensions
+    size = tuple(max(int(side * render_scale) // 2 * 2, 2) for side in FRAME_SIZE)
+    slides = compose_slides(modifications, size)
+
+    with tempfile.TemporaryDirectory(prefix="slides_") as work_dir:
+        for index, slide in enumerate(slides):
+            slide.save(os.path.join(work_dir, f"slide_{index:03d}.png"))
+
+        command = [
+            FFMPEG_BINARY, "-y", "-loglevel", "error",
+            "-framerate", f"1/{SLIDE_SECONDS}",
+            "-i", os.path.join(work_dir, "slide_%03d.png"),
+            # tpad holds the last slide - the image demuxer gives it no duration of its own
+            "-vf", f"fps={FRAME_RATE},tpad=stop_mode=clone:stop_duration={SLIDE_SECONDS},format=yuv420p",
+            "-t", str(len(slides) * SLIDE_SECONDS),
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+            "-movflags", "+faststart",
+            output_path,
+        ]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+
+    return output_path
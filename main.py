@@ -1,41 +1,72 @@
 import os
-from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+import uuid
+from typing import Optional
 from state import GraphState
-from nodes import (
-    process_images_with_fal, 
-    prepare_creatomate_payload, 
-    create_video_render, 
-    check_video_status,
-    wait_for_approval,
-    regenerate_images
-)
+from templates import DEFAULT_TEMPLATE_ID
+
+# langgraph and nodes (fal_client, requests) are imported inside the workflow
+# so that importing this module stays cheap - the Streamlit login page doesn't need them.
 
 # --- Graph Definition ---
 
 class VideoGenerationWorkflow:
     def __init__(self, checkpointer=None):
+        from langgraph.graph import StateGraph
+        from checkpoints import CompactingSaver
+
         self.workflow = StateGraph(GraphState)
-        self.checkpointer = checkpointer or MemorySaver()
+        # Compacts each thread's history and prunes finished threads (see checkpoints.py)
+        self.checkpointer = checkpointer or CompactingSaver(on_prune=forget_thread)
         self._define_graph()
 
     def _define_graph(self):
         """
         Defines the nodes and edges of the LangGraph workflow with HITL approval.
         """
+        from langgraph.graph import START, END
+        from nodes import (
+            start_workflow,
+            finish_workflow,
+            route_photos,
+            enhance_photo,
+            upload_agent_picture,
+            prepare_text_payload,
+            prepare_creatomate_payload, 
+            create_video_render, 
+            check_video_status,
+            wait_for_approval,
+            regenerate_images,
+            create_draft_render,
+            check_draft_status,
+            wait_for_draft_approval
+        )
+
         # Add all nodes to the workflow
-        self.workflow.add_node("process_images", process_images_with_fal)
+        self.workflow.add_node("start", start_workflow)
+        self.workflow.add_node("enhance_photo", enhance_photo)
+        self.workflow.add_node("upload_agent_picture", upload_agent_picture)
+        self.workflow.add_node("prepare_text_payload", prepare_text_payload)
         self.workflow.add_node("wait_approval", wait_for_approval)
         self.workflow.add_node("regenerate", regenerate_images)
         self.workflow.add_node("prepare_payload", prepare_creatomate_payload)
+        self.workflow.add_node("create_draft", create_draft_render)
+        self.workflow.add_node("check_draft", check_draft_status)
+        self.workflow.add_node("wait_draft", wait_for_draft_approval)
         self.workflow.add_node("create_render", create_video_render)
         self.workflow.add_node("check_status", check_video_status)
+        self.workflow.add_node("finish", finish_workflow)
 
-        # Set the entry point
-        self.workflow.set_entry_point("process_images")
+        # Fan out: one branch per property photo, plus the agent picture upload
+        # and the text payload, all running in parallel
+        self.workflow.add_edge(START, "start")
+        self.workflow.add_conditional_edges("start", route_photos, ["enhance_photo"])
+        self.workflow.add_edge("start", "upload_agent_picture")
+        self.workflow.add_edge("start", "prepare_text_payload")
 
-        # Define the sequence: process → wait for approval
-        self.workflow.add_edge("process_images", "wait_approval")
+        # Fan in: approval waits for every branch of the step to finish
+        self.workflow.add_edge("enhance_photo", "wait_approval")
+        self.workflow.add_edge("upload_agent_picture", "wait_approval")
+        self.workflow.add_edge("prepare_text_payload", "wait_approval")
         
         # After approval, decide whether to regenerate or proceed
         self.workflow.add_conditional_edges(
@@ -50,8 +81,37 @@ class VideoGenerationWorkflow:
         # After regeneration, go back to approval
         self.workflow.add_edge("regenerate", "wait_approval")
         
-        # Continue with video creation flow
-        self.workflow.add_edge("prepare_payload", "create_render")
+        # Continue with video creation flow, optionally through a draft preview
+        self.workflow.add_conditional_edges(
+            "prepare_payload",
+            self.check_draft,
+            {
+                "draft": "create_draft",
+                "render": "create_render",
+            }
+        )
+        
+        # Poll the draft, then wait for the user to confirm or correct it
+        for node in ("create_draft", "check_draft"):
+            self.workflow.add_conditional_edges(
+                node,
+                self.should_continue_draft,
+                {
+                    "continue": "check_draft",
+                    "review": "wait_draft",
+                    "error": "finish",
+                }
+            )
+        
+        # Corrections rebuild the payload and render a new draft
+        self.workflow.add_conditional_edges(
+            "wait_draft",
+            self.check_draft_approval,
+            {
+                "render": "create_render",
+                "revise": "prepare_payload",
+            }
+        )
         
         # Add conditional edges for polling
         self.workflow.add_conditional_edges(
@@ -59,8 +119,8 @@ class VideoGenerationWorkflow:
             self.should_continue_render,
             {
                 "continue": "check_status",
-                "finish": END,
-                "error": END,
+                "finish": "finish",
+                "error": "finish",
             }
         )
         self.workflow.add_conditional_edges(
@@ -68,10 +128,11 @@ class VideoGenerationWorkflow:
             self.should_continue_render,
             {
                 "continue": "check_status",
-                "finish": END,
-                "error": END,
+                "finish": "finish",
+                "error": "finish",
             }
         )
+        self.workflow.add_edge("finish", END)
 
     def check_approval(self, state: GraphState) -> str:
         """
@@ -88,6 +149,36 @@ class VideoGenerationWorkflow:
         # Default: wait for approval (shouldn't reach here normally)
         return "proceed"
 
+    def check_draft(self, state: GraphState) -> str:
+        """
+        Determines whether a draft preview is rendered before the full render.
+        """
+        if state.draft_preview and not state.draft_approved:
+            return "draft"
+        return "render"
+
+    def should_continue_draft(self, state: GraphState) -> str:
+        """
+        Determines the next step based on the draft render status.
+        """
+        # Payload didn't validate - nothing was submitted
+        if state.render_status == "error":
+            return "error"
+        
+        if state.draft_status in ("succeeded", "failed", "error"):
+            # A failed draft is still shown so the user can decide to go ahead
+            return "review"
+        
+        return "continue"
+
+    def check_draft_approval(self, state: GraphState) -> str:
+        """
+        Determines whether the confirmed draft proceeds to the full render.
+        """
+        if state.draft_approved:
+            return "render"
+        return "revise"
+
     def should_continue_render(self, state: GraphState) -> str:
         """
         Determines the next step based on the render status.
@@ -100,7 +191,7 @@ class VideoGenerationWorkflow:
         
         if render_status == "succeeded":
             return "finish"
-        elif render_status == "failed" or render_status == "error":
+        elif render_status in ("failed", "error"):
             return "error"
         else:
             # Still processing (planned, rendering, etc.)
@@ -110,14 +201,92 @@ class VideoGenerationWorkflow:
         """
         Compiles the workflow into a runnable graph with checkpointing.
         """
-        return self.workflow.compile(checkpointer=self.checkpointer, interrupt_after=["wait_approval"])
+        return self.workflow.compile(checkpointer=self.checkpointer, interrupt_after=["wait_approval", "wait_draft"])
+
+
+def new_thread_id() -> str:
+    """
+    Returns a unique thread_id. The compiled graph and its checkpointer are
+    shared by every session in the process, so the thread_id is the only
+    thing keeping one user's workflow apart from another's.
+    """
+    return f"thread_{uuid.uuid4().hex}"
+
+
+def workflow_config(thread_id: str, tenant: Optional[str] = None) -> dict:
+    """
+    Run config for a workflow thread. `tenant` (agent email or name) is who
+    the provider scheduler shares capacity between; without it every
+    thread is its own tenant.
+    """
+    configurable = {"thread_id": thread_id}
+    if tenant:
+        configurable["tenant"] = tenant
+    return {"configurable": configurable}
+
+
+def claim_thread(thread_id: str) -> bool:
+    """
+    Takes ownership of a workflow thread for this process (see leases.py;
+    processes must share a host). Returns False while another live process
+    is running it; once that process stops heartbeating, the thread can be
+    claimed here - but its checkpoints only come along if the checkpointer
+    is shared between the processes.
+    """
+    from leases import get_lease_manager, resource_name, THREAD
+
+    return get_lease_manager().acquire(resource_name(THREAD, thread_id))
+
+
+def release_thread(graph, thread_id):
+    """
+    Cancels any work still running for a finished or abandoned thread
+    (fal requests, uploads, render polling), drops its checkpoints from
+    the graph's checkpointer, lets go of its scratch directory, deletes
+    its locally rendered videos and gives up this process's leases on it
+    and its renders.
+    """
+    from cancellation import cancel_thread
+    from leases import get_lease_manager
+    from progress import get_progress_bus
+    from renderers import get_renderer, LOCAL
+    from scratch import get_scratch_manager
+
+    cancel_thread(thread_id)
+    get_progress_bus().clear(thread_id)
+    if thread_id:
+        get_scratch_manager().release_owner(thread_id)
+        get_renderer(LOCAL).release_thread(thread_id)
+        get_lease_manager().release_thread(thread_id)
+    if graph is None or not thread_id or graph.checkpointer is None:
+        return
+    graph.checkpointer.delete_thread(thread_id)
+
+def forget_thread(thread_id: str):
+    """
+    Frees what this process still keeps for a thread the checkpointer
+    pruned (finished or idle long ago): its cancel token, progress items,
+    locally rendered videos and leases.
+    """
+    from cancellation import discard_token
+    from leases import get_lease_manager
+    from progress import get_progress_bus
+    from renderers import get_renderer, LOCAL
+
+    discard_token(thread_id)
+    get_progress_bus().clear(thread_id)
+    get_renderer(LOCAL).release_thread(thread_id)
+    get_lease_manager().release_thread(thread_id)
 
 # --- Main Execution ---
 
 if __name__ == "__main__":
     # --- Configuration ---
     # Specify the Creatomate template ID we want to use
-    TEMPLATE_ID = "6821de4e-c173-4a8f-9c8e-d8f0e3c292ed" # Real Estate Ad with 5 photos
+    TEMPLATE_ID = DEFAULT_TEMPLATE_ID # Real Estate Ad with 5 photos
+
+    # Extra templates (e.g. other formats) rendered from the same enhanced images
+    EXTRA_TEMPLATE_IDS = []
 
     # Provide the local paths to the images you want to use.
     # The keys should match the placeholder names in your Creatomate template.
@@ -134,17 +303,24 @@ if __name__ == "__main__":
     # Initial state for the graph
     initial_state = {
         "template_id": TEMPLATE_ID,
+        "template_ids": EXTRA_TEMPLATE_IDS,
         "input_images": INPUT_IMAGES,
         "processed_image_urls": {},
         "modifications": {},
         "render_id": None,
         "final_video_url": None,
+        # "creatomate", "local" (offline ffmpeg slideshow) or "auto" (Creatomate, local fallback)
+        "render_backend": os.getenv("RENDER_BACKEND", "creatomate"),
     }
 
     # Instantiate and compile the workflow
     graph_builder = VideoGenerationWorkflow()
     app = graph_builder.compile()
 
+    # Queue positions and render statuses as they change
+    from progress import get_progress_bus, describe
+    get_progress_bus().subscribe(lambda event: print(f"[progress] {event['item']}: {describe(event)}"))
+
     print("--- Invoking Graph ---")
     # Run the graph and stream the results
     for output in app.stream(initial_state):
@@ -155,6 +331,15 @@ if __name__ == "__main__":
             print(value)
     print("--- Graph Finished ---")
 
+    from circuit_breaker import format_breaker_states
+    from scheduler import format_scheduler_states
+    print("\n--- Provider Status ---")
+    print(format_breaker_states())
+    print(format_scheduler_states())
+    from progress import format_progress
+    print(format_progress(None))
+    get_progress_bus().clear(None)
+
     # To see the final state, you can invoke the graph like this:
     # final_state = app.invoke(initial_state)
     # print("\n--- Final State ---")
@@ -1,9 +1,25 @@
 import os
-import fal_client
-from typing import Dict
-from state import GraphState
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from state import GraphState, PhotoTask
+from langgraph.types import Send
+from langchain_core.runnables import RunnableConfig
+from cancellation import CancelToken, WorkflowCancelled, NEVER_CANCELLED, token_for_config, discard_token
+from templates import get_template_registry, aspect_value, DEFAULT_ASPECT_RATIO
+from render_cache import get_render_cache, payload_key, FINAL_STATUSES
+from hedging import run_hedged, get_fal_hedge_policy, Superseded
+from circuit_breaker import get_breaker
+from scheduler import get_scheduler
+from renderers import get_renderer, renderer_for, CREATOMATE, LOCAL, AUTO
+from local_enhance import get_enhance_pool, enhance_image_file, enhanced_path_for
+from image_quality import assess_image, QUALITY_SKIP_ENABLED, SKIP, WARN
+from photo_index import phash, find_duplicates, get_photo_index, REUSE_DISTANCE
+from ledger import get_ledger, job_scope, carry_context, current_scope
+from leases import get_lease_manager, resource_name, RENDER
+from progress import get_progress_bus
+from scratch import get_scratch_manager
 import time
-import requests
 
 # Load environment variables - works for both local (.env) and cloud (already set by streamlit_app.py)
 try:
@@ -15,105 +31,464 @@ except ImportError:
 # --- Get API Keys ---
 FAL_KEY = os.getenv("FAL_KEY")
 if not FAL_KEY:
-    print("Warning: FAL_KEY not found in environment. Image processing will be skipped.")
+    print("Warning: FAL_KEY not found in environment. AI enhancement disabled - photos will be enhanced locally.")
 
 CREATOMATE_API_KEY = os.getenv("CREATOMATE_API_KEY")
 
 # The specific fal.ai model for image editing
 FAL_MODEL_URL = "fal-ai/nano-banana/edit"
 
-def on_queue_update(update):
-    """Callback function to print logs from the fal.ai queue."""
-    if isinstance(update, fal_client.InProgress):
-        for log in update.logs:
-            print(log["message"])
+# Draft previews render at a fraction of the template's resolution - fast, for checking text
+DRAFT_RENDER_SCALE = float(os.getenv("DRAFT_RENDER_SCALE", "0.25"))
+DRAFT_POLL_INTERVAL = 3
 
+# Seconds between render status checks; local renders finish in seconds, not minutes
+RENDER_POLL_INTERVAL = 10
+LOCAL_RENDER_POLL_INTERVAL = 1
 
-def process_images_with_fal(state: GraphState) -> dict:
+ENHANCE_PROMPT = "A high-quality, clear photograph, vibrant and professional, with the best part of the image in focus with no zooming"
+REGENERATE_PROMPT = "A high-quality, clear photograph, vibrant and professional, well-composed with excellent lighting and focus. Attempt {attempt}"
+
+def on_queue_update(update, item: Optional[str] = None):
+    """Callback for fal.ai queue updates: prints model logs and reports the queue position and logs of `item`."""
+    import fal_client
+
+    if isinstance(update, fal_client.Queued):
+        get_progress_bus().publish(item, "queued", queue_position=update.position)
+    elif isinstance(update, fal_client.InProgress):
+        messages = [log["message"] for log in update.logs or []]
+        for message in messages:
+            print(message)
+        get_progress_bus().publish(item, "running", logs=messages)
+
+
+def _enhance_image(file_path: str, prompt: str, token: CancelToken = NEVER_CANCELLED,
+                   placeholder: Optional[str] = None, aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> Optional[str]:
+    """
+    Uploads a local image, runs it through the fal.ai model and returns
+    the URL of the processed image (None if the model returned nothing),
+    framed for `aspect_ratio` (e.g. "1:1" for a square template).
+    Raises WorkflowCancelled (and cancels the fal request) if `token` is cancelled,
+    and CircuitOpenError right away if fal.ai is currently failing.
+    Progress is reported on the progress bus under `placeholder`.
+    """
+    get_progress_bus().publish(placeholder, "scheduled")
+    breaker = get_breaker("fal")
+    with get_scheduler("fal").slot(breaker=breaker), breaker.track(ignore=(WorkflowCancelled,)):
+        return _run_fal_enhancement(file_path, prompt, token, placeholder, aspect_ratio)
+
+
+def _run_fal_enhancement(file_path: str, prompt: str, token: CancelToken,
+                         placeholder: Optional[str] = None,
+                         aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> Optional[str]:
+    import fal_client  # Imported on first use - slow to import
+
+    # 1. Read the image file as bytes and upload it
+    token.raise_if_cancelled()
+    print("Uploading file...")
+    get_progress_bus().publish(placeholder, "uploading")
+    with open(file_path, "rb") as f:
+        image_bytes = f.read()
+    
+    with get_ledger().track("fal", "upload", bytes_sent=len(image_bytes)):
+        uploaded_url = fal_client.upload(image_bytes, content_type="image/jpeg")
+    print(f"File uploaded to temporary URL: {uploaded_url}")
+    token.raise_if_cancelled()
+
+    # 2. Submit the job to fal.ai and wait for it (hedged against slow queue times if enabled)
+    print("Submitting job to fal.ai...")
+    arguments = {
+        "prompt": prompt,
+        "image_urls": [uploaded_url],
+        "num_images": 1,
+        "output_format": "jpeg",
+        "aspect_ratio": aspect_ratio
+    }
+
+    attempts = []
+    hedges = set()
+
+    def submit():
+        attempts.append(time.monotonic())
+        handle = fal_client.submit(FAL_MODEL_URL, arguments=arguments)
+        if len(attempts) > 1:
+            hedges.add(id(handle))
+        return handle
+
+    @contextmanager
+    def hedge_guard():
+        # The duplicate needs a fal slot and breaker accounting of its own
+        with get_scheduler("fal").spare_slot() as allowed:
+            if not allowed:
+                yield False
+                return
+            with get_breaker("fal").track(ignore=(WorkflowCancelled, Superseded)):
+                yield True
+
+    def wait_result(handle):
+        # A hedged duplicate is recorded as a retry of the same model run;
+        # only the primary reports progress, so the photo has one status
+        request_id = getattr(handle, "request_id", None)
+        item = None if id(handle) in hedges else placeholder
+        with get_ledger().track("fal", "enhance", retries=len(attempts) - 1, ref=request_id):
+            submitted = time.monotonic()
+            queued = True
+            for event in handle.iter_events(with_logs=True):
+                if queued and not isinstance(event, fal_client.Queued):
+                    # Time spent in fal's queue, apart from the model run itself
+                    queued = False
+                    get_ledger().record("fal", "queue", time.monotonic() - submitted, ref=request_id)
+                on_queue_update(event, item)
+                if token.cancelled:
+                    raise WorkflowCancelled()
+            return handle.get()
+
+    result = run_hedged(
+        submit,
+        wait_result,
+        lambda handle: handle.cancel(),
+        get_fal_hedge_policy(),
+        token,
+        hedge_guard,
+    )
+    
+    # 3. Extract the processed image URL from the result
+    if result and "images" in result and len(result["images"]) > 0:
+        return result["images"][0]["url"]
+    return None
+
+
+def _upload_for_render(file_path: str) -> str:
     """
-    Uploads local property images, submits jobs to fal-ai/nano-banana/edit,
-    polls for the result, and returns the new image URLs.
-    Agent picture is uploaded directly without AI processing.
+    Uploads a locally produced image so Creatomate can fetch it. Without
+    FAL_KEY there is nowhere to host it, so the local path is returned.
     """
     if not FAL_KEY:
-        print("Warning: FAL_KEY not found. Skipping image processing.")
-        return {**state.model_dump(), "processed_image_urls": {}}
+        return file_path
 
-    input_images = state.input_images
-    processed_urls = {}
+    import fal_client  # Imported on first use - slow to import
 
-    print("--- Starting Image Processing with fal-client ---")
+    with open(file_path, "rb") as f:
+        image_bytes = f.read()
+    breaker = get_breaker("fal")
+    with get_scheduler("fal").slot(breaker=breaker), breaker.track(), \
+            get_ledger().track("fal", "upload", bytes_sent=len(image_bytes)):
+        return fal_client.upload(image_bytes, content_type="image/jpeg")
+
+
+def _enhance_local(file_path: str, placeholder: str, token: CancelToken = NEVER_CANCELLED,
+                   aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> str:
+    """
+    Enhances a photo on this machine (no model call) in the local process
+    pool, cropped to `aspect_ratio`, and uploads the result. Returns the URL
+    (or local path without FAL_KEY).
+    """
+    token.raise_if_cancelled()
+    get_progress_bus().publish(placeholder, "enhancing locally")
+    with get_ledger().track("local", "enhance"):
+        future = get_enhance_pool().submit(enhance_image_file, file_path, enhanced_path_for(file_path, placeholder),
+                                           aspect_value(aspect_ratio))
+        while True:
+            try:
+                output_path = future.result(timeout=0.5)
+                break
+            except FuturesTimeoutError:
+                if token.cancelled:
+                    future.cancel()
+                    raise WorkflowCancelled()
+
+    print(f"Enhanced '{placeholder}' locally: {output_path}")
+    return _upload_for_render(output_path)
+
+
+def _enhance_with_mode(placeholder: str, file_path: str, mode: str, prompt: str,
+                       token: CancelToken = NEVER_CANCELLED,
+                       aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> Tuple[Optional[str], str]:
+    """
+    Enhances one photo according to its enhancement mode:
+    "model" - fal.ai only, "local" - Pillow/NumPy only,
+    "auto"  - fal.ai, falling back to local enhancement if the model
+              is unavailable (no FAL_KEY, open circuit, error, no result).
+    Both engines frame the result for `aspect_ratio` (the primary template's).
+    Returns the result URL (or None) and the engine that produced it.
+    """
+    if mode == "local" or (mode == "auto" and not FAL_KEY):
+        print(f"Enhancing '{placeholder}' locally...")
+        return _enhance_local(file_path, placeholder, token, aspect_ratio), "local"
+
+    if not FAL_KEY:
+        print(f"Warning: FAL_KEY not found. Cannot enhance '{placeholder}' with the model.")
+        return None, "model"
 
-    for placeholder, file_path in input_images.items():
-        if not os.path.exists(file_path):
-            print(f"Warning: Image file not found at {file_path}. Skipping.")
+    try:
+        url = _enhance_image(file_path, prompt, token, placeholder, aspect_ratio)
+        if url or mode == "model":
+            return url, "model"
+        print(f"Warning: No image URL returned for '{placeholder}' - falling back to local enhancement.")
+    except WorkflowCancelled:
+        raise
+    except Exception as e:
+        if mode == "model":
+            raise
+        print(f"Model enhancement failed for '{placeholder}' ({e}) - falling back to local enhancement.")
+
+    return _enhance_local(file_path, placeholder, token, aspect_ratio), "local"
+
+
+def _prescreen(placeholder: str, file_path: str) -> Optional[dict]:
+    """Runs the local quality pre-screen on a photo; None if it can't be analysed."""
+    try:
+        quality = assess_image(file_path)
+    except Exception as e:
+        print(f"Warning: Could not assess quality of '{placeholder}': {e}")
+        return None
+
+    if quality["verdict"] == WARN:
+        print(f"Quality warning for '{placeholder}': {', '.join(quality['issues'])}")
+    return quality
+
+
+def _photo_hash(placeholder: str, file_path: str) -> Optional[str]:
+    """Perceptual hash of a photo; None if it can't be read."""
+    try:
+        return phash(file_path)
+    except Exception as e:
+        print(f"Warning: Could not hash '{placeholder}': {e}")
+        return None
+
+
+def _thread_id(config: Optional[RunnableConfig]) -> Optional[str]:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+def start_workflow(state: GraphState, config: RunnableConfig) -> dict:
+    """
+    Entry node: holds the job's scratch directory for the workflow thread,
+    so the input files outlive the session that uploaded them until the
+    workflow finishes or is cancelled (see finish_workflow, main.release_thread).
+    """
+    thread_id = _thread_id(config)
+    if state.scratch_dir and thread_id:
+        get_scratch_manager().acquire(state.scratch_dir, owner=thread_id)
+    return {}
+
+
+def finish_workflow(state: GraphState, config: RunnableConfig) -> dict:
+    """Exit node: releases what the workflow thread held while it ran."""
+    thread_id = _thread_id(config)
+    if thread_id:
+        get_scratch_manager().release_owner(thread_id)
+        # A cancelled thread's token stays a tombstone (see cancellation.cancel_thread)
+        if not token_for_config(config).cancelled:
+            discard_token(thread_id)
+    return {}
+
+
+def route_photos(state: GraphState) -> list:
+    """
+    Fans out one enhance_photo branch per property photo so all photos
+    are processed in parallel. The same photo uploaded twice in a listing
+    (e.g. resent under another name) gets one branch whose result is used
+    for every copy.
+    """
+    modes = {placeholder: state.image_enhancement_modes.get(placeholder, state.enhancement_mode)
+             for placeholder in state.input_images}
+    hashes = {}
+    for placeholder, file_path in state.input_images.items():
+        if os.path.exists(file_path):
+            photo_hash = _photo_hash(placeholder, file_path)
+            if photo_hash:
+                hashes[placeholder] = photo_hash
+
+    for group in find_duplicates(hashes):
+        print(f"Warning: {', '.join(group)} look like the same shot.")
+
+    aliases: Dict[str, List[str]] = {}
+    for group in find_duplicates(hashes, REUSE_DISTANCE):
+        leader = group[0]
+        aliases[leader] = [name for name in group[1:] if modes[name] == modes[leader]]
+
+    alias_names = {name for names in aliases.values() for name in names}
+    # Photos are framed for the primary template; other formats get the same approved images
+    aspect_ratio = get_template_registry().aspect_ratio(state.template_id)
+    tasks = []
+    for placeholder, file_path in state.input_images.items():
+        if placeholder in alias_names:
             continue
+        tasks.append(PhotoTask(placeholder=placeholder, file_path=file_path, mode=modes[placeholder],
+                               photo_hash=hashes.get(placeholder), aliases=aliases.get(placeholder, []),
+                               aspect_ratio=aspect_ratio))
 
-        print(f"\nProcessing image for '{placeholder}' from {file_path}...")
+    print(f"--- Starting Image Processing ({len(tasks)} photos in parallel) ---")
+    return [Send("enhance_photo", task) for task in tasks]
 
-        try:
-            # 1. Read the image file as bytes and upload it
-            print("Uploading file...")
-            with open(file_path, "rb") as f:
-                image_bytes = f.read()
-            
-            uploaded_url = fal_client.upload(image_bytes, content_type="image/jpeg")
-            print(f"File uploaded to temporary URL: {uploaded_url}")
-
-            # 2. Submit the job to fal.ai using subscribe (blocking call with logs)
-            print("Submitting job to fal.ai...")
-            result = fal_client.subscribe(
-                FAL_MODEL_URL,
-                arguments={
-                    "prompt": "A high-quality, clear photograph, vibrant and professional, with the best part of the image in focus with no zooming",
-                    "image_urls": [uploaded_url],
-                    "num_images": 1,
-                    "output_format": "jpeg",
-                    "aspect_ratio": "9:16"
-                },
-                with_logs=True,
-                on_queue_update=on_queue_update,
-            )
-            
-            # 3. Extract the processed image URL from the result
-            if result and "images" in result and len(result["images"]) > 0:
-                processed_image_url = result["images"][0]["url"]
-                processed_urls[placeholder] = processed_image_url
-                print(f"Successfully processed '{placeholder}'. New URL: {processed_image_url}")
-            else:
-                print(f"Warning: No image URL returned for '{placeholder}'")
 
-        except Exception as e:
-            print(f"An error occurred while processing image {file_path} with fal.ai: {e}")
+@job_scope
+def enhance_photo(task: PhotoTask, config: RunnableConfig) -> dict:
+    """
+    Processes a single property photo with fal-ai/nano-banana/edit and/or
+    the local enhancement engine, depending on the photo's mode. A photo
+    already enhanced for an earlier listing reuses that result.
+    The result is merged into processed_image_urls by the state reducer.
+    """
+    placeholder, file_path = task.placeholder, task.file_path
+    aspect_ratio = task.aspect_ratio or DEFAULT_ASPECT_RATIO
+    placeholders = [placeholder, *task.aliases]
+    if not os.path.exists(file_path):
+        print(f"Warning: Image file not found at {file_path}. Skipping.")
+        return {}
+
+    print(f"\nProcessing image for '{placeholder}' from {file_path}...")
+    if task.aliases:
+        print(f"'{placeholder}' is also used for {', '.join(task.aliases)} - enhancing it once.")
+
+    quality = _prescreen(placeholder, file_path)
+    update = {"image_quality": {name: quality for name in placeholders}} if quality else {}
+
+    token = token_for_config(config)
+    index = get_photo_index()
+    bus = get_progress_bus()
+    engine = None
+    try:
+        processed_image_url = index.lookup(task.photo_hash, task.mode, aspect_ratio) if task.photo_hash else None
+        if processed_image_url:
+            print(f"'{placeholder}' was already enhanced for an earlier listing - reusing the result.")
+        elif quality and quality["verdict"] == SKIP and task.mode == "auto" and QUALITY_SKIP_ENABLED:
+            # Already sharp and well exposed - a model run wouldn't improve it
+            print(f"'{placeholder}' already looks good - skipping enhancement.")
+            token.raise_if_cancelled()
+            bus.publish(placeholder, "uploading")
+            processed_image_url, engine = _upload_for_render(file_path), "original"
+        else:
+            processed_image_url, engine = _enhance_with_mode(placeholder, file_path, task.mode,
+                                                             ENHANCE_PROMPT, token, aspect_ratio)
+    except WorkflowCancelled:
+        print(f"Processing of '{placeholder}' cancelled.")
+        bus.publish(placeholder, "cancelled")
+        raise
+    except Exception as e:
+        print(f"An error occurred while processing image {file_path}: {e}")
+        bus.publish(placeholder, "failed", message=str(e))
+        return update
+
+    if not processed_image_url:
+        print(f"Warning: No image URL returned for '{placeholder}'")
+        bus.publish(placeholder, "failed", message="no image returned")
+        return update
+
+    if engine and task.photo_hash:
+        index.record(task.photo_hash, engine, processed_image_url, aspect_ratio)
+
+    print(f"Successfully processed '{placeholder}'. New URL: {processed_image_url}")
+    for name in placeholders:
+        bus.publish(name, "done", message=engine or "reused")
+    update["processed_image_urls"] = {name: processed_image_url for name in placeholders}
+    return update
+
+
+@job_scope
+def upload_agent_picture(state: GraphState, config: RunnableConfig) -> dict:
+    """
+    Uploads the agent/brand picture directly (no AI processing needed).
+    Runs in parallel with the photo enhancement branches.
+    """
+    if not state.agent_picture_path or not os.path.exists(state.agent_picture_path):
+        # No agent picture uploaded - use empty string to let template use default
+        print("No agent picture uploaded - Creatomate template will use default image")
+        return {"picture_source": ""}
 
-    print("\n--- Finished Image Processing ---")
-    
-    current_state = state.model_dump()
-    current_state["processed_image_urls"] = processed_urls
+    if not FAL_KEY:
+        print("Warning: FAL_KEY not found. Agent picture not uploaded.")
+        return {"picture_source": ""}
+
+    import fal_client  # Imported on first use - slow to import
+
+    token_for_config(config).raise_if_cancelled()
+    print(f"\nUploading agent/brand picture from {state.agent_picture_path}...")
+    print("(Agent picture is uploaded directly, no AI processing)")
     
-    # Upload agent picture directly (no AI processing needed)
-    if state.agent_picture_path and os.path.exists(state.agent_picture_path):
-        print(f"\nUploading agent/brand picture from {state.agent_picture_path}...")
-        print("(Agent picture is uploaded directly, no AI processing)")
+    try:
+        with open(state.agent_picture_path, "rb") as f:
+            image_bytes = f.read()
         
-        try:
-            with open(state.agent_picture_path, "rb") as f:
-                image_bytes = f.read()
-            
+        breaker = get_breaker("fal")
+        with get_scheduler("fal").slot(breaker=breaker), breaker.track(), \
+                get_ledger().track("fal", "upload", bytes_sent=len(image_bytes)):
             agent_picture_url = fal_client.upload(image_bytes, content_type="image/jpeg")
-            current_state["picture_source"] = agent_picture_url
-            print(f"Agent picture uploaded successfully: {agent_picture_url}")
-        
-        except Exception as e:
-            print(f"Error uploading agent picture: {e}")
-            # Use empty string to let Creatomate template use its default image
-            current_state["picture_source"] = ""
-    else:
-        # No agent picture uploaded - use empty string to let template use default
-        print("No agent picture uploaded - Creatomate template will use default image")
-        current_state["picture_source"] = ""
+        print(f"Agent picture uploaded successfully: {agent_picture_url}")
+        return {"picture_source": agent_picture_url}
     
-    return current_state
+    except Exception as e:
+        print(f"Error uploading agent picture: {e}")
+        # Use empty string to let Creatomate template use its default image
+        return {"picture_source": ""}
+
+
+def _text_modifications(state: GraphState) -> dict:
+    """Returns the non-image part of the Creatomate payload."""
+    return {
+        "Address.text": state.address,
+        "Details-1.text": state.details_1,
+        "Details-2.text": state.details_2,
+        "Email.text": state.email,
+        "Phone-Number.text": state.phone_number,
+        "Brand-Name.text": state.brand_name,
+        "Name.text": state.agent_name
+    }
+
+
+def _target_payloads(state: GraphState, modifications: dict) -> Tuple[Dict[str, dict], List[str]]:
+    """
+    Builds the payload for each target template from the primary one: the
+    same approved photos (Creatomate fits them to each template's frame),
+    with element names mapped onto the template's own (see
+    TemplateRegistry.payload_for). Returns the payloads and an error for
+    every field an extra format has no element for - a photo or text that
+    would silently be missing from its video - unless TEMPLATE_ELEMENT_MAPS
+    leaves it out on purpose.
+    """
+    registry = get_template_registry()
+    payloads, errors = {}, []
+    for template_id in _target_templates(state):
+        if template_id == state.template_id:
+            payloads[template_id] = dict(modifications)
+            continue
+        payloads[template_id], dropped = registry.payload_for(template_id, modifications)
+        errors.extend(f"[{template_id}] Template has no element for '{key}' "
+                      f"(map or leave it out in TEMPLATE_ELEMENT_MAPS)" for key in dropped)
+    return payloads, errors
+
+
+def _validation_errors(payloads: Dict[str, dict], backend: str = CREATOMATE) -> List[str]:
+    """Checks each template's payload against it; errors are prefixed when there are several."""
+    registry = get_template_registry()
+    errors = []
+    for template_id, modifications in payloads.items():
+        # The local renderer reads local files; only Creatomate needs public URLs
+        for error in registry.validate_modifications(template_id, modifications,
+                                                     public_sources=backend != LOCAL):
+            errors.append(error if len(payloads) == 1 else f"[{template_id}] {error}")
+    return errors
+
+
+@job_scope
+def prepare_text_payload(state: GraphState, config: RunnableConfig) -> dict:
+    """
+    Builds the text part of the Creatomate payload and checks it against the
+    target templates while the photos are still being processed, so template
+    problems show up before approval and the template definitions are cached.
+    """
+    print("--- Preparing Text Payload ---")
+    get_ledger().record_job(((config or {}).get("configurable") or {}).get("thread_id"),
+                            state.agent_name, state.email, state.template_id, len(state.input_images))
+    modifications = _text_modifications(state)
+
+    payloads, errors = _target_payloads(state, modifications)
+    errors += _validation_errors(payloads)
+    for error in errors:
+        print(f"Warning: {error}")
+
+    return {"modifications": modifications, "payload_errors": errors}
 
 
 def prepare_creatomate_payload(state: GraphState) -> dict:
@@ -122,7 +497,8 @@ def prepare_creatomate_payload(state: GraphState) -> dict:
     """
     print("--- Preparing Creatomate Payload ---")
     
-    modifications = {}
+    # Text comes from the state fields, which may have been corrected after a draft preview
+    modifications = {**state.modifications, **_text_modifications(state)}
     
     # Add processed image URLs to the payload
     processed_urls = state.processed_image_urls
@@ -130,17 +506,6 @@ def prepare_creatomate_payload(state: GraphState) -> dict:
         modifications[f"{placeholder}.source"] = url
         print(f"Adding '{placeholder}' with URL to payload.")
 
-    # Add template fields from state
-    modifications.update({
-        "Address.text": state.address,
-        "Details-1.text": state.details_1,
-        "Details-2.text": state.details_2,
-        "Email.text": state.email,
-        "Phone-Number.text": state.phone_number,
-        "Brand-Name.text": state.brand_name,
-        "Name.text": state.agent_name
-    })
-    
     # Only add Picture.source if user uploaded an agent picture
     # Empty string lets Creatomate template use its default image
     if state.picture_source:
@@ -156,103 +521,301 @@ def prepare_creatomate_payload(state: GraphState) -> dict:
     return current_state
 
 
-def create_video_render(state: GraphState) -> dict:
+def _target_templates(state: GraphState) -> List[str]:
+    """Returns the primary template followed by any extra output templates, without duplicates."""
+    targets = [state.template_id]
+    for template_id in state.template_ids:
+        if template_id not in targets:
+            targets.append(template_id)
+    return targets
+
+
+def _render_backend(state: GraphState) -> str:
     """
-    Sends the request to the Creatomate API to start a new video render.
+    Picks the backend for this workflow's renders. In "auto" mode the local
+    renderer is used up front when Creatomate can't take the render: no API
+    key, open circuit, or photos that only exist on this machine. Otherwise
+    "auto" stays, so a render Creatomate rejects still falls back to local.
     """
-    if not CREATOMATE_API_KEY:
-        print("Error: CREATOMATE_API_KEY not found in .env file.")
-        return state.model_dump()
+    if state.render_backend != AUTO:
+        return state.render_backend
 
-    print("--- Starting Video Render ---")
+    public = all(str(url).startswith(("http://", "https://")) for url in state.processed_image_urls.values())
+    if (not get_renderer(CREATOMATE).available() or not public) and get_renderer(LOCAL).available():
+        print("Creatomate unavailable for this render - using the local renderer.")
+        return LOCAL
+    return AUTO
 
-    headers = {
-        "Authorization": f"Bearer {CREATOMATE_API_KEY}",
-        "Content-Type": "application/json",
-    }
 
-    data = {
-        "template_id": state.template_id,
-        "modifications": state.modifications,
-    }
+def _submit_render(template_id: str, modifications: dict, force: bool = False,
+                   render_scale: Optional[float] = None, backend: str = CREATOMATE) -> Optional[dict]:
+    """
+    Starts a render for one template on `backend` ("creatomate", "local", or
+    "auto" to fall back to local if Creatomate won't take it).
+    `render_scale` (e.g. 0.25) renders a smaller, faster draft.
+    Returns the cache entry (render_id, status, url) or None if submission failed.
+    """
+    if backend == LOCAL:
+        # Local renders are quick to redo and their files are not kept forever - not cached
+        render_id = get_renderer(LOCAL).submit(template_id, modifications, render_scale)
+        return {"render_id": render_id, "status": "planned", "url": None} if render_id else None
 
-    try:
-        response = requests.post("https://api.creatomate.com/v2/renders", json=data, headers=headers)
-        response.raise_for_status()
-        
-        render_data = response.json()
-        print(f"Creatomate response: {render_data}")
-        
-        # Handle both single object and array responses
-        if isinstance(render_data, list):
-            render_id = render_data[0]["id"]
-        else:
-            render_id = render_data["id"]
-        
-        print(f"Successfully started render. Render ID: {render_id}")
-        
+    def submit_render():
+        return get_renderer(CREATOMATE).submit(template_id, modifications, render_scale)
+
+    # Identical payloads (double-clicks, retries, batch reruns) reuse the existing render
+    options = {"render_scale": render_scale} if render_scale else None
+    key = payload_key(template_id, modifications, options)
+    entry = get_render_cache().get_or_submit(key, submit_render, force=force)
+    if entry is None and backend == AUTO and get_renderer(LOCAL).available():
+        print(f"Creatomate did not accept the render for template {template_id} - rendering locally.")
+        return _submit_render(template_id, modifications, render_scale=render_scale, backend=LOCAL)
+    return entry
+
+
+def _fetch_render(render_id: str) -> dict:
+    """
+    Fetches the current status (and URL, once done) of a single render.
+    Only the instance holding the render's lease polls the renderer; the
+    others read the status it publishes, and take the lease over if that
+    instance stops renewing it.
+    """
+    renderer = renderer_for(render_id)
+    leases = get_lease_manager()
+    # Local renders only exist on the instance that started them
+    lease = resource_name(RENDER, render_id) if renderer.name != LOCAL else None
+    if lease and not leases.acquire(lease, thread_id=current_scope()[0]):
+        published = (leases.read(lease) or {}).get("data") or {}
+        return {"status": published.get("status"), "url": published.get("url")}
+
+    result = renderer.fetch(render_id)
+    if result["status"] is not None:
+        get_render_cache().record_status(render_id, result["status"], result["url"])
+        if lease:
+            leases.publish(lease, {"status": result["status"], "url": result["url"]})
+    if result["status"] in FINAL_STATUSES:
+        get_ledger().record_render(renderer.name, render_id, result["status"])
+        if lease:
+            leases.release(lease)
+    return result
+
+
+def _summarize_renders(current_state: dict):
+    """
+    Derives the overall render_status, render_id and final_video_url from the
+    per-template render fields. The primary template's video is preferred.
+    """
+    statuses = current_state["render_statuses"]
+    urls = current_state["final_video_urls"]
+    primary = current_state["template_id"]
+
+    if any(status not in FINAL_STATUSES for status in statuses.values()):
+        overall = "rendering"
+    elif urls:
+        overall = "succeeded"
+    elif "failed" in statuses.values():
+        overall = "failed"
+    else:
+        overall = "error"
+
+    render_ids = current_state["render_ids"]
+    current_state["render_status"] = overall
+    current_state["render_id"] = render_ids.get(primary) or next(iter(render_ids.values()), None)
+    if overall == "succeeded":
+        current_state["final_video_url"] = urls.get(primary) or next(iter(urls.values()))
+
+
+@job_scope
+def create_video_render(state: GraphState, config: RunnableConfig) -> dict:
+    """
+    Starts the video renders on the workflow's render backend, one per
+    target template, all from the same approved images with the payload
+    mapped onto its elements.
+    """
+    backend = _render_backend(state)
+    if backend != LOCAL and not CREATOMATE_API_KEY:
+        print("Error: CREATOMATE_API_KEY not found in .env file.")
+        return state.model_dump()
+
+    payloads, errors = _target_payloads(state, state.modifications)
+    targets = list(payloads)
+
+    # Fail fast on payloads that don't fit a template instead of waiting for a failed render
+    errors += _validation_errors(payloads, backend)
+    if errors:
+        print("Error: Payload does not match the selected template(s):")
+        for error in errors:
+            print(f"  - {error}")
         current_state = state.model_dump()
-        current_state["render_id"] = render_id
+        current_state["payload_errors"] = errors
+        current_state["render_status"] = "error"
         return current_state
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling Creatomate API: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            try:
-                error_body = e.response.json()
-                print(f"Response body: {error_body}")
-            except:
-                print(f"Response text: {e.response.text}")
+    # Don't start paid renders for a workflow that was abandoned
+    token_for_config(config).raise_if_cancelled()
+
+    print(f"--- Starting Video Render ({len(targets)} template(s)) ---")
+
+    # Submit all renders at once so total time is the slowest render, not the sum
+    with ThreadPoolExecutor(max_workers=len(targets)) as pool:
+        entries = list(pool.map(
+            carry_context(lambda template_id: _submit_render(template_id, payloads[template_id],
+                                                             state.force_rerender, backend=backend)),
+            targets
+        ))
+
+    for template_id, entry in zip(targets, entries):
+        status = (entry.get("status") or "planned") if entry else "failed"
+        get_progress_bus().publish(f"render {template_id}", status)
+
+    if not any(entries):
         return state.model_dump()
 
+    current_state = state.model_dump()
+    current_state["force_rerender"] = False
+    for template_id, entry in zip(targets, entries):
+        if entry is None:
+            current_state["render_statuses"][template_id] = "error"
+            continue
+        current_state["render_ids"][template_id] = entry["render_id"]
+        current_state["render_statuses"][template_id] = entry.get("status") or "planned"
+        if entry.get("status") == "succeeded" and entry.get("url"):
+            print(f"Render already completed for template {template_id}: {entry['url']}")
+            current_state["final_video_urls"][template_id] = entry["url"]
+
+    _summarize_renders(current_state)
+    return current_state
+
 
-def check_video_status(state: GraphState) -> dict:
+@job_scope
+def check_video_status(state: GraphState, config: RunnableConfig) -> dict:
     """
-    Checks the status of the video render and updates the state.
+    Checks the status of all unfinished video renders and updates the state.
     """
-    render_id = state.render_id
-    if not render_id:
+    render_ids = dict(state.render_ids)
+    if not render_ids and state.render_id:
+        # State from before multi-template support
+        render_ids = {state.template_id: state.render_id}
+
+    if not render_ids:
         print("Error: Render ID not found in state.")
         current_state = state.model_dump()
         current_state["render_status"] = "error"
         return current_state
 
-    print(f"--- Checking Status for Render ID: {render_id} ---")
-
-    headers = {
-        "Authorization": f"Bearer {CREATOMATE_API_KEY}",
-        "Content-Type": "application/json",
+    current_state = state.model_dump()
+    current_state["render_ids"] = render_ids
+    pending = {
+        template_id: render_id for template_id, render_id in render_ids.items()
+        if current_state["render_statuses"].get(template_id) not in FINAL_STATUSES
     }
 
-    try:
-        response = requests.get(f"https://api.creatomate.com/v2/renders/{render_id}", headers=headers)
-        response.raise_for_status()
-        
-        render_data = response.json()
-        status = render_data.get("status")
-        
-        print(f"Current render status: '{status}'")
-        
-        current_state = state.model_dump()
-        current_state["render_status"] = status
+    print(f"--- Checking Status for Render IDs: {list(pending.values())} ---")
 
+    with ThreadPoolExecutor(max_workers=max(len(pending), 1)) as pool:
+        results = dict(zip(pending, pool.map(carry_context(_fetch_render), pending.values())))
+
+    for template_id, result in results.items():
+        status = result["status"]
+        if status is None:
+            continue
+        print(f"Current render status for template {template_id}: '{status}'")
+        get_progress_bus().publish(f"render {template_id}", status)
+        current_state["render_statuses"][template_id] = status
         if status == "succeeded":
-            final_url = render_data.get("url")
-            print(f"Render successful! Final video URL: {final_url}")
-            current_state["final_video_url"] = final_url
+            print(f"Render successful! Final video URL: {result['url']}")
+            current_state["final_video_urls"][template_id] = result["url"]
         elif status == "failed":
-            print("Error: Video rendering failed.")
-        else:
-            time.sleep(10)
+            print(f"Error: Video rendering failed for template {template_id}.")
 
+    _summarize_renders(current_state)
+    if current_state["render_status"] not in FINAL_STATUSES:
+        # Wait before the next poll, but stop polling at once if the workflow is cancelled.
+        # The renders are left as they are, so the thread can resume polling from here.
+        all_local = all(get_renderer(LOCAL).owns(render_id) for render_id in pending.values())
+        if token_for_config(config).wait(LOCAL_RENDER_POLL_INTERVAL if all_local else RENDER_POLL_INTERVAL):
+            print("Render polling cancelled.")
+            raise WorkflowCancelled()
+
+    return current_state
+
+
+@job_scope
+def create_draft_render(state: GraphState, config: RunnableConfig) -> dict:
+    """
+    Starts a fast, low-resolution preview render of the primary template so
+    the text can be checked before paying for the full-resolution renders.
+    """
+    current_state = state.model_dump()
+    backend = _render_backend(state)
+    if backend != LOCAL and not CREATOMATE_API_KEY:
+        print("Error: CREATOMATE_API_KEY not found in .env file.")
+        current_state["draft_status"] = "error"
         return current_state
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error checking status: {e}")
-        current_state = state.model_dump()
+    errors = _validation_errors({state.template_id: state.modifications}, backend)
+    current_state["payload_errors"] = errors
+    if errors:
+        print("Error: Payload does not match the selected template:")
+        for error in errors:
+            print(f"  - {error}")
         current_state["render_status"] = "error"
         return current_state
 
+    token_for_config(config).raise_if_cancelled()
+
+    print(f"--- Starting Draft Render (scale {DRAFT_RENDER_SCALE}) ---")
+    entry = _submit_render(state.template_id, state.modifications, render_scale=DRAFT_RENDER_SCALE,
+                           backend=backend)
+    if entry is None:
+        current_state["draft_status"] = "error"
+        return current_state
+
+    current_state["draft_render_id"] = entry["render_id"]
+    current_state["draft_status"] = entry.get("status") or "planned"
+    get_progress_bus().publish("draft", current_state["draft_status"])
+    if entry.get("status") == "succeeded" and entry.get("url"):
+        current_state["draft_video_url"] = entry["url"]
+    return current_state
+
+
+@job_scope
+def check_draft_status(state: GraphState, config: RunnableConfig) -> dict:
+    """Checks the status of the draft preview render and updates the state."""
+    current_state = state.model_dump()
+    result = _fetch_render(state.draft_render_id)
+    if result["status"] is not None:
+        print(f"Current draft status: '{result['status']}'")
+        current_state["draft_status"] = result["status"]
+        get_progress_bus().publish("draft", result["status"])
+        if result["status"] == "succeeded":
+            print(f"Draft ready: {result['url']}")
+            current_state["draft_video_url"] = result["url"]
+
+    if current_state["draft_status"] not in FINAL_STATUSES:
+        local = get_renderer(LOCAL).owns(state.draft_render_id)
+        if token_for_config(config).wait(LOCAL_RENDER_POLL_INTERVAL if local else DRAFT_POLL_INTERVAL):
+            print("Draft polling cancelled.")
+            raise WorkflowCancelled()
+
+    return current_state
+
+
+def wait_for_draft_approval(state: GraphState) -> dict:
+    """
+    HITL node: Pauses after the draft preview so the user can confirm it or
+    correct the text before the full render is queued.
+    """
+    print("\n--- Waiting for Draft Approval ---")
+    if state.draft_video_url:
+        print(f"Draft preview: {state.draft_video_url}")
+    else:
+        print(f"Draft preview unavailable (status: {state.draft_status}).")
+
+    current_state = state.model_dump()
+    current_state["awaiting_draft_approval"] = True
+    return current_state
+
 
 def wait_for_approval(state: GraphState) -> dict:
     """
@@ -271,7 +834,8 @@ def wait_for_approval(state: GraphState) -> dict:
     return current_state
 
 
-def regenerate_images(state: GraphState) -> dict:
+@job_scope
+def regenerate_images(state: GraphState, config: RunnableConfig) -> dict:
     """
     Regenerates images that were rejected by the human reviewer.
     Can either regenerate with AI or use a replacement image uploaded by user.
@@ -285,16 +849,17 @@ def regenerate_images(state: GraphState) -> dict:
         return state.model_dump()
     
     print(f"Images to regenerate: {rejected}")
+    for placeholder in rejected:
+        get_ledger().record("workflow", "regenerate_photo", ref=placeholder)
     
     current_state = state.model_dump()
     current_state["regeneration_count"] += 1
     
-    if not FAL_KEY:
-        print("Warning: FAL_KEY not found. Cannot regenerate images.")
-        return current_state
-    
-    # Process each rejected image
-    for placeholder in rejected:
+    token = token_for_config(config)
+    regeneration_prompt = REGENERATE_PROMPT.format(attempt=current_state['regeneration_count'])
+    aspect_ratio = get_template_registry().aspect_ratio(state.template_id)
+
+    def regenerate_one(placeholder):
         # Check if user provided a replacement image
         if placeholder in state.replacement_images:
             # Use the replacement image path
@@ -307,43 +872,49 @@ def regenerate_images(state: GraphState) -> dict:
         
         if not file_path or not os.path.exists(file_path):
             print(f"Warning: Image file not found for {placeholder}. Skipping.")
-            continue
+            return None
         
+        if placeholder in state.replacement_images:
+            quality = _prescreen(placeholder, file_path)
+            if quality:
+                current_state["image_quality"][placeholder] = quality
+
+        # The reviewer rejected this result - don't hand it out for future listings
+        original_path = state.input_images.get(placeholder)
+        if original_path and os.path.exists(original_path):
+            original_hash = _photo_hash(placeholder, original_path)
+            if original_hash:
+                get_photo_index().forget(original_hash)
+
+        bus = get_progress_bus()
         try:
-            # Upload the image
-            with open(file_path, "rb") as f:
-                image_bytes = f.read()
-            
-            uploaded_url = fal_client.upload(image_bytes, content_type="image/jpeg")
-            print(f"File uploaded to temporary URL: {uploaded_url}")
-            
-            # Use a slightly modified prompt for regeneration
-            regeneration_prompt = f"A high-quality, clear photograph, vibrant and professional, well-composed with excellent lighting and focus. Attempt {current_state['regeneration_count']}"
-            
-            # Submit to fal.ai
-            result = fal_client.subscribe(
-                FAL_MODEL_URL,
-                arguments={
-                    "prompt": regeneration_prompt,
-                    "image_urls": [uploaded_url],
-                    "num_images": 1,
-                    "output_format": "jpeg",
-                    "aspect_ratio": "9:16"
-                },
-                with_logs=True,
-                on_queue_update=on_queue_update,
-            )
-            
-            # Extract the new processed image URL
-            if result and "images" in result and len(result["images"]) > 0:
-                new_url = result["images"][0]["url"]
-                current_state["processed_image_urls"][placeholder] = new_url
-                print(f"Successfully regenerated '{placeholder}'. New URL: {new_url}")
-            else:
-                print(f"Warning: No image URL returned for '{placeholder}'")
-        
+            mode = state.image_enhancement_modes.get(placeholder, state.enhancement_mode)
+            new_url, engine = _enhance_with_mode(placeholder, file_path, mode, regeneration_prompt, token,
+                                                 aspect_ratio)
+        except WorkflowCancelled:
+            bus.publish(placeholder, "cancelled")
+            raise
         except Exception as e:
             print(f"Error regenerating image {file_path}: {e}")
+            bus.publish(placeholder, "failed", message=str(e))
+            return None
+
+        if not new_url:
+            print(f"Warning: No image URL returned for '{placeholder}'")
+            bus.publish(placeholder, "failed", message="no image returned")
+            return None
+
+        print(f"Successfully regenerated '{placeholder}'. New URL: {new_url}")
+        bus.publish(placeholder, "done", message=engine)
+        return new_url
+
+    # Rejected images are independent of each other - regenerate them in parallel
+    with ThreadPoolExecutor(max_workers=len(rejected)) as pool:
+        results = dict(zip(rejected, pool.map(carry_context(regenerate_one), rejected)))
+
+    for placeholder, new_url in results.items():
+        if new_url:
+            current_state["processed_image_urls"][placeholder] = new_url
     
     print("\n--- Finished Regenerating Images ---")
     
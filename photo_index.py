@@ -0,0 +1,203 @@
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, List, Optional, Union, BinaryIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from templates import DEFAULT_ASPECT_RATIO
+
+# --- Photo Index Configuration ---
+# Local disk shared by the instances of one host - not a network filesystem (see PhotoIndex)
+PHOTO_INDEX_PATH = os.getenv(
+    "PHOTO_INDEX_PATH",
+    os.path.join(tempfile.gettempdir(), "video_generator_photos.sqlite3")
+)
+# Hamming distance (out of 64 bits) at which two photos count as the same shot
+DUPLICATE_DISTANCE = int(os.getenv("PHOTO_DUPLICATE_DISTANCE", "8"))
+# Stricter distance for reusing an enhancement result - a resend/recompress of the same file
+REUSE_DISTANCE = int(os.getenv("PHOTO_REUSE_DISTANCE", "2"))
+# fal storage URLs are not kept forever; don't hand out stale ones
+PHOTO_INDEX_TTL = int(os.getenv("PHOTO_INDEX_TTL", str(7 * 24 * 3600)))
+PHOTO_INDEX_MAX_ENTRIES = int(os.getenv("PHOTO_INDEX_MAX_ENTRIES", "5000"))
+
+HASH_SIZE = 8
+_DCT_SIZE = 32
+
+# Engines whose results each enhancement mode may reuse
+REUSABLE_ENGINES = {
+    "auto": {"model", "original"},
+    "model": {"model"},
+    "local": {"local"},
+}
+
+
+def _result_key(engine: str, aspect_ratio: str) -> str:
+    """Model and local results are framed for one aspect ratio; an original (uncropped) photo fits any."""
+    if engine in ("model", "local") and aspect_ratio != DEFAULT_ASPECT_RATIO:
+        return f"{engine}:{aspect_ratio}"
+    return engine
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so a 2D DCT is two matrix products."""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    basis = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    basis[0] /= np.sqrt(2)
+    return basis
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def phash(source: Union[str, BinaryIO]) -> str:
+    """
+    Perceptual hash of an image (path or file object) as 16 hex digits.
+    Robust to resizing, recompression (e.g. WhatsApp) and small edits;
+    compare hashes with `hamming`.
+    """
+    with Image.open(source) as image:
+        image.draft("L", (_DCT_SIZE * 4, _DCT_SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert("L")
+    small = np.asarray(image.resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+
+    low_freq = (_DCT @ small @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low_freq > np.median(low_freq[1:])  # DC term excluded from the median
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):016x}"
+
+
+def hamming(hash_a: str, hash_b: str) -> int:
+    """Number of differing bits between two perceptual hashes."""
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+
+def find_duplicates(hashes: Dict[str, str], max_distance: int = DUPLICATE_DISTANCE) -> List[List[str]]:
+    """
+    Groups placeholders whose photos are near-duplicates of each other.
+    Returns only groups with more than one photo, in placeholder order.
+    """
+    groups: List[List[str]] = []
+    for name, value in hashes.items():
+        for group in groups:
+            if any(hamming(value, hashes[other]) <= max_distance for other in group):
+                group.append(name)
+                break
+        else:
+            groups.append([name])
+    return [group for group in groups if len(group) > 1]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS photo_results (
+    photo_hash TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    url TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (photo_hash, engine)
+);
+CREATE INDEX IF NOT EXISTS photo_results_created ON photo_results (created_at);
+"""
+
+
+class PhotoIndex:
+    """
+    Cross-job index of perceptual hashes -> enhancement results.
+
+    When a photo that was already enhanced for an earlier listing is
+    uploaded again (even resized or recompressed), its hosted result is
+    reused instead of running the model again.
+
+    Stored in SQLite (like the ledger and the lease table), so instances on
+    one host sharing PHOTO_INDEX_PATH add to the same index instead of
+    overwriting each other's results. Same host only: WAL mode is not safe
+    on a network filesystem (NFS, SMB, EFS). Index operations never raise.
+    """
+
+    def __init__(self, path: Optional[str] = PHOTO_INDEX_PATH, ttl: int = PHOTO_INDEX_TTL,
+                 max_entries: int = PHOTO_INDEX_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path or ":memory:", check_same_thread=False,
+                                         isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def lookup(self, photo_hash: str, mode: str, aspect_ratio: str = DEFAULT_ASPECT_RATIO) -> Optional[str]:
+        """Returns a reusable result URL for the photo in this enhancement mode and format, or None."""
+        engines = sorted({_result_key(engine, aspect_ratio) for engine in REUSABLE_ENGINES.get(mode, set())})
+        if not engines:
+            return None
+        try:
+            with self._lock:
+                rows = self._connection().execute(
+                    f"SELECT photo_hash, url FROM photo_results WHERE created_at >= ?"
+                    f" AND engine IN ({', '.join('?' * len(engines))})",
+                    (time.time() - self.ttl, *engines),
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read photo index: {e}")
+            return None
+
+        best_url, best_distance = None, REUSE_DISTANCE + 1
+        for known_hash, url in rows:
+            distance = hamming(photo_hash, known_hash)
+            if distance < best_distance:
+                best_url, best_distance = url, distance
+        return best_url
+
+    def record(self, photo_hash: str, engine: str, url: str, aspect_ratio: str = DEFAULT_ASPECT_RATIO):
+        """Remembers the hosted result of enhancing a photo with `engine` (for `aspect_ratio`)."""
+        if not url.startswith(("http://", "https://")):
+            return  # local files don't outlive the job's scratch directory
+        try:
+            with self._lock:
+                connection = self._connection()
+                connection.execute(
+                    "INSERT INTO photo_results (photo_hash, engine, url, created_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT (photo_hash, engine) DO UPDATE SET url = excluded.url,"
+                    " created_at = excluded.created_at",
+                    (photo_hash, _result_key(engine, aspect_ratio), url, time.time()),
+                )
+                # Keep the most recently enhanced photos
+                connection.execute(
+                    "DELETE FROM photo_results WHERE photo_hash IN (SELECT photo_hash FROM photo_results"
+                    " GROUP BY photo_hash ORDER BY MAX(created_at) DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write photo index: {e}")
+
+    def forget(self, photo_hash: str):
+        """Drops every result for a photo (e.g. the reviewer rejected it)."""
+        try:
+            with self._lock:
+                connection = self._connection()
+                known = [row[0] for row in connection.execute("SELECT DISTINCT photo_hash FROM photo_results")]
+                for known_hash in [h for h in known if hamming(photo_hash, h) <= REUSE_DISTANCE]:
+                    connection.execute("DELETE FROM photo_results WHERE photo_hash = ?", (known_hash,))
+        except sqlite3.Error as e:
+            print(f"Warning: Could not update photo index: {e}")
+
+
+_index: Optional[PhotoIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_photo_index() -> PhotoIndex:
+    """Returns the process-wide photo index."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = PhotoIndex()
+        return _index
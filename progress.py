@@ -0,0 +1,154 @@
+import time
+import itertools
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from ledger import current_scope
+
+# Statuses that end an item; its next event starts it over (e.g. a regenerated photo)
+DONE_STATUSES = {"done", "failed", "cancelled", "succeeded", "error"}
+# Statuses where the provider has the work but hasn't started it
+PROVIDER_QUEUED = {"queued", "planned", "waiting"}
+LOG_LINES_KEPT = 3
+
+
+class ProgressBus:
+    """
+    Live progress of the work inside a workflow, one item per photo or render.
+
+    Nodes publish status changes as they happen - our own scheduler queue
+    ("scheduled"), uploads, the fal.ai queue position, model log lines,
+    Creatomate render statuses - and subscribers (the UI, the CLI, metrics
+    exporters) get each event as a dict. `snapshot()` gives the latest
+    state of every item of a thread, with the time it has spent in each
+    status, so provider queueing can be told apart from our own slowness.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Tuple[Optional[str], Callable[[dict], None]]] = {}
+        self._ids = itertools.count()
+        self._items: Dict[Optional[str], Dict[str, Dict[str, Any]]] = {}  # thread -> item -> latest event
+
+    def publish(self, item: Optional[str], status: str, message: Optional[str] = None,
+                queue_position: Optional[int] = None, logs: Optional[List[str]] = None,
+                thread_id: Optional[str] = None) -> Optional[dict]:
+        """Records a status for `item` in the current job's thread and notifies subscribers."""
+        if not item:
+            return None
+        scope_thread, node, _ = current_scope()
+        thread_id = thread_id or scope_thread
+        now = time.time()
+
+        with self._lock:
+            items = self._items.setdefault(thread_id, {})
+            previous = items.get(item)
+            if previous is None or previous["status"] in DONE_STATUSES:
+                started_at, status_since, phases, kept_logs = now, now, {}, []
+            else:
+                started_at, phases, kept_logs = previous["started_at"], dict(previous["phases"]), previous["logs"]
+                status_since = previous["status_since"]
+                if status != previous["status"]:
+                    phases[previous["status"]] = phases.get(previous["status"], 0.0) + now - status_since
+                    status_since = now
+            if logs:
+                kept_logs = list(logs)[-LOG_LINES_KEPT:]
+
+            event = {
+                "thread_id": thread_id,
+                "node": node,
+                "item": item,
+                "status": status,
+                "message": message,
+                "queue_position": queue_position,
+                "logs": kept_logs,
+                "ts": now,
+                "started_at": started_at,
+                "status_since": status_since,
+                "phases": phases,
+            }
+            items[item] = event
+            subscribers = [callback for wanted, callback in self._subscribers.values()
+                           if wanted is None or wanted == thread_id]
+
+        for callback in subscribers:
+            try:
+                callback(dict(event))
+            except Exception as e:
+                print(f"Warning: Progress subscriber failed: {e}")
+        return event
+
+    def subscribe(self, callback: Callable[[dict], None],
+                  thread_id: Optional[str] = None) -> Callable[[], None]:
+        """
+        Calls `callback(event)` for every event (of one thread, if given).
+        Callbacks run on the publishing worker thread and must be quick.
+        Returns a function that unsubscribes.
+        """
+        with self._lock:
+            subscription = next(self._ids)
+            self._subscribers[subscription] = (thread_id, callback)
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers.pop(subscription, None)
+        return unsubscribe
+
+    def snapshot(self, thread_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+        """Latest event per item of a thread, with `elapsed` and `phases` brought up to now."""
+        now = time.time()
+        with self._lock:
+            items = {item: dict(event) for item, event in self._items.get(thread_id, {}).items()}
+        for event in items.values():
+            if event["status"] in DONE_STATUSES:
+                end = event["ts"]
+            else:
+                end = now
+                phases = dict(event["phases"])
+                phases[event["status"]] = phases.get(event["status"], 0.0) + now - event["status_since"]
+                event["phases"] = phases
+            event["elapsed"] = end - event["started_at"]
+        return items
+
+    def clear(self, thread_id: Optional[str]):
+        """Forgets a finished or abandoned thread's items."""
+        with self._lock:
+            self._items.pop(thread_id, None)
+
+
+def describe(event: Dict[str, Any]) -> str:
+    """One-line description of an item's state, e.g. "queued at fal.ai (position 3)"."""
+    status = event["status"]
+    if event.get("queue_position") is not None:
+        text = f"{status} (position {event['queue_position']})"
+    else:
+        text = status
+    detail = event.get("message") or (event["logs"][-1] if event.get("logs") else None)
+    if detail:
+        text += f" - {detail}"
+    return text
+
+
+def provider_queue_seconds(event: Dict[str, Any]) -> float:
+    """Time an item has spent waiting in a provider's queue (as opposed to ours or in processing)."""
+    return sum(seconds for status, seconds in event.get("phases", {}).items() if status in PROVIDER_QUEUED)
+
+
+_bus = ProgressBus()
+
+
+def get_progress_bus() -> ProgressBus:
+    """Returns the process-wide progress bus."""
+    return _bus
+
+
+def format_progress(thread_id: Optional[str]) -> str:
+    """Formats a thread's items as one line per photo or render."""
+    lines = []
+    for item, event in sorted(_bus.snapshot(thread_id).items()):
+        line = f"{item:<22} {describe(event):<60} {event['elapsed']:>6.1f}s"
+        queued = provider_queue_seconds(event)
+        if queued:
+            line += f" ({queued:.1f}s in provider queue)"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Any, Optional, Callable
+
+from leases import get_lease_manager, resource_name, RENDER_SUBMIT
+
+# How long a render result is reused for an identical payload.
+# Creatomate keeps rendered files for a limited time, so don't trust them forever.
+RENDER_CACHE_TTL = int(os.getenv("RENDER_CACHE_TTL", str(24 * 3600)))
+RENDER_CACHE_DIR = os.getenv(
+    "RENDER_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "video_generator_renders")
+)
+
+# Statuses that mean the render is finished one way or the other
+FINAL_STATUSES = {"succeeded", "failed", "error", "cancelled"}
+SUBMIT_WAIT_INTERVAL = 1  # seconds between checks while another instance submits a payload
+
+
+def payload_key(template_id: str, modifications: Dict[str, Any],
+                options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Returns a canonical hash for a render request. Key order and whitespace
+    don't matter, so the same payload always maps to the same key.
+    `options` are extra render settings (e.g. a draft's render_scale) that
+    make an otherwise identical request a different render.
+    """
+    request = {"template_id": template_id, "modifications": modifications}
+    if options:
+        request["options"] = options
+    canonical = json.dumps(
+        request,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """
+    Idempotent render cache keyed by payload hash.
+
+    - A payload that already rendered successfully returns its URL without a new render.
+    - A payload that is still rendering returns the existing render_id.
+    - Concurrent submissions of the same payload share a single API call,
+      across instances too when they share the cache dir (see leases.py).
+    """
+
+    def __init__(self, ttl: int = RENDER_CACHE_TTL, cache_dir: Optional[str] = RENDER_CACHE_DIR):
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._render_keys: Dict[str, str] = {}  # render_id -> payload key
+        self._inflight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def _cache_path(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            return entry
+        path = self._cache_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read render cache entry {key[:12]}: {e}")
+            return None
+        self._entries[key] = entry
+        if entry.get("render_id"):
+            self._render_keys[entry["render_id"]] = key
+        return entry
+
+    def _store(self, key: str, entry: Dict[str, Any]):
+        self._entries[key] = entry
+        if entry.get("render_id"):
+            self._render_keys[entry["render_id"]] = key
+        path = self._cache_path(key)
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write render cache entry {key[:12]}: {e}")
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry and entry.get("render_id"):
+            self._render_keys.pop(entry["render_id"], None)
+        path = self._cache_path(key)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _usable(self, entry: Optional[Dict[str, Any]]) -> bool:
+        if entry is None:
+            return False
+        if entry.get("status") in ("failed", "error"):
+            return False
+        return time.time() - entry.get("created_at", 0) < self.ttl
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Returns a usable cache entry for the payload key, or None."""
+        with self._lock:
+            entry = self._load(key)
+            if self._usable(entry):
+                return dict(entry)
+            if entry is not None:
+                self._discard(key)
+            return None
+
+    def get_or_submit(self, key: str, submit: Callable[[], Optional[str]],
+                      force: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cache entry for `key`, calling `submit()` to start a new
+        render only when no usable entry exists (or `force` is set).
+        `submit` must return the new render_id, or None on failure.
+        """
+        while True:
+            with self._lock:
+                if force:
+                    self._discard(key)
+                    force = False
+                else:
+                    entry = self._load(key)
+                    if self._usable(entry):
+                        print(f"Reusing render {entry['render_id']} for identical payload (status: {entry.get('status')}).")
+                        return dict(entry)
+                    if entry is not None:
+                        self._discard(key)
+
+                waiter = self._inflight.get(key)
+                if waiter is None:
+                    # We are the leader for this payload
+                    done = threading.Event()
+                    self._inflight[key] = done
+                    break
+
+            # Another caller is already submitting this payload - wait for its result
+            print("Identical render already being submitted - waiting for it...")
+            waiter.wait()
+
+        lease = resource_name(RENDER_SUBMIT, key) if self.cache_dir else None
+        try:
+            if lease:
+                entry = self._await_other_instances(key, lease)
+                if entry is not None:
+                    return entry
+                with get_lease_manager().hold(lease):
+                    render_id = submit()
+            else:
+                render_id = submit()
+            if not render_id:
+                return None
+            entry = {
+                "render_id": render_id,
+                "status": "planned",
+                "url": None,
+                "created_at": time.time(),
+            }
+            with self._lock:
+                self._store(key, entry)
+            return dict(entry)
+        finally:
+            if lease:
+                get_lease_manager().release(lease)
+            with self._lock:
+                self._inflight.pop(key, None)
+            done.set()
+
+    def _await_other_instances(self, key: str, lease: str) -> Optional[Dict[str, Any]]:
+        """
+        Takes the submission lease for a payload. If another instance holds
+        it, waits until it is done and returns the render it stored in the
+        shared cache dir; returns None when this instance should submit.
+        """
+        leases = get_lease_manager()
+        if leases.acquire(lease):
+            return None
+        print("Identical render being submitted by another instance - waiting for it...")
+        while not leases.acquire(lease):
+            time.sleep(SUBMIT_WAIT_INTERVAL)
+        with self._lock:
+            entry = self._load(key)
+            if self._usable(entry):
+                print(f"Reusing render {entry['render_id']} submitted by another instance.")
+                return dict(entry)
+        return None
+
+    def record_status(self, render_id: str, status: Optional[str], url: Optional[str] = None):
+        """Updates the cached entry for a render as its status changes."""
+        with self._lock:
+            key = self._render_keys.get(render_id)
+            if key is None:
+                return
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if status in ("failed", "error"):
+                # Never hand out a failed render - the next submission should retry
+                self._discard(key)
+                return
+            updated = {**entry, "status": status}
+            if url:
+                updated["url"] = url
+            self._store(key, updated)
+
+
+_cache: Optional[RenderCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """Returns the process-wide render cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+        return _cache
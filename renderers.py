@@ -0,0 +1,261 @@
+import os
+import json
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+import requests
+
+from circuit_breaker import get_breaker, CircuitOpenError
+from ledger import get_ledger, current_scope
+from scheduler import get_scheduler
+from scratch import get_scratch_manager
+from local_render import render_slideshow, ffmpeg_available, LOCAL_RENDER_DIR
+
+CREATOMATE_RENDERS_URL = "https://api.creatomate.com/v2/renders"
+
+# Creatomate API requests (not renders) should answer quickly; don't hang a worker on them
+CREATOMATE_TIMEOUT = float(os.getenv("CREATOMATE_TIMEOUT", "30"))
+
+LOCAL_RENDER_WORKERS = int(os.getenv("LOCAL_RENDER_WORKERS", "2"))
+
+# Render backends selectable in GraphState.render_backend
+CREATOMATE = "creatomate"
+LOCAL = "local"
+AUTO = "auto"  # Creatomate, falling back to the local renderer
+
+
+class Renderer:
+    """
+    A video render backend. Renders are asynchronous: `submit` starts one and
+    returns its render_id, `fetch` reports its status ("planned", "rendering",
+    "succeeded", "failed" or "error") and, once succeeded, its video URL.
+    """
+
+    name = ""
+
+    def available(self) -> bool:
+        """Whether this backend can take renders right now."""
+        return True
+
+    def submit(self, template_id: str, modifications: Dict[str, Any],
+               render_scale: Optional[float] = None) -> Optional[str]:
+        """Starts a render; returns its render_id, or None if it could not be started."""
+        raise NotImplementedError
+
+    def fetch(self, render_id: str) -> Dict[str, Optional[str]]:
+        """
+        Returns {"status", "url"} for a render. A None status means the
+        status is unknown right now and should be polled again.
+        """
+        raise NotImplementedError
+
+
+def _is_provider_failure(error: BaseException) -> bool:
+    """
+    Whether an error means Creatomate itself is unhealthy. Client errors
+    (4xx, e.g. a rejected payload) don't count against the circuit breaker.
+    """
+    response = getattr(error, "response", None)
+    if response is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+        return False
+    return True
+
+
+class CreatomateRenderer(Renderer):
+    """Renders through the Creatomate API, guarded by the creatomate circuit breaker."""
+
+    name = CREATOMATE
+
+    def __init__(self, api_key: Optional[str]):
+        self.api_key = api_key
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+    def available(self) -> bool:
+        return bool(self.api_key) and get_breaker("creatomate").snapshot()["state"] != "open"
+
+    def submit(self, template_id: str, modifications: Dict[str, Any],
+               render_scale: Optional[float] = None) -> Optional[str]:
+        data = {
+            "template_id": template_id,
+            "modifications": modifications,
+        }
+        if render_scale:
+            data["render_scale"] = render_scale
+
+        try:
+            breaker = get_breaker("creatomate")
+            with get_scheduler("creatomate").slot(breaker=breaker), \
+                    breaker.track(is_failure=_is_provider_failure), \
+                    get_ledger().track("creatomate", "submit", bytes_sent=len(json.dumps(data))) as call:
+                response = requests.post(CREATOMATE_RENDERS_URL, json=data, headers=self._headers(),
+                                         timeout=CREATOMATE_TIMEOUT)
+                call.bytes_received = len(response.content)
+                response.raise_for_status()
+                render_data = response.json()
+
+                # Handle both single object and array responses
+                if isinstance(render_data, list):
+                    render_id = render_data[0]["id"]
+                else:
+                    render_id = render_data["id"]
+                call.ref = render_id
+
+            print(f"Creatomate response: {render_data}")
+            print(f"Successfully started render for template {template_id}. Render ID: {render_id}")
+            return render_id
+
+        except CircuitOpenError as e:
+            print(f"Skipping render for template {template_id}: {e}")
+            return None
+
+        except requests.exceptions.RequestException as e:
+            print(f"Error calling Creatomate API for template {template_id}: {e}")
+            if hasattr(e, 'response') and e.response is not None:
+                try:
+                    error_body = e.response.json()
+                    print(f"Response body: {error_body}")
+                except:
+                    print(f"Response text: {e.response.text}")
+            return None
+
+    def fetch(self, render_id: str) -> Dict[str, Optional[str]]:
+        try:
+            breaker = get_breaker("creatomate")
+            with get_scheduler("creatomate").slot(breaker=breaker), \
+                    breaker.track(is_failure=_is_provider_failure), \
+                    get_ledger().track("creatomate", "status", ref=render_id) as call:
+                response = requests.get(f"{CREATOMATE_RENDERS_URL}/{render_id}", headers=self._headers(),
+                                        timeout=CREATOMATE_TIMEOUT)
+                call.bytes_received = len(response.content)
+                response.raise_for_status()
+            render_data = response.json()
+        except CircuitOpenError as e:
+            # The render itself may be fine - keep its last status and poll again later
+            print(f"Not checking render {render_id}: {e}")
+            return {"status": None, "url": None}
+        except requests.exceptions.RequestException as e:
+            print(f"Error checking status of render {render_id}: {e}")
+            return {"status": "error", "url": None}
+
+        return {"status": render_data.get("status"), "url": render_data.get("url")}
+
+
+class LocalRenderer(Renderer):
+    """
+    Renders a 9:16 slideshow on this machine with Pillow and ffmpeg, in a
+    process pool. No queue, no API key and no network (except to download
+    hosted photos) - for offline previews, tests and as a fallback.
+    The video URL is a local file path: in `output_dir` if set, otherwise
+    in a scratch directory per workflow thread that `release_thread`
+    deletes (the scratch janitor catches what is never released).
+    """
+
+    name = LOCAL
+    ID_PREFIX = "local-"
+
+    def __init__(self, output_dir: Optional[str] = LOCAL_RENDER_DIR, workers: int = LOCAL_RENDER_WORKERS):
+        self.output_dir = output_dir
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._renders: Dict[str, Future] = {}
+        self._thread_dirs: Dict[Optional[str], str] = {}  # workflow thread -> its render directory
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._pool
+
+    def available(self) -> bool:
+        return ffmpeg_available()
+
+    def _render_dir(self) -> str:
+        """Directory for the current workflow thread's videos."""
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            return self.output_dir
+        thread_id, _, _ = current_scope()
+        with self._lock:
+            path = self._thread_dirs.get(thread_id)
+            if path is None or not os.path.isdir(path):
+                path = self._thread_dirs[thread_id] = get_scratch_manager().create_job_dir(prefix="renders_")
+            return path
+
+    def release_thread(self, thread_id: Optional[str]):
+        """Deletes the videos rendered for a released or pruned workflow thread."""
+        with self._lock:
+            path = self._thread_dirs.pop(thread_id, None)
+        if path:
+            get_scratch_manager().release(path)
+
+    def submit(self, template_id: str, modifications: Dict[str, Any],
+               render_scale: Optional[float] = None) -> Optional[str]:
+        if not self.available():
+            print("Error: ffmpeg not found - local rendering unavailable.")
+            return None
+
+        render_id = f"{self.ID_PREFIX}{uuid.uuid4().hex}"
+        output_path = os.path.join(self._render_dir(), f"{render_id}.mp4")
+        with get_ledger().track("local", "submit", ref=render_id):
+            future = self._get_pool().submit(render_slideshow, dict(modifications), output_path,
+                                             render_scale or 1.0)
+        with self._lock:
+            self._renders[render_id] = future
+        print(f"Started local render for template {template_id}. Render ID: {render_id}")
+        return render_id
+
+    def fetch(self, render_id: str) -> Dict[str, Optional[str]]:
+        with self._lock:
+            future = self._renders.get(render_id)
+        if future is None:
+            # Renders live in this process only - e.g. lost on a server restart
+            print(f"Error: Unknown local render {render_id}.")
+            return {"status": "error", "url": None}
+        if not future.done():
+            return {"status": "rendering" if future.running() else "planned", "url": None}
+
+        with self._lock:
+            self._renders.pop(render_id, None)
+        error = future.exception()
+        if error is not None:
+            print(f"Local render {render_id} failed: {error}")
+            return {"status": "failed", "url": None}
+        return {"status": "succeeded", "url": future.result()}
+
+    def owns(self, render_id: str) -> bool:
+        return render_id.startswith(self.ID_PREFIX)
+
+
+_renderers: Dict[str, Renderer] = {}
+_renderers_lock = threading.Lock()
+
+
+def get_renderer(name: str) -> Renderer:
+    """Returns the process-wide renderer for a backend ("creatomate" or "local")."""
+    with _renderers_lock:
+        if name not in _renderers:
+            if name == CREATOMATE:
+                _renderers[name] = CreatomateRenderer(os.getenv("CREATOMATE_API_KEY"))
+            elif name == LOCAL:
+                _renderers[name] = LocalRenderer()
+            else:
+                raise ValueError(f"Unknown render backend '{name}'")
+        return _renderers[name]
+
+
+def renderer_for(render_id: str) -> Renderer:
+    """Returns the backend that owns a render_id."""
+    local = get_renderer(LOCAL)
+    return local if local.owns(render_id) else get_renderer(CREATOMATE)
@@ -0,0 +1,282 @@
+import os
+import time
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from cancellation import get_cancel_token
+from circuit_breaker import CircuitBreaker
+from ledger import current_scope, percentile
+
+# --- Scheduler Configuration ---
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Calls in flight per provider, shared by every tenant on this deployment
+PROVIDER_CAPACITY = {
+    "fal": int(os.getenv("FAL_MAX_CONCURRENCY", "8")),
+    "creatomate": int(os.getenv("CREATOMATE_MAX_CONCURRENCY", "4")),
+}
+# Most calls one tenant may have in flight per provider (interactive calls are exempt)
+TENANT_QUOTA = {
+    "fal": int(os.getenv("FAL_TENANT_QUOTA", "5")),
+    "creatomate": int(os.getenv("CREATOMATE_TENANT_QUOTA", "2")),
+}
+# Tenant shares, e.g. "agent@brand.com=2,Other Brand=0.5" (default weight 1)
+TENANT_WEIGHTS = os.getenv("SCHEDULER_TENANT_WEIGHTS", "")
+# Graph nodes a user is actively waiting on - served before batch work
+INTERACTIVE_NODES = {"regenerate", "create_draft", "check_draft"}
+WAIT_WINDOW = 200  # recent queue waits kept for the metrics
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        tenant, _, weight = item.rpartition("=")
+        if tenant.strip():
+            try:
+                weights[tenant.strip()] = max(float(weight), 0.01)
+            except ValueError:
+                print(f"Warning: Ignoring invalid tenant weight '{item}'")
+    return weights
+
+
+class _Ticket:
+    """One call waiting for (or holding) a slot."""
+
+    __slots__ = ("tenant", "interactive", "start", "finish", "seq", "enqueued_at", "granted")
+
+    def __init__(self, tenant: str, interactive: bool, start: float, finish: float, seq: int):
+        self.tenant = tenant
+        self.interactive = interactive
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class FairScheduler:
+    """
+    Weighted fair queue in front of one provider.
+
+    At most `capacity` calls run at once. When calls are waiting, the next
+    free slot goes to an interactive call (a user waiting on a HITL action)
+    if there is one, otherwise to the tenant furthest behind its fair share:
+    each call gets a virtual finish time of max(virtual clock, tenant's last
+    finish) + cost / weight, and the lowest finish time is served first. So
+    an agent submitting 20 listings gets the same share as one submitting a
+    single listing, and no tenant holds more than `tenant_quota` batch slots.
+    """
+
+    def __init__(self, name: str, capacity: int, tenant_quota: int,
+                 weights: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.capacity = max(capacity, 1)
+        self.tenant_quota = max(tenant_quota, 1)
+        self.weights = weights or {}
+        self._cond = threading.Condition()
+        self._waiting: List[_Ticket] = []
+        self._in_flight = 0
+        self._tenant_in_flight: Dict[str, int] = {}
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._waits: deque = deque(maxlen=WAIT_WINDOW)  # (interactive, seconds queued)
+
+    def _eligible(self, ticket: _Ticket) -> bool:
+        return ticket.interactive or self._tenant_in_flight.get(ticket.tenant, 0) < self.tenant_quota
+
+    def _dispatch(self):
+        """Hands free slots to waiting calls, best first. Caller holds the lock."""
+        granted = False
+        while self._in_flight < self.capacity:
+            eligible = [ticket for ticket in self._waiting if self._eligible(ticket)]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (not t.interactive, t.finish, t.seq))
+            self._waiting.remove(ticket)
+            ticket.granted = True
+            if ticket.start > self._virtual_time:
+                self._virtual_time = ticket.start
+                self._forget_idle_tenants()
+            self._in_flight += 1
+            self._tenant_in_flight[ticket.tenant] = self._tenant_in_flight.get(ticket.tenant, 0) + 1
+            self._waits.append((ticket.interactive, time.monotonic() - ticket.enqueued_at))
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _forget_idle_tenants(self):
+        """
+        Drops finish times the virtual clock has passed - such a tenant starts
+        at the clock anyway - so tenants that come and go don't pile up.
+        Caller holds the lock.
+        """
+        self._last_finish = {tenant: finish for tenant, finish in self._last_finish.items()
+                             if finish > self._virtual_time}
+
+    def _withdraw(self, ticket: _Ticket):
+        """
+        Takes a call that never ran out of the queue and gives its charge back
+        to the tenant, so a cancelled job doesn't push the tenant's later calls
+        back. Caller holds the lock.
+        """
+        self._waiting.remove(ticket)
+        charge = ticket.finish - ticket.start
+        for other in self._waiting:
+            if other.tenant == ticket.tenant and other.seq > ticket.seq:
+                other.start -= charge
+                other.finish -= charge
+        if ticket.tenant in self._last_finish:
+            self._last_finish[ticket.tenant] -= charge
+            if self._last_finish[ticket.tenant] <= self._virtual_time:
+                del self._last_finish[ticket.tenant]
+        self._dispatch()
+
+    def _release(self, ticket: _Ticket):
+        """Gives a granted slot back. Caller holds the lock."""
+        self._in_flight -= 1
+        remaining = self._tenant_in_flight.get(ticket.tenant, 1) - 1
+        if remaining:
+            self._tenant_in_flight[ticket.tenant] = remaining
+        else:
+            self._tenant_in_flight.pop(ticket.tenant, None)
+        if not self._in_flight and not self._waiting and self._last_finish:
+            # Idle: nobody is behind anyone any more, start the next busy period even
+            self._virtual_time = max(self._virtual_time, *self._last_finish.values())
+            self._forget_idle_tenants()
+        self._dispatch()
+
+    @contextmanager
+    def slot(self, tenant: Optional[str] = None, interactive: Optional[bool] = None, cost: float = 1.0,
+             breaker: Optional[CircuitBreaker] = None):
+        """
+        Blocks until this call may run, then holds a slot while the block runs.
+        Tenant and priority default to the current job scope (see ledger.job_scope);
+        raises WorkflowCancelled if the job is cancelled while queued, and
+        CircuitOpenError - before queuing, or as soon as it trips while
+        queued - if the provider's `breaker` is rejecting calls.
+        """
+        if breaker is not None:
+            breaker.check()
+        if not SCHEDULER_ENABLED:
+            yield
+            return
+
+        thread_id, node, scope_tenant = current_scope()
+        tenant = tenant or scope_tenant or "(default)"
+        if interactive is None:
+            interactive = node in INTERACTIVE_NODES
+        token = get_cancel_token(thread_id)
+
+        with self._cond:
+            start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+            finish = start + cost / self.weights.get(tenant, 1.0)
+            self._last_finish[tenant] = finish
+            ticket = _Ticket(tenant, interactive, start, finish, next(self._seq))
+            self._waiting.append(ticket)
+            self._dispatch()
+            try:
+                while not ticket.granted:
+                    token.raise_if_cancelled()
+                    if breaker is not None:
+                        breaker.check()
+                    self._cond.wait(0.5)
+            except BaseException:
+                if ticket.granted:
+                    self._release(ticket)
+                else:
+                    self._withdraw(ticket)
+                raise
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._release(ticket)
+
+    @contextmanager
+    def spare_slot(self, tenant: Optional[str] = None, cost: float = 1.0):
+        """
+        Holds a slot for optional extra work (e.g. a hedged duplicate) only
+        if one is free right now and no call is waiting for it; never
+        queues. Yields whether the slot was taken. The call is charged to
+        the tenant's fair share like any other.
+        """
+        if not SCHEDULER_ENABLED:
+            yield True
+            return
+
+        _, _, scope_tenant = current_scope()
+        tenant = tenant or scope_tenant or "(default)"
+        with self._cond:
+            ticket = None
+            if self._in_flight < self.capacity and not self._waiting and \
+                    self._tenant_in_flight.get(tenant, 0) < self.tenant_quota:
+                start = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+                finish = start + cost / self.weights.get(tenant, 1.0)
+                self._last_finish[tenant] = finish
+                ticket = _Ticket(tenant, False, start, finish, next(self._seq))
+                ticket.granted = True
+                self._in_flight += 1
+                self._tenant_in_flight[tenant] = self._tenant_in_flight.get(tenant, 0) + 1
+
+        if ticket is None:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with self._cond:
+                self._release(ticket)
+
+    def snapshot(self) -> dict:
+        """Queue depth and wait times, for the UI and CLI."""
+        with self._cond:
+            tenants: Dict[str, Dict[str, int]] = {}
+            for tenant, count in self._tenant_in_flight.items():
+                tenants.setdefault(tenant, {"in_flight": 0, "queued": 0})["in_flight"] = count
+            for ticket in self._waiting:
+                tenants.setdefault(ticket.tenant, {"in_flight": 0, "queued": 0})["queued"] += 1
+            waits = [seconds for _, seconds in self._waits]
+            interactive_waits = [seconds for interactive, seconds in self._waits if interactive]
+            return {
+                "capacity": self.capacity,
+                "in_flight": self._in_flight,
+                "queued": len(self._waiting),
+                "queued_interactive": sum(1 for ticket in self._waiting if ticket.interactive),
+                "tenants": tenants,
+                "wait_p50": percentile(waits, 0.5),
+                "wait_p95": percentile(waits, 0.95),
+                "interactive_wait_p95": percentile(interactive_waits, 0.95),
+            }
+
+
+_schedulers: Dict[str, FairScheduler] = {
+    name: FairScheduler(name, PROVIDER_CAPACITY[name], TENANT_QUOTA[name], _parse_weights(TENANT_WEIGHTS))
+    for name in PROVIDER_CAPACITY
+}
+
+
+def get_scheduler(name: str) -> FairScheduler:
+    """Returns the process-wide scheduler for a provider ("fal" or "creatomate")."""
+    return _schedulers[name]
+
+
+def scheduler_states() -> Dict[str, dict]:
+    """Returns a snapshot of every provider queue, for the UI and CLI."""
+    return {name: scheduler.snapshot() for name, scheduler in _schedulers.items()}
+
+
+def format_scheduler_states() -> str:
+    """Formats queue depths as one line per provider."""
+    lines = []
+    for name, snap in scheduler_states().items():
+        line = f"{name}: {snap['in_flight']}/{snap['capacity']} busy, {snap['queued']} queued"
+        if snap["queued_interactive"]:
+            line += f" ({snap['queued_interactive']} interactive)"
+        if snap["wait_p95"] is not None:
+            line += f", p95 wait {snap['wait_p95']:.1f}s"
+        lines.append(line)
+    return "\n".join(lines)
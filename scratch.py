@@ -0,0 +1,249 @@
+"""
+Per-job scratch directories for uploads and enhanced images, reference
+counted and cleaned up by a background janitor in the app process.
+
+Only the app knows which directories its sessions still use, so the
+command line is read-only by default: it reports what is on disk. Live
+reference counts and deletion totals are shown in the app's sidebar.
+
+Usage:
+    python scratch.py            # disk usage of the scratch root
+    python scratch.py --sweep    # also delete old job directories
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from typing import Dict, Optional, List, Set, Tuple
+
+# --- Scratch Storage Configuration ---
+SCRATCH_ROOT = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "video_generator"))
+# Directories nobody holds a reference to are deleted after this many seconds
+SCRATCH_MAX_AGE = int(os.getenv("SCRATCH_MAX_AGE", str(2 * 3600)))
+# Directories still referenced but untouched this long belong to abandoned sessions
+SCRATCH_IDLE_TTL = int(os.getenv("SCRATCH_IDLE_TTL", str(12 * 3600)))
+# Total size the janitor keeps the scratch root under (oldest unreferenced jobs go first)
+SCRATCH_MAX_BYTES = int(os.getenv("SCRATCH_MAX_BYTES", str(2 * 1024 ** 3)))
+SCRATCH_JANITOR_INTERVAL = int(os.getenv("SCRATCH_JANITOR_INTERVAL", "300"))
+
+
+def dir_size(path: str) -> int:
+    """Returns the total size in bytes of all files under `path`."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def last_modified(path: str) -> float:
+    """Returns the newest mtime of `path` or anything directly inside it."""
+    newest = os.path.getmtime(path)
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    newest = max(newest, entry.stat().st_mtime)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return newest
+
+
+class ScratchManager:
+    """
+    Hands out unique per-job scratch directories and cleans them up.
+
+    Each directory is reference counted: it is deleted as soon as its last
+    holder releases it (e.g. when the workflow finishes). A background janitor
+    removes leftovers from crashed or abandoned sessions and keeps the total
+    size under a quota.
+    """
+
+    def __init__(self, root: str = SCRATCH_ROOT, max_age: int = SCRATCH_MAX_AGE,
+                 idle_ttl: int = SCRATCH_IDLE_TTL, max_bytes: int = SCRATCH_MAX_BYTES):
+        self.root = root
+        self.max_age = max_age
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._refs: Dict[str, int] = {}
+        self._owners: Dict[str, Set[str]] = {}  # owner (e.g. workflow thread) -> directories it holds
+        self._lock = threading.Lock()
+        self._janitor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.deleted_dirs = 0
+        self.deleted_bytes = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def create_job_dir(self, prefix: str = "job_") -> str:
+        """Creates a new, unique scratch directory holding one reference."""
+        path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        with self._lock:
+            self._refs[path] = 1
+        return path
+
+    def acquire(self, path: str, owner: Optional[str] = None):
+        """
+        Adds a reference to an existing scratch directory. With an `owner`
+        (e.g. a workflow thread), the reference is taken at most once per
+        owner and dropped by `release_owner`.
+        """
+        with self._lock:
+            if owner is not None:
+                held = self._owners.setdefault(owner, set())
+                if path in held:
+                    return
+                held.add(path)
+            self._refs[path] = self._refs.get(path, 0) + 1
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def release(self, path: str):
+        """Drops a reference; the directory is deleted when no references remain."""
+        with self._lock:
+            count = self._refs.get(path, 0) - 1
+            if count > 0:
+                self._refs[path] = count
+                return
+            self._refs.pop(path, None)
+        self._delete(path)
+
+    def release_owner(self, owner: str):
+        """Drops every reference `owner` holds (safe to call more than once)."""
+        with self._lock:
+            paths = self._owners.pop(owner, set())
+        for path in paths:
+            self.release(path)
+
+    def _delete(self, path: str):
+        if not os.path.isdir(path):
+            return
+        size = dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self.deleted_dirs += 1
+            self.deleted_bytes += size
+
+    def _job_dirs(self) -> List[Tuple[str, float, int]]:
+        jobs = []
+        try:
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        jobs.append((entry.path, last_modified(entry.path), dir_size(entry.path)))
+        except OSError:
+            pass
+        return jobs
+
+    def sweep(self) -> int:
+        """
+        Runs one janitor pass. Deletes unreferenced directories older than
+        max_age, referenced ones idle longer than idle_ttl, then the oldest
+        unreferenced directories until the root is under max_bytes.
+        Returns the number of directories deleted.
+        """
+        now = time.time()
+        deleted = 0
+        survivors = []
+        for path, mtime, size in self._job_dirs():
+            with self._lock:
+                referenced = path in self._refs
+            age = now - mtime
+            if (not referenced and age > self.max_age) or age > self.idle_ttl:
+                with self._lock:
+                    self._refs.pop(path, None)
+                self._delete(path)
+                deleted += 1
+            else:
+                survivors.append((path, mtime, size, referenced))
+
+        total = sum(size for _, _, size, _ in survivors)
+        for path, _, size, referenced in sorted(survivors, key=lambda job: job[1]):
+            if total <= self.max_bytes:
+                break
+            if referenced:
+                continue
+            self._delete(path)
+            total -= size
+            deleted += 1
+
+        if deleted:
+            print(f"Scratch janitor removed {deleted} director{'y' if deleted == 1 else 'ies'}.")
+        return deleted
+
+    def stats(self) -> Dict[str, int]:
+        """Returns scratch storage metrics."""
+        jobs = self._job_dirs()
+        with self._lock:
+            return {
+                "directories": len(jobs),
+                "referenced": len(self._refs),
+                "bytes_held": sum(size for _, _, size in jobs),
+                "deleted_dirs": self.deleted_dirs,
+                "deleted_bytes": self.deleted_bytes,
+            }
+
+    def start_janitor(self, interval: int = SCRATCH_JANITOR_INTERVAL):
+        """Starts the background janitor thread (once)."""
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,),
+                                             name="scratch-janitor", daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+
+    def _janitor_loop(self, interval: int):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Scratch janitor error: {e}")
+
+
+_manager: Optional[ScratchManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_scratch_manager() -> ScratchManager:
+    """Returns the process-wide scratch manager, starting its janitor on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = ScratchManager()
+            _manager.start_janitor()
+        return _manager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sweep", action="store_true",
+                        help="Delete job directories older than SCRATCH_MAX_AGE (including ones live sessions use)")
+    args = parser.parse_args()
+
+    manager = ScratchManager()
+    print(f"Scratch root: {manager.root}")
+    if args.sweep:
+        print("Warning: this process can't see which directories running app sessions hold - "
+              f"any job idle longer than {manager.max_age}s is deleted, even if a session still needs it.")
+        manager.sweep()
+    stats = manager.stats()
+    print(f"  directories: {stats['directories']}")
+    print(f"  bytes_held: {stats['bytes_held']}")
+    if args.sweep:
+        print(f"  deleted_dirs: {stats['deleted_dirs']}")
+        print(f"  deleted_bytes: {stats['deleted_bytes']}")
+
+
+if __name__ == "__main__":
+    main()
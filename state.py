@@ -1,19 +1,54 @@
-from typing import List, Dict, Any, Optional
+from typing import Annotated, List, Dict, Any, Optional
 from pydantic import BaseModel
 
+
+def merge_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """Reducer that merges per-branch dict updates (e.g. one processed URL per photo branch)."""
+    return {**(left or {}), **(right or {})}
+
+
+class PhotoTask(BaseModel):
+    """Input for a single photo-enhancement branch of the graph."""
+    placeholder: str
+    file_path: str
+    mode: str = "auto"
+    photo_hash: Optional[str] = None   # perceptual hash, for reusing earlier results
+    aliases: List[str] = []            # other placeholders showing the same photo
+    aspect_ratio: Optional[str] = None  # the primary template's, photos are framed for (None: 9:16)
+
+
 class GraphState(BaseModel):
     """
     Represents the state of our graph using Pydantic for validation.
 
     Attributes:
-        template_id: The ID of the Creatomate template.
+        template_id: The ID of the primary Creatomate template.
+        template_ids: Extra templates (formats) to render from the same approved images.
         input_images: A dictionary mapping template placeholders to local file paths.
+        scratch_dir: Scratch directory holding the input files (see scratch.py); the
+                     workflow keeps it alive until it finishes or is cancelled.
+        enhancement_mode: How photos are enhanced: "auto" (AI model, local fallback),
+                          "model" (AI model only) or "local" (Pillow/NumPy only).
+        image_enhancement_modes: Per-placeholder overrides of enhancement_mode.
+        image_quality: Local pre-screen metrics per placeholder (resolution, sharpness,
+                       exposure) with a verdict: "skip", "enhance" or "warn".
         processed_image_urls: A dictionary mapping placeholders to the new URLs
-                              after processing and uploading.
+                              after processing and uploading (merged across branches).
         modifications: The final JSON payload for the Creatomate API.
+        payload_errors: Template validation errors found before submitting the render.
         render_id: The ID of the video render job.
         render_status: The status of the video render (planned, rendering, succeeded, failed).
-        final_video_url: The URL of the final rendered video.
+        final_video_url: The URL of the final rendered video (primary template).
+        render_ids: Render ID per template.
+        render_statuses: Render status per template.
+        final_video_urls: Final video URL per template.
+        force_rerender: Start a new render even if an identical payload was already rendered.
+        render_backend: Where videos are rendered: "creatomate", "local" (ffmpeg slideshow)
+                        or "auto" (Creatomate, falling back to local).
+        draft_preview: Render a low-resolution draft for confirmation before the full render.
+        draft_render_id: The ID of the draft preview render.
+        draft_status: The status of the draft preview render.
+        draft_video_url: The URL of the draft preview video.
         
         # Template-specific fields
         address: Property address
@@ -32,14 +67,31 @@ class GraphState(BaseModel):
         replacement_images: Dict mapping placeholder to new uploaded image path
         human_approval_received: Whether human has provided approval decision.
         regeneration_count: Number of times images have been regenerated.
+        awaiting_draft_approval: Whether the workflow is waiting for the draft to be confirmed.
+        draft_approved: Whether the user confirmed the draft (queues the full render).
     """
     template_id: str
+    template_ids: List[str] = []
     input_images: Dict[str, str]
-    processed_image_urls: Dict[str, str] = {}
+    scratch_dir: Optional[str] = None
+    enhancement_mode: str = "auto"
+    image_enhancement_modes: Dict[str, str] = {}
+    image_quality: Annotated[Dict[str, Dict[str, Any]], merge_dicts] = {}
+    processed_image_urls: Annotated[Dict[str, str], merge_dicts] = {}
     modifications: Dict[str, Any] = {}
+    payload_errors: List[str] = []
     render_id: Optional[str] = None
     render_status: Optional[str] = None
     final_video_url: Optional[str] = None
+    render_ids: Dict[str, str] = {}
+    render_statuses: Dict[str, str] = {}
+    final_video_urls: Dict[str, str] = {}
+    force_rerender: bool = False
+    render_backend: str = "creatomate"
+    draft_preview: bool = False
+    draft_render_id: Optional[str] = None
+    draft_status: Optional[str] = None
+    draft_video_url: Optional[str] = None
     
     # Template fields
     address: str = "Los Angeles,\nCA 90045"
@@ -59,3 +111,5 @@ class GraphState(BaseModel):
     replacement_images: Dict[str, str] = {}
     human_approval_received: bool = False
     regeneration_count: int = 0
+    awaiting_draft_approval: bool = False
+    draft_approved: bool = False
@@ -1,19 +1,26 @@
 import streamlit as st
 import os
 import random
-from datetime import datetime
-from main import VideoGenerationWorkflow
-from state import GraphState
-from langgraph.checkpoint.memory import MemorySaver
-from PIL import Image
+from templates import MUSIC_TEMPLATES, FORMAT_TEMPLATES
+from scratch import get_scratch_manager
+from circuit_breaker import breaker_states
 import time
 
-# Music template configuration
-MUSIC_TEMPLATES = {
-    "Music 1": "6821de4e-c173-4a8f-9c8e-d8f0e3c292ed",
-    "Music 2": "fc3f9447-8030-4e94-8f28-47afa34b6935",
-    "Music 3": "6d269058-d3ae-49e7-9d9e-5d94e634a736",
-    "Music 4": "6b162577-7a21-4318-9e13-fa9ccae66a95"
+# langgraph, fal_client and the workflow nodes are imported lazily (see
+# load_workflow_graph) so the login page renders without paying for them.
+
+# Video render backends, as shown in the UI -> GraphState.render_backend
+RENDER_BACKENDS = {
+    "Creatomate": "creatomate",
+    "Creatomate (local fallback)": "auto",
+    "Local (offline slideshow)": "local",
+}
+
+# Photo enhancement engines, as shown in the UI -> GraphState.enhancement_mode
+ENHANCEMENT_MODES = {
+    "Auto (AI, local fallback)": "auto",
+    "AI model": "model",
+    "Local": "local",
 }
 
 def get_template_id(selected_music):
@@ -25,6 +32,137 @@ def get_template_id(selected_music):
     else:
         return MUSIC_TEMPLATES[selected_music], selected_music
 
+@st.cache_resource(show_spinner="Loading workflow...")
+def load_workflow_graph():
+    """
+    Builds and compiles the LangGraph workflow once per server process.
+    The graph's checkpointer is shared by all sessions; runs are isolated by thread_id.
+    """
+    from main import VideoGenerationWorkflow
+    return VideoGenerationWorkflow().compile()
+
+def release_session_dir():
+    """Releases the session's scratch directory so its files can be deleted."""
+    if st.session_state.get('session_dir'):
+        get_scratch_manager().release(st.session_state.session_dir)
+        st.session_state.session_dir = None
+
+def release_session_thread():
+    """Cancels the session's in-flight workflow work and removes its checkpoints."""
+    if st.session_state.get('app_graph') is not None and st.session_state.get('thread_id'):
+        from main import release_thread
+        release_thread(st.session_state.app_graph, st.session_state.thread_id)
+
+def session_config() -> dict:
+    """
+    Run config for the session's workflow thread, scheduled under the
+    session's tenant. Stops the page if another app process on this host
+    owns the thread.
+    """
+    from main import workflow_config, claim_thread
+    if not claim_thread(st.session_state.thread_id):
+        st.error("This workflow is running in another app process. Please try again in a minute.")
+        st.stop()
+    return workflow_config(st.session_state.thread_id, st.session_state.get('tenant'))
+
+def step_name(event) -> str:
+    """Name of the node a streamed workflow step came from."""
+    return list(event.keys())[0] if event else "unknown"
+
+def show_progress(board):
+    """Renders the live status of every photo and render of the session's workflow."""
+    from progress import get_progress_bus, describe, provider_queue_seconds
+    items = get_progress_bus().snapshot(st.session_state.thread_id)
+    if not items:
+        return
+    rows = ["| | Status | Time |", "|---|---|---|"]
+    for item, event in sorted(items.items()):
+        queued = provider_queue_seconds(event)
+        time_text = f"{event['elapsed']:.0f}s" + (f" ({queued:.0f}s in provider queue)" if queued else "")
+        rows.append(f"| {item} | {describe(event).replace('|', '/')} | {time_text} |")
+    board.markdown("\n".join(rows))
+
+def follow_run(run, on_step=None) -> int:
+    """
+    Shows a workflow run's steps and live progress until it pauses or ends.
+    Returns the number of steps and re-raises the workflow's error.
+    """
+    import queue
+    board = st.empty()
+    count = 0
+    while True:
+        try:
+            step = run["steps"].get(timeout=0.5)
+        except queue.Empty:
+            show_progress(board)
+            continue
+        if step is run["finished"]:
+            break
+        # The run is over - a rerun from here on has nothing to reattach to
+        if isinstance(step, BaseException):
+            st.session_state.workflow_run = None
+            raise step
+        count += 1
+        if on_step:
+            on_step(count, step)
+        show_progress(board)
+    st.session_state.workflow_run = None
+    show_progress(board)
+    return count
+
+def stream_workflow(graph_input, config, on_step=None) -> int:
+    """
+    Runs the session's workflow until it pauses or ends, like
+    graph.stream(), while showing live per-photo and render progress.
+    The graph runs in a worker thread so this script can redraw the
+    progress table; `on_step(count, event)` is called for each step.
+    Returns the number of steps and re-raises the workflow's error.
+
+    A rerun (any widget interaction, a reloaded tab) stops this script but
+    not the run: it keeps going in the background and the next script run
+    reattaches to it (see reattach_workflow). Only Logout and "Create
+    Another Video" cancel it, through release_session_thread.
+    """
+    import queue
+    import threading
+    from leases import get_lease_manager, resource_name, THREAD
+    graph = st.session_state.app_graph
+    # Keep this process's claim on the thread alive for as long as the run takes
+    lease = resource_name(THREAD, config["configurable"]["thread_id"])
+    run = {"steps": queue.Queue(), "finished": object()}
+
+    def work():
+        try:
+            with get_lease_manager().hold(lease):
+                for event in graph.stream(graph_input, config):
+                    run["steps"].put(event)
+            run["steps"].put(run["finished"])
+        except BaseException as e:
+            run["steps"].put(e)
+
+    st.session_state.workflow_run = run
+    threading.Thread(target=work, name="workflow-stream", daemon=True).start()
+    return follow_run(run, on_step)
+
+def reattach_workflow():
+    """
+    Waits for a run a rerun left going in the background, then picks up
+    the state it got to.
+    """
+    run = st.session_state.get('workflow_run')
+    if run is None:
+        return
+    with st.spinner("Still working on your last step..."):
+        try:
+            follow_run(run)
+        except Exception as e:
+            st.error(f"Error during workflow: {e}")
+    state = st.session_state.app_graph.get_state(session_config())
+    if state.values:
+        st.session_state.current_state = state.values
+        st.session_state.workflow_started = True
+    st.rerun()
+
 # Page config MUST be first Streamlit command
 st.set_page_config(
     page_title="Real Estate Video Generator",
@@ -172,8 +310,6 @@ st.markdown("""
 # Initialize session state
 if 'workflow_started' not in st.session_state:
     st.session_state.workflow_started = False
-if 'checkpointer' not in st.session_state:
-    st.session_state.checkpointer = MemorySaver()
 if 'thread_id' not in st.session_state:
     st.session_state.thread_id = None
 if 'app_graph' not in st.session_state:
@@ -181,12 +317,11 @@ if 'app_graph' not in st.session_state:
 if 'current_state' not in st.session_state:
     st.session_state.current_state = None
 if 'session_dir' not in st.session_state:
-    import tempfile
-    # Use system temp directory for cloud compatibility
-    session_id = datetime.now().strftime('%Y%m%d_%H%M%S')
-    base_temp = tempfile.gettempdir()
-    st.session_state.session_dir = os.path.join(base_temp, f"video_generator_{session_id}")
-    os.makedirs(st.session_state.session_dir, exist_ok=True)
+    st.session_state.session_dir = None  # Unique scratch dir, created when a job starts
+if 'upload_hashes' not in st.session_state:
+    st.session_state.upload_hashes = {}  # uploaded file id -> perceptual hash
+if 'workflow_run' not in st.session_state:
+    st.session_state.workflow_run = None  # run still going after a rerun (see stream_workflow)
 
 # Header with logout
 col1, col2 = st.columns([4, 1])
@@ -197,6 +332,9 @@ with col2:
     st.write("")  # Spacing
     st.write("")  # Spacing
     if st.button("🚪 Logout", type="secondary", use_container_width=True):
+        # Free this session's checkpoints in the shared graph and its scratch files
+        release_session_thread()
+        release_session_dir()
         # Clear authentication and reset session
         st.session_state.password_correct = False
         # Clear all session state to start fresh
@@ -204,6 +342,9 @@ with col2:
             del st.session_state[key]
         st.rerun()
 
+# A step the last rerun interrupted is still running - finish following it first
+reattach_workflow()
+
 # Progress bar
 progress_value = 0
 if st.session_state.workflow_started:
@@ -228,7 +369,7 @@ with st.sidebar:
     
     # Music selection dropdown
     st.subheader("🎵 Background Music")
-    music_options = ["Random", "Music 1", "Music 2", "Music 3", "Music 4"]
+    music_options = ["Random"] + list(MUSIC_TEMPLATES.keys())
     selected_music = st.selectbox(
         "Select Music Style",
         options=music_options,
@@ -236,6 +377,43 @@ with st.sidebar:
         help="Choose a specific music track or let the system pick randomly"
     )
     
+    extra_formats = st.multiselect(
+        "Also Render With",
+        options=list(MUSIC_TEMPLATES.keys()) + list(FORMAT_TEMPLATES.keys()),
+        default=[],
+        help="Render additional videos from the same approved images - each template "
+             "fits them to its own frame (square, landscape)."
+    )
+    
+    force_rerender = st.checkbox(
+        "Force new render",
+        value=False,
+        help="Render again even if an identical video was already created"
+    )
+    
+    default_backend = os.getenv("RENDER_BACKEND", "creatomate")
+    render_label = st.selectbox(
+        "Renderer",
+        options=list(RENDER_BACKENDS.keys()),
+        index=list(RENDER_BACKENDS.values()).index(default_backend) if default_backend in RENDER_BACKENDS.values() else 0,
+        help="The local renderer makes a simple slideshow on this machine - no music, but no render queue"
+    )
+    render_backend = RENDER_BACKENDS[render_label]
+    
+    draft_preview = st.checkbox(
+        "Draft preview first",
+        value=False,
+        help="Render a quick low-resolution preview to check the text before the full video is rendered"
+    )
+    
+    enhancement_label = st.selectbox(
+        "Photo Enhancement",
+        options=list(ENHANCEMENT_MODES.keys()),
+        index=0,
+        help="Local enhancement runs on this machine (levels, white balance, sharpening, 9:16 crop) - fast and free"
+    )
+    enhancement_mode = ENHANCEMENT_MODES[enhancement_label]
+    
     st.divider()
     
     address = st.text_area(
@@ -275,8 +453,35 @@ with st.sidebar:
     if agent_picture:
         st.success("✓ Picture uploaded!")
         # Show preview
-        agent_img = Image.open(agent_picture)
-        st.image(agent_img, caption="Agent Picture Preview", width=200)
+        st.image(agent_picture, caption="Agent Picture Preview", width=200)
+    
+    st.divider()
+    
+    # Provider health - open circuits mean requests fail fast instead of hanging
+    st.header("🩺 Service Status")
+    for provider, snapshot in breaker_states().items():
+        if snapshot['state'] == 'open':
+            st.error(f"{provider}: unavailable (retry in {snapshot['retry_in']:.0f}s)")
+        elif snapshot['state'] == 'half_open':
+            st.warning(f"{provider}: recovering")
+        else:
+            st.caption(f"✓ {provider}: OK")
+
+    from scheduler import scheduler_states
+    for provider, snapshot in scheduler_states().items():
+        if snapshot['queued']:
+            st.caption(f"⏳ {provider}: {snapshot['queued']} request(s) queued, "
+                       f"{snapshot['in_flight']}/{snapshot['capacity']} running")
+
+    from leases import get_lease_manager
+    instances = get_lease_manager().snapshot()['instances']
+    if len(instances) > 1:
+        st.caption(f"🖥️ {len(instances)} app processes sharing the work")
+
+    scratch = get_scratch_manager().stats()
+    st.caption(f"🗂️ Scratch: {scratch['directories']} job folder(s), "
+               f"{scratch['bytes_held'] / 1024 ** 2:.1f} MB, {scratch['referenced']} in use; "
+               f"cleaned up {scratch['deleted_dirs']} ({scratch['deleted_bytes'] / 1024 ** 2:.1f} MB)")
 
 # Main content area
 st.header("📸 Step 1: Upload Property Images")
@@ -301,13 +506,35 @@ if uploaded_files:
     else:
         st.error(f"Too many images! Please upload only 5 (you have {len(uploaded_files)})")
     
+    # Flag near-identical shots (e.g. the same photo resent under another name)
+    from photo_index import phash, find_duplicates
+    photo_hashes = {}
+    for idx, uploaded_file in enumerate(uploaded_files[:5]):
+        # Hashed once per upload, not on every rerun of the script
+        if uploaded_file.file_id not in st.session_state.upload_hashes:
+            try:
+                st.session_state.upload_hashes[uploaded_file.file_id] = phash(uploaded_file)
+            except Exception:
+                st.session_state.upload_hashes[uploaded_file.file_id] = None  # reported when processed
+            uploaded_file.seek(0)
+        if st.session_state.upload_hashes[uploaded_file.file_id]:
+            photo_hashes[f"Photo-{idx+1}"] = st.session_state.upload_hashes[uploaded_file.file_id]
+    for group in find_duplicates(photo_hashes):
+        st.warning(f"⚠️ {', '.join(group)} look like the same shot - consider replacing one of them")
+    
     # Show image previews in a grid
     cols = st.columns(5)
     for idx, uploaded_file in enumerate(uploaded_files[:5]):
         with cols[idx]:
-            img = Image.open(uploaded_file)
-            st.image(img, caption=f"Photo-{idx+1}", use_column_width=True)
+            st.image(uploaded_file, caption=f"Photo-{idx+1}", use_column_width=True)
             st.markdown(f"**{uploaded_file.name}**")
+            st.selectbox(
+                "Enhancement",
+                options=list(ENHANCEMENT_MODES.keys()),
+                index=list(ENHANCEMENT_MODES.values()).index(enhancement_mode),
+                key=f"enhance_mode_{idx}",
+                label_visibility="collapsed"
+            )
 
 # Start processing button
 st.divider()
@@ -315,8 +542,12 @@ st.divider()
 if len(uploaded_files) == 5 and not st.session_state.workflow_started:
     if st.button("🚀 Start AI Processing", type="primary", use_container_width=True):
         with st.spinner("Saving images and starting workflow..."):
-            # Ensure session directory exists
-            os.makedirs(st.session_state.session_dir, exist_ok=True)
+            from state import GraphState
+            from main import new_thread_id
+            
+            # Fresh scratch directory for this job (the workflow holds it until it finishes)
+            release_session_dir()
+            st.session_state.session_dir = get_scratch_manager().create_job_dir()
             
             # Save property images
             input_images = {}
@@ -326,6 +557,13 @@ if len(uploaded_files) == 5 and not st.session_state.workflow_started:
                     f.write(uploaded_file.getbuffer())
                 input_images[f"Photo-{idx}"] = filepath
             
+            # Per-photo overrides of the global enhancement mode
+            image_enhancement_modes = {}
+            for idx in range(5):
+                label = st.session_state.get(f"enhance_mode_{idx}")
+                if label and ENHANCEMENT_MODES[label] != enhancement_mode:
+                    image_enhancement_modes[f"Photo-{idx+1}"] = ENHANCEMENT_MODES[label]
+            
             # Save agent picture
             agent_picture_path = None
             if agent_picture:
@@ -344,7 +582,9 @@ if len(uploaded_files) == 5 and not st.session_state.workflow_started:
             # Create initial state
             initial_state = GraphState(
                 template_id=template_id,
+                template_ids=[{**MUSIC_TEMPLATES, **FORMAT_TEMPLATES}[name] for name in extra_formats],
                 input_images=input_images,
+                scratch_dir=st.session_state.session_dir,
                 address=address,
                 details_1=details_1,
                 details_2=details_2,
@@ -352,24 +592,27 @@ if len(uploaded_files) == 5 and not st.session_state.workflow_started:
                 agent_name=agent_name,
                 brand_name=brand_name,
                 email=email,
-                phone_number=phone
+                phone_number=phone,
+                force_rerender=force_rerender,
+                draft_preview=draft_preview,
+                render_backend=render_backend,
+                enhancement_mode=enhancement_mode,
+                image_enhancement_modes=image_enhancement_modes
             )
             
             # Create workflow
-            st.session_state.thread_id = f"thread_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            workflow = VideoGenerationWorkflow(checkpointer=st.session_state.checkpointer)
-            st.session_state.app_graph = workflow.compile()
+            st.session_state.thread_id = new_thread_id()
+            st.session_state.app_graph = load_workflow_graph()
+            # Provider capacity is shared fairly between agents, not between browser sessions
+            st.session_state.tenant = (email or agent_name or brand_name or "").strip().lower() or None
             
             # Start workflow (will pause at wait_approval)
-            config = {"configurable": {"thread_id": st.session_state.thread_id}}
+            config = session_config()
             
             try:
                 # Start workflow - it will pause at wait_approval
-                event_count = 0
-                for event in st.session_state.app_graph.stream(initial_state.model_dump(), config):
-                    event_count += 1
-                    node_name = list(event.keys())[0] if event else "unknown"
-                    st.write(f"✓ Step {event_count}: {node_name}")
+                event_count = stream_workflow(initial_state.model_dump(), config,
+                                              lambda count, event: st.write(f"✓ Step {count}: {step_name(event)}"))
                 
                 st.write(f"Processed {event_count} workflow steps")
                 
@@ -400,6 +643,12 @@ if st.session_state.workflow_started and st.session_state.current_state:
         
         processed_urls = current_state['processed_image_urls']
         
+        # Template problems found while the photos were processing
+        if current_state.get('payload_errors'):
+            st.warning("⚠️ Some property details don't match the selected template:")
+            for error in current_state['payload_errors']:
+                st.markdown(f"- {error}")
+        
         # Create approval interface
         approved_images = []
         rejected_images = []
@@ -410,6 +659,16 @@ if st.session_state.workflow_started and st.session_state.current_state:
             with cols[idx % 5]:
                 st.image(url, caption=placeholder, use_column_width=True)
                 
+                # Local pre-screen results for the original photo
+                quality = current_state.get('image_quality', {}).get(placeholder)
+                if quality:
+                    from image_quality import format_quality
+                    st.caption(format_quality(quality))
+                    if quality['verdict'] == 'skip':
+                        st.caption("✓ Already good - used as uploaded")
+                    for issue in quality['issues']:
+                        st.warning(issue)
+                
                 approve = st.checkbox(f"✓ Approve {placeholder}", value=True, key=f"approve_{placeholder}")
                 
                 if not approve:
@@ -442,7 +701,7 @@ if st.session_state.workflow_started and st.session_state.current_state:
                     st.error(f"⚠️ Please approve all images or regenerate the {len(rejected_images)} rejected image(s)")
                 else:
                     with st.spinner("Creating video..."):
-                        config = {"configurable": {"thread_id": st.session_state.thread_id}}
+                        config = session_config()
                         
                         # Update state
                         update = {
@@ -462,11 +721,9 @@ if st.session_state.workflow_started and st.session_state.current_state:
                         # Resume workflow - continue until completion
                         try:
                             st.write("Resuming workflow...")
-                            event_count = 0
-                            for event in st.session_state.app_graph.stream(None, config):
-                                event_count += 1
-                                node_name = list(event.keys())[0] if event else "unknown"
-                                st.write(f"✓ Step {event_count}: {node_name}")
+                            event_count = stream_workflow(
+                                None, config, lambda count, event: st.write(f"✓ Step {count}: {step_name(event)}")
+                            )
                             
                             st.write(f"Completed {event_count} workflow steps")
                         except Exception as e:
@@ -482,13 +739,16 @@ if st.session_state.workflow_started and st.session_state.current_state:
                         st.write(f"Final state - render_status: {state.values.get('render_status')}")
                         st.write(f"Final state - final_video_url: {state.values.get('final_video_url')}")
                         
-                        st.success("✓ Video creation started!")
+                        if state.values.get('awaiting_draft_approval'):
+                            st.success("✓ Draft preview ready!")
+                        else:
+                            st.success("✓ Video creation started!")
                         st.rerun()
         
         with col2:
             if rejected_images and st.button("↻ Regenerate Rejected Images", use_container_width=True):
                 with st.spinner(f"Regenerating {len(rejected_images)} image(s)..."):
-                    config = {"configurable": {"thread_id": st.session_state.thread_id}}
+                    config = session_config()
                     
                     # Update state
                     update = {
@@ -500,8 +760,7 @@ if st.session_state.workflow_started and st.session_state.current_state:
                     st.session_state.app_graph.update_state(config, update)
                     
                     # Resume workflow
-                    for event in st.session_state.app_graph.stream(None, config):
-                        st.write(f"Processing: {list(event.keys())}")
+                    stream_workflow(None, config, lambda count, event: st.write(f"Processing: {list(event.keys())}"))
                     
                     # Update state
                     state = st.session_state.app_graph.get_state(config)
@@ -510,6 +769,72 @@ if st.session_state.workflow_started and st.session_state.current_state:
                     st.success("✓ Images regenerated! Please review again.")
                     st.rerun()
     
+    # Show the draft preview for confirmation before the full render
+    if current_state.get('awaiting_draft_approval') and not current_state.get('draft_approved'):
+        st.header("🎞️ Step 3: Check the Draft Preview")
+        
+        if current_state.get('draft_video_url'):
+            st.video(current_state['draft_video_url'])
+            st.caption("Low-resolution preview - the final video is rendered in full quality.")
+        else:
+            st.warning(f"⚠️ The draft preview could not be rendered (status: {current_state.get('draft_status')}). "
+                       "You can still render the full video.")
+        
+        st.markdown("Spotted a typo? Correct it here and update the draft:")
+        corrected = {
+            "address": st.text_area("Property Address", value=current_state.get('address', ''),
+                                    height=80, key="draft_address"),
+            "details_1": st.text_input("Property Details (Line 1)", value=current_state.get('details_1', ''),
+                                       key="draft_details_1"),
+            "details_2": st.text_input("Property Details (Line 2)", value=current_state.get('details_2', ''),
+                                       key="draft_details_2"),
+            "agent_name": st.text_input("Agent Name", value=current_state.get('agent_name', ''),
+                                        key="draft_agent_name"),
+            "brand_name": st.text_input("Brand/Company Name", value=current_state.get('brand_name', ''),
+                                        key="draft_brand_name"),
+            "email": st.text_input("Contact Email", value=current_state.get('email', ''), key="draft_email"),
+            "phone_number": st.text_input("Contact Phone", value=current_state.get('phone_number', ''),
+                                          key="draft_phone_number"),
+        }
+        changed = {field: value for field, value in corrected.items() if value != current_state.get(field)}
+        
+        col1, col2 = st.columns(2)
+        config = session_config()
+        
+        with col1:
+            if st.button("✅ Looks Good - Render Full Video", type="primary", use_container_width=True,
+                         disabled=bool(changed)):
+                with st.spinner("Creating video..."):
+                    st.session_state.app_graph.update_state(config, {
+                        "draft_approved": True,
+                        "awaiting_draft_approval": False
+                    })
+                    try:
+                        stream_workflow(None, config, lambda count, event: st.write(f"✓ {step_name(event)}"))
+                    except Exception as e:
+                        st.error(f"Error during workflow: {e}")
+                    state = st.session_state.app_graph.get_state(config)
+                    st.session_state.current_state = state.values
+                    st.rerun()
+        
+        with col2:
+            if st.button("✏️ Update Draft", use_container_width=True, disabled=not changed):
+                with st.spinner("Rendering new draft..."):
+                    st.session_state.app_graph.update_state(config, {
+                        **changed,
+                        "awaiting_draft_approval": False,
+                        "draft_render_id": None,
+                        "draft_status": None,
+                        "draft_video_url": None
+                    })
+                    try:
+                        stream_workflow(None, config, lambda count, event: st.write(f"✓ {step_name(event)}"))
+                    except Exception as e:
+                        st.error(f"Error during workflow: {e}")
+                    state = st.session_state.app_graph.get_state(config)
+                    st.session_state.current_state = state.values
+                    st.rerun()
+    
     # Show video status
     if current_state.get('render_id') and not current_state.get('final_video_url'):
         st.header("🎬 Step 3: Video Generation")
@@ -519,6 +844,11 @@ if st.session_state.workflow_started and st.session_state.current_state:
         if render_status == 'rendering' or render_status == 'planned':
             st.info(f"⏳ Your video is being created... Status: {render_status}")
             
+            render_statuses = current_state.get('render_statuses', {})
+            if len(render_statuses) > 1:
+                for template_id, status in render_statuses.items():
+                    st.markdown(f"- `{template_id}`: {status}")
+            
             # Auto-refresh every 3 seconds
             status_placeholder = st.empty()
             with status_placeholder:
@@ -526,12 +856,11 @@ if st.session_state.workflow_started and st.session_state.current_state:
                     time.sleep(3)
             
             # Poll for status
-            config = {"configurable": {"thread_id": st.session_state.thread_id}}
+            config = session_config()
             
             # Resume to check status
             try:
-                for event in st.session_state.app_graph.stream(None, config):
-                    st.write(f"Status check: {list(event.keys())}")
+                stream_workflow(None, config, lambda count, event: st.write(f"Status check: {list(event.keys())}"))
             except Exception as e:
                 st.error(f"Error checking status: {e}")
             
@@ -541,27 +870,58 @@ if st.session_state.workflow_started and st.session_state.current_state:
             
             st.rerun()
         elif render_status == 'failed':
+            release_session_dir()
             st.error("❌ Video rendering failed. Please try again.")
+        elif render_status == 'cancelled':
+            release_session_dir()
+            st.warning("⚠️ Video rendering was cancelled. Please start again.")
         else:
             st.warning(f"⚠️ Unknown status: {render_status}")
     
+    # Show payload problems caught before the render was submitted
+    if current_state.get('payload_errors') and current_state.get('render_status') == 'error' and not current_state.get('render_id'):
+        st.header("🎬 Step 3: Video Generation")
+        st.error("❌ The video payload does not match the selected template:")
+        for error in current_state['payload_errors']:
+            st.markdown(f"- {error}")
+    
     # Show final video
     if current_state.get('final_video_url'):
         st.header("🎉 Step 4: Video Complete!")
         st.balloons()
         
+        # Local copies of the images aren't needed once the video exists
+        release_session_dir()
+        
         video_url = current_state['final_video_url']
         
         st.success("✅ Your video has been generated successfully!")
         
-        # Display video
-        st.video(video_url)
-        
-        # Download button
-        st.markdown(f"### [⬇️ Download Video]({video_url})")
+        # Display video(s) - one per rendered template
+        final_video_urls = current_state.get('final_video_urls') or {current_state['template_id']: video_url}
+        template_names = {template_id: name for name, template_id in {**MUSIC_TEMPLATES, **FORMAT_TEMPLATES}.items()}
+        for template_id, url in final_video_urls.items():
+            if len(final_video_urls) > 1:
+                st.subheader(template_names.get(template_id, template_id))
+            if not url.startswith(("http://", "https://")) and not os.path.exists(url):
+                # Local renders are deleted when the finished workflow is pruned
+                st.warning("This locally rendered video has been cleaned up - please render it again.")
+                continue
+            st.video(url)
+            
+            # Download button
+            if url.startswith(("http://", "https://")):
+                st.markdown(f"### [⬇️ Download Video]({url})")
+            elif os.path.exists(url):
+                # Rendered locally - serve the file itself
+                with open(url, 'rb') as f:
+                    st.download_button("⬇️ Download Video", f.read(), file_name=os.path.basename(url),
+                                       mime="video/mp4", key=f"download_{template_id}")
         
         # Create another button
         if st.button("🔄 Create Another Video", use_container_width=True):
+            release_session_thread()
+            release_session_dir()
             # Reset session state
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
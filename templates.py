@@ -0,0 +1,365 @@
+import os
+import json
+import math
+import time
+import tempfile
+import threading
+from typing import Dict, List, Optional, Any, Tuple
+
+# Load environment variables - works for both local (.env) and cloud (already set by streamlit_app.py)
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass  # dotenv not needed in cloud deployment
+
+# --- Template Configuration ---
+# Single source of truth for the Creatomate templates used by the app and CLI.
+MUSIC_TEMPLATES = {
+    "Music 1": "6821de4e-c173-4a8f-9c8e-d8f0e3c292ed",
+    "Music 2": "fc3f9447-8030-4e94-8f28-47afa34b6935",
+    "Music 3": "6d269058-d3ae-49e7-9d9e-5d94e634a736",
+    "Music 4": "6b162577-7a21-4318-9e13-fa9ccae66a95"
+}
+
+DEFAULT_TEMPLATE_ID = MUSIC_TEMPLATES["Music 1"]  # Real Estate Ad with 5 photos
+
+# Other output formats offered next to the 9:16 music variants (only those configured)
+FORMAT_TEMPLATES = {label: template_id for label, template_id in {
+    "Square post (1:1)": os.getenv("SQUARE_TEMPLATE_ID"),
+    "Portrait post (4:5)": os.getenv("PORTRAIT_TEMPLATE_ID"),
+    "Landscape video (16:9)": os.getenv("LANDSCAPE_TEMPLATE_ID"),
+}.items() if template_id}
+
+CREATOMATE_TEMPLATES_URL = "https://api.creatomate.com/v1/templates"
+
+# How long a fetched template definition is trusted before it is fetched again
+TEMPLATE_CACHE_TTL = int(os.getenv("TEMPLATE_CACHE_TTL", "3600"))
+# How long a failed fetch (API down, unknown template) is remembered before trying again
+TEMPLATE_FAILURE_TTL = int(os.getenv("TEMPLATE_FAILURE_TTL", "60"))
+TEMPLATE_CACHE_DIR = os.getenv(
+    "TEMPLATE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "video_generator_templates")
+)
+
+# Element renames for templates whose element names differ from the 9:16 templates, as JSON:
+# {"<template_id>": {"Photo-1": "Image-1", "Address": "Headline", "Details-2": null}}
+# (null: the template deliberately has no such element - left out of its payload)
+TEMPLATE_ELEMENT_MAPS = os.getenv("TEMPLATE_ELEMENT_MAPS", "")
+
+# Aspect ratios the fal.ai model can produce; the 9:16 templates use the last one
+FAL_ASPECT_RATIOS = ["21:9", "16:9", "3:2", "4:3", "5:4", "1:1", "4:5", "3:4", "2:3", "9:16"]
+DEFAULT_ASPECT_RATIO = "9:16"
+
+# Properties that only make sense on certain element types
+TEXT_PROPERTIES = {"text"}
+SOURCE_PROPERTIES = {"source"}
+MEDIA_TYPES = {"image", "video", "audio"}
+
+
+def _parse_element_maps(spec: str) -> Dict[str, Dict[str, str]]:
+    if not spec.strip():
+        return {}
+    try:
+        maps = json.loads(spec)
+    except ValueError as e:
+        print(f"Warning: Ignoring invalid TEMPLATE_ELEMENT_MAPS: {e}")
+        return {}
+    return {template_id: dict(renames) for template_id, renames in maps.items()}
+
+
+def _element_key(name: str) -> str:
+    """Element name compared without case or separators ("Photo-1" == "photo_1" == "Photo 1")."""
+    return "".join(ch for ch in name.lower() if ch.isalnum())
+
+
+def aspect_value(ratio: str) -> float:
+    """Width / height of an aspect ratio like "9:16"."""
+    w, h = ratio.split(":")
+    return int(w) / int(h)
+
+
+def nearest_aspect_ratio(width: Optional[float], height: Optional[float]) -> str:
+    """The fal.ai aspect ratio closest to a width x height output (9:16 if unknown)."""
+    if not width or not height:
+        return DEFAULT_ASPECT_RATIO
+    target = math.log(float(width) / float(height))
+
+    def distance(ratio: str) -> float:
+        return abs(math.log(aspect_value(ratio)) - target)
+    return min(FAL_ASPECT_RATIOS, key=distance)
+
+
+def collect_elements(elements: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Walks a Creatomate element tree (including nested compositions)
+    and returns a mapping of element name to element type.
+    """
+    found = {}
+    for element in elements or []:
+        name = element.get("name")
+        if name:
+            found[name] = element.get("type", "")
+        if element.get("elements"):
+            found.update(collect_elements(element["elements"]))
+    return found
+
+
+class TemplateRegistry:
+    """
+    Fetches Creatomate template definitions and caches them in memory
+    and on disk so payloads can be validated before a render is submitted.
+    """
+
+    def __init__(self, api_key: Optional[str] = None, ttl: int = TEMPLATE_CACHE_TTL,
+                 cache_dir: Optional[str] = TEMPLATE_CACHE_DIR,
+                 element_maps: Optional[Dict[str, Dict[str, str]]] = None,
+                 failure_ttl: int = TEMPLATE_FAILURE_TTL):
+        self.api_key = api_key if api_key is not None else os.getenv("CREATOMATE_API_KEY")
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.cache_dir = cache_dir
+        self.element_maps = element_maps if element_maps is not None else _parse_element_maps(TEMPLATE_ELEMENT_MAPS)
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, threading.Event] = {}  # template_id -> fetch in progress
+        self._failed_at: Dict[str, float] = {}  # template_id -> last failed fetch
+        self._not_found: set = set()  # templates Creatomate answered 404 for
+        self._lock = threading.Lock()
+
+    def _cache_path(self, template_id: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, f"{template_id}.json")
+
+    def _load_from_disk(self, template_id: str) -> Optional[Dict[str, Any]]:
+        path = self._cache_path(template_id)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read cached template {template_id}: {e}")
+            return None
+
+    def _save_to_disk(self, template_id: str, entry: Dict[str, Any]):
+        path = self._cache_path(template_id)
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write template cache for {template_id}: {e}")
+
+    def _fetch(self, template_id: str) -> Dict[str, Any]:
+        import requests
+        from circuit_breaker import get_breaker
+        from ledger import get_ledger
+        from scheduler import get_scheduler
+
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        # Fails fast while Creatomate is down rather than queuing behind the calls in flight
+        with get_scheduler("creatomate").slot(breaker=get_breaker("creatomate")), \
+                get_ledger().track("creatomate", "template", ref=template_id) as call:
+            response = requests.get(f"{CREATOMATE_TEMPLATES_URL}/{template_id}", headers=headers, timeout=15)
+            call.bytes_received = len(response.content)
+            response.raise_for_status()
+        template = response.json()
+        source = template.get("source") or {}
+        return {
+            "template_id": template_id,
+            "name": template.get("name", ""),
+            "elements": collect_elements(source.get("elements", [])),
+            "width": source.get("width"),
+            "height": source.get("height"),
+            "fetched_at": time.time(),
+        }
+
+    def _is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return time.time() - entry.get("fetched_at", 0) < self.ttl
+
+    def get_template(self, template_id: str, refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached definition for a template, fetching it when the
+        cache is missing or older than the TTL. A stale entry is returned
+        if the API cannot be reached; None if nothing is known at all or
+        the template doesn't exist (see not_found). A failed fetch isn't
+        retried for failure_ttl seconds. Only one fetch per template runs
+        at a time, outside the lock, so a slow response doesn't hold up
+        lookups of other templates.
+        """
+        with self._lock:
+            entry = self._cache.get(template_id)
+            if entry is None:
+                entry = self._load_from_disk(template_id)
+                if entry is not None:
+                    self._cache[template_id] = entry
+
+            if entry is not None and self._is_fresh(entry) and not refresh:
+                return entry
+
+            if not self.api_key:
+                if entry is None:
+                    print(f"Warning: CREATOMATE_API_KEY not set. Cannot fetch template {template_id}.")
+                return entry
+
+            failed_at = self._failed_at.get(template_id)
+            if failed_at is not None and time.time() - failed_at < self.failure_ttl and not refresh:
+                return entry
+
+            waiter = self._inflight.get(template_id)
+            if waiter is None:
+                done = threading.Event()
+                self._inflight[template_id] = done
+
+        if waiter is not None:
+            # Another caller is already fetching this template - use its result
+            waiter.wait()
+            with self._lock:
+                return self._cache.get(template_id, entry)
+
+        import requests
+        from circuit_breaker import CircuitOpenError
+
+        try:
+            print(f"Fetching template definition for {template_id}...")
+            fresh = self._fetch(template_id)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                print(f"Warning: Could not fetch template {template_id}: {e}")
+                self._record_failure(template_id)
+                return entry
+            # Mistyped or deleted - a cached definition no longer describes anything
+            print(f"Warning: Template {template_id} not found on Creatomate.")
+            self._record_failure(template_id, not_found=True)
+            return None
+        except (requests.exceptions.RequestException, CircuitOpenError, ValueError) as e:
+            print(f"Warning: Could not fetch template {template_id}: {e}")
+            self._record_failure(template_id)
+            return entry
+        else:
+            with self._lock:
+                self._cache[template_id] = fresh
+                self._failed_at.pop(template_id, None)
+                self._not_found.discard(template_id)
+            self._save_to_disk(template_id, fresh)
+            return fresh
+        finally:
+            with self._lock:
+                self._inflight.pop(template_id, None)
+            done.set()
+
+    def _record_failure(self, template_id: str, not_found: bool = False):
+        with self._lock:
+            self._failed_at[template_id] = time.time()
+            if not_found:
+                self._not_found.add(template_id)
+                self._cache.pop(template_id, None)
+        if not_found:
+            path = self._cache_path(template_id)
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Warning: Could not remove cached template {template_id}: {e}")
+
+    def not_found(self, template_id: str) -> bool:
+        """Whether Creatomate answered the last fetch of this template with 404."""
+        with self._lock:
+            return template_id in self._not_found
+
+    def aspect_ratio(self, template_id: str) -> str:
+        """The fal.ai aspect ratio photos should be enhanced at for this template."""
+        template = self.get_template(template_id) or {}
+        return nearest_aspect_ratio(template.get("width"), template.get("height"))
+
+    def payload_for(self, template_id: str, modifications: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+        """
+        Maps a payload named after the 9:16 templates' elements onto another
+        template: renames from TEMPLATE_ELEMENT_MAPS first, then elements
+        whose names match ignoring case and separators. Returns the payload
+        and the keys the template has no element for. Elements mapped to
+        null are left out without being reported (e.g. a format with fewer
+        photos). Unchanged if the template is unknown.
+        """
+        template = self.get_template(template_id)
+        if template is None:
+            return dict(modifications), []
+        elements = template.get("elements", {})
+        by_key = {_element_key(name): name for name in elements}
+        renames = self.element_maps.get(template_id, {})
+
+        payload, dropped = {}, []
+        for key, value in modifications.items():
+            name, _, prop = key.partition(".")
+            if name in renames and renames[name] is None:
+                continue
+            target = renames.get(name, name)
+            if target not in elements:
+                target = by_key.get(_element_key(target))
+            if target is None:
+                dropped.append(key)
+            else:
+                payload[f"{target}.{prop}" if prop else target] = value
+        return payload, dropped
+
+    def validate_modifications(self, template_id: str, modifications: Dict[str, Any],
+                               public_sources: bool = True) -> List[str]:
+        """
+        Checks every modification key against the template's elements.
+        Returns a list of error messages (empty when the payload is valid).
+        Element checks are skipped when the template definition is unavailable,
+        but a template Creatomate reports as missing is an error.
+        With `public_sources`, sources must be http(s) URLs Creatomate can fetch.
+        """
+        errors = []
+        for key, value in modifications.items():
+            prop = key.partition(".")[2]
+            if prop in SOURCE_PROPERTIES and not value:
+                errors.append(f"'{key}' has an empty source URL")
+            elif (prop in SOURCE_PROPERTIES and public_sources
+                  and not str(value).startswith(("http://", "https://"))):
+                errors.append(f"'{key}' is not a public URL ({value}) - Creatomate can't fetch it")
+
+        template = self.get_template(template_id)
+        if template is None:
+            if self.not_found(template_id):
+                errors.append(f"Template {template_id} not found - check the template ID")
+                return errors
+            print(f"Warning: Template {template_id} unknown - skipping element validation.")
+            return errors
+
+        elements = template.get("elements", {})
+        for key in modifications:
+            name, _, prop = key.partition(".")
+            if name not in elements:
+                errors.append(f"Template has no element named '{name}' (from '{key}')")
+                continue
+
+            element_type = elements[name]
+            if prop in TEXT_PROPERTIES and element_type and element_type != "text":
+                errors.append(f"'{key}' sets text on a {element_type} element")
+            elif prop in SOURCE_PROPERTIES and element_type and element_type not in MEDIA_TYPES:
+                errors.append(f"'{key}' sets a source on a {element_type} element")
+
+        return errors
+
+
+_registry: Optional[TemplateRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_template_registry() -> TemplateRegistry:
+    """Returns the process-wide template registry."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry()
+        return _registry
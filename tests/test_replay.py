@@ -0,0 +1,95 @@
+"""
+Replays the recorded listing (tests/cassettes/listing, recorded with
+bench_replay.py) through the full workflow offline and checks it ends the
+way the recorded run did: same final state, same provider calls and the
+same rows in the call ledger. A second replay at the recorded latencies
+checks the workflow is no slower than the recording.
+"""
+import json
+import os
+import shutil
+import time
+
+import pytest
+
+from bench_replay import BASELINE_FILE, BASELINE_FIELDS, INPUTS_DIR, initial_state, ledger_rows, run_workflow
+from cassettes import Cassette, REPLAY
+
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cassettes", "listing")
+# Recorded latencies (and poll intervals) are multiplied by this in the timed replay
+LATENCY_SCALE = float(os.getenv("REPLAY_LATENCY_SCALE", "1"))
+# Allowed wall-time increase over the recording (0.25 = 25%)
+WALL_TOLERANCE = float(os.getenv("REPLAY_WALL_TOLERANCE", "0.25"))
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    with open(os.path.join(CASSETTE_DIR, BASELINE_FILE), "r") as f:
+        return json.load(f)
+
+
+def replay(tmp_path_factory, latency_scale: float) -> dict:
+    """Replays the cassette with its latencies and poll intervals scaled by `latency_scale`."""
+    import nodes
+    import photo_index
+    import render_cache
+    from main import VideoGenerationWorkflow, new_thread_id
+
+    # The workflow writes next to its input photos (e.g. local enhancement) - use a copy
+    inputs = str(tmp_path_factory.mktemp("inputs"))
+    shutil.copytree(os.path.join(CASSETTE_DIR, INPUTS_DIR), inputs, dirs_exist_ok=True)
+    storage = tmp_path_factory.mktemp("storage")
+
+    graph = VideoGenerationWorkflow().compile()
+    thread_id = new_thread_id()
+    with Cassette(CASSETTE_DIR, mode=REPLAY, latency_scale=latency_scale) as cassette, \
+            pytest.MonkeyPatch.context() as patch:
+        # Fresh caches, so an earlier replay's renders and enhanced photos aren't reused
+        patch.setattr(render_cache, "_cache", render_cache.RenderCache(cache_dir=str(storage / "renders")))
+        patch.setattr(photo_index, "_index", photo_index.PhotoIndex(str(storage / "photos.sqlite3")))
+        polls = cassette.metadata.get("poll_intervals", {})
+        patch.setattr(nodes, "RENDER_POLL_INTERVAL", polls.get("render", nodes.RENDER_POLL_INTERVAL) * latency_scale)
+        patch.setattr(nodes, "DRAFT_POLL_INTERVAL", polls.get("draft", nodes.DRAFT_POLL_INTERVAL) * latency_scale)
+        start = time.perf_counter()
+        final = run_workflow(graph, initial_state(inputs, cassette.metadata["scenario"]), thread_id)
+        wall = time.perf_counter() - start
+    return {"final": final, "cassette": cassette, "thread_id": thread_id, "wall_seconds": wall}
+
+
+@pytest.fixture(scope="module")
+def replayed(tmp_path_factory):
+    # As fast as possible: no recorded latencies, no waits between polls
+    return replay(tmp_path_factory, latency_scale=0)
+
+
+@pytest.fixture(scope="module")
+def timed(tmp_path_factory, replayed):
+    # After the fast replay, so imports and first-use setup aren't timed
+    return replay(tmp_path_factory, latency_scale=LATENCY_SCALE)
+
+
+def test_every_call_was_recorded(replayed):
+    assert replayed["cassette"].misses == []
+
+
+def test_final_state_matches_recording(replayed, baseline):
+    final = replayed["final"]
+    assert final["render_status"] == "succeeded"
+    assert {field: final.get(field) for field in BASELINE_FIELDS} == baseline["final_state"]
+
+
+def test_no_extra_provider_calls(replayed, baseline):
+    calls = dict(replayed["cassette"].calls)
+    for kind in sorted(set(calls) | set(baseline["calls"])):
+        assert calls.get(kind, 0) <= baseline["calls"].get(kind, 0), f"more {kind} calls than recorded"
+
+
+def test_ledger_rows_match_recording(replayed, baseline):
+    assert ledger_rows(replayed["thread_id"]) == baseline["ledger"]
+
+
+def test_no_slower_than_recording(timed, baseline):
+    assert timed["cassette"].misses == []
+    limit = baseline["wall_seconds"] * LATENCY_SCALE * (1 + WALL_TOLERANCE)
+    assert timed["wall_seconds"] <= limit, \
+        f"replay took {timed['wall_seconds']:.2f}s, recording {baseline['wall_seconds']:.2f}s (limit {limit:.2f}s)"
@@ -0,0 +1,46 @@
+"""
+Runs the session benchmark (bench_sessions.py) on a few sessions sharing
+one graph and checks that each session stays small and that releasing the
+threads gives back everything they held.
+"""
+import os
+
+import pytest
+
+from bench_sessions import leftovers, measure, run_shared, seed_template
+
+SESSIONS = 20
+# Memory one session may keep up to the approval step (checkpoints, tokens, scratch bookkeeping)
+MAX_BYTES_PER_SESSION = int(os.getenv("SESSION_MAX_BYTES", "200000"))
+
+
+@pytest.fixture(scope="module")
+def sessions():
+    import nodes
+
+    with pytest.MonkeyPatch.context() as patch:
+        # Photos take the local path; the seeded template keeps Creatomate out of it
+        patch.setattr(nodes, "FAL_KEY", None)
+        seed_template()
+        (graph, threads), held, _, _ = measure(run_shared, SESSIONS)
+    return {"graph": graph, "threads": threads, "held": held}
+
+
+def test_memory_per_session_is_bounded(sessions):
+    per_session = sessions["held"] / SESSIONS
+    assert per_session <= MAX_BYTES_PER_SESSION, \
+        f"{per_session / 1e3:.1f} KB per session (limit {MAX_BYTES_PER_SESSION / 1e3:.1f} KB)"
+
+
+def test_release_leaves_nothing_behind(sessions):
+    from main import release_thread
+    from scratch import get_scratch_manager
+
+    graph, threads = sessions["graph"], sessions["threads"]
+    before = leftovers(graph, threads)
+    assert (before["threads"], before["scratch"]) == (SESSIONS, SESSIONS)
+
+    for thread_id in threads:
+        release_thread(graph, thread_id)
+    assert leftovers(graph, threads) == {"threads": 0, "tokens": 0, "scratch": 0}
+    assert get_scratch_manager().stats()["referenced"] == 0